@@ -39,12 +39,11 @@ INSTALLED_APPS = (
     'django.contrib.staticfiles',
     'django.contrib.humanize',
 
-    'el_pagination',
-
     'youtube',
 )
 
 MIDDLEWARE = (
+    'youtube.profiling.ProfilingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -77,6 +76,48 @@ if 'DATABASE_URL' in os.environ:
     )
 
 
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+# CACHE_BACKEND is one of 'locmem' (default), 'file' or 'db', the location is
+# a directory for 'file' and a table name for 'db'. The table for the 'db'
+# backend is created by: `python manage.py createcachetable`
+
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'locmem')
+CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'youtube',
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get(
+            'CACHE_LOCATION', os.path.join(BASE_DIR, 'cache')),
+    },
+    'db': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'youtube_cache'),
+    },
+}
+CACHES = {
+    'default': CACHE_BACKENDS[CACHE_BACKEND],
+}
+# Responses from the Youtube API are kept between runs, so they are stored in
+# the database or on disk, never in local memory.
+if CACHE_BACKEND == 'db':
+    CACHES['api'] = dict(CACHE_BACKENDS['db'], KEY_PREFIX='api')
+else:
+    CACHES['api'] = dict(CACHE_BACKENDS['file'], LOCATION=os.path.join(
+        CACHE_BACKENDS['file']['LOCATION'], 'api'))
+CACHES['api']['OPTIONS'] = {'MAX_ENTRIES': 100000}
+# The rendered video tiles of the feeds are kept in the memory of each
+# process, they're invalidated by a generation kept in the default cache.
+CACHES['template_fragments'] = {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'youtube-fragments',
+    'OPTIONS': {'MAX_ENTRIES': 10000},
+}
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.7/topics/i18n/
 
@@ -141,6 +182,21 @@ LOGGING = {
             'level': 'DEBUG',
             'propagate': True,
         },
+        'youtube.management.commands.update_channel_counters': {
+            'handlers': ['stdout'],
+            'level': 'DEBUG',
+            'propagate': True,
+        },
+        'youtube.management.commands.process_jobs': {
+            'handlers': ['stdout'],
+            'level': 'DEBUG',
+            'propagate': True,
+        },
+        'youtube.profiling': {
+            'handlers': ['stdout'],
+            'level': 'DEBUG',
+            'propagate': True,
+        },
     },
 }
 
@@ -150,3 +206,78 @@ LOGIN_URL = '/login/'
 # Put your youtube API key here, it will be used in all API calls to the
 # Youtube API.
 YOUTUBE_API_KEY = os.environ.get('YOUTUBE_API_KEY')
+
+# Settings for the HTTP session shared by all calls to the Youtube API. The
+# pool size should be at least the number of threads doing API calls.
+YOUTUBE_API_POOL_SIZE = int(os.environ.get('YOUTUBE_API_POOL_SIZE', 10))
+YOUTUBE_API_TIMEOUT = float(os.environ.get('YOUTUBE_API_TIMEOUT', 30))
+YOUTUBE_API_KEEP_ALIVE = True
+YOUTUBE_API_GZIP = True
+# Dotted path to a requests transport adapter class, used instead of doing
+# real HTTP requests against the API (for tests and benchmarks).
+YOUTUBE_API_ADAPTER = os.environ.get('YOUTUBE_API_ADAPTER')
+# The dataset served by 'youtube.fakeapi.FakeYoutubeAdapter', a synthetic one
+# or the responses recorded in the FIXTURES directory by
+# 'youtube.fakeapi.RecordingAdapter'.
+YOUTUBE_FAKE_API = {
+    'CHANNELS': int(os.environ.get('YOUTUBE_FAKE_API_CHANNELS', 100)),
+    'VIDEOS_PER_CHANNEL': int(
+        os.environ.get('YOUTUBE_FAKE_API_VIDEOS_PER_CHANNEL', 500)),
+    'CATEGORIES': 10,
+    'PAGE_SIZE': 50,
+    'LATENCY': float(os.environ.get('YOUTUBE_FAKE_API_LATENCY', 0)),
+    'FIXTURES': os.environ.get('YOUTUBE_FAKE_API_FIXTURES'),
+}
+# The cache (in CACHES) used for storing ETags and responses from the API, to
+# make conditional requests. Set to None to disable conditional requests.
+YOUTUBE_API_ETAG_CACHE = 'api'
+YOUTUBE_API_ETAG_TIMEOUT = 30 * 24 * 60 * 60
+# The number of quota units available per day, `update_channels
+# --quota-budget` never plans to use more than what is left of it. The usage
+# is recorded per day in TIME_ZONE, while Google resets the quota at midnight
+# Pacific Time.
+YOUTUBE_API_DAILY_QUOTA = int(os.environ.get('YOUTUBE_API_DAILY_QUOTA', 10000))
+
+# Channels are refreshed by `update_channels --due` after a fraction (the
+# factor) of the average time between their latest uploads, or the time since
+# the latest upload if longer, within the min and max intervals in seconds.
+YOUTUBE_REFRESH_UPLOADS = 10
+YOUTUBE_REFRESH_FACTOR = 4
+YOUTUBE_REFRESH_MIN_INTERVAL = 60 * 60
+YOUTUBE_REFRESH_MAX_INTERVAL = 2 * 24 * 60 * 60
+
+# Jobs running for longer than this many seconds are assumed to be left behind
+# by a dead `process_jobs` worker, and are claimed again.
+YOUTUBE_JOB_TIMEOUT = 60 * 60
+
+# Profiling of the views by 'youtube.profiling.ProfilingMiddleware', disabled
+# unless the YOUTUBE_PROFILING environ variable is set. Responses of the views
+# get a Server-Timing header, and a fraction (the sample rate) of the requests
+# slower than the threshold in milliseconds is logged with its slowest queries.
+YOUTUBE_PROFILING = 'YOUTUBE_PROFILING' in os.environ
+YOUTUBE_PROFILING_VIEWS = ['index', 'channel', 'admin']
+YOUTUBE_PROFILING_SAMPLE_RATE = float(
+    os.environ.get('YOUTUBE_PROFILING_SAMPLE_RATE', 0.1))
+YOUTUBE_PROFILING_SLOW_REQUEST = float(
+    os.environ.get('YOUTUBE_PROFILING_SLOW_REQUEST', 500))
+YOUTUBE_PROFILING_TOP_QUERIES = 5
+
+# Metrics of the ingest and the API client are served in the Prometheus text
+# format at /metrics, if a token is set it has to be sent by the scraper in an
+# "Authorization: Bearer <token>" header. The metrics of the commands are added
+# up in the database.
+YOUTUBE_METRICS_TOKEN = os.environ.get('YOUTUBE_METRICS_TOKEN')
+
+# Pages of the feeds are cached for anonymous users, for the number of seconds
+# given (which is how old the relative upload times shown may get), 0
+# disables the cache. Cached pages and video tiles are invalidated when videos
+# or channels change.
+YOUTUBE_PAGE_CACHE_TIMEOUT = int(
+    os.environ.get('YOUTUBE_PAGE_CACHE_TIMEOUT', 60))
+# The channel lists of the navigation bar and the video tiles are invalidated
+# in the default cache, which with 'locmem' is not seen by the other processes
+# (the commands and other web workers), so they're only cached for a minute
+# then.
+YOUTUBE_CHANNELS_CACHE_TIMEOUT = 60 if CACHE_BACKEND == 'locmem' else 60 * 60
+YOUTUBE_FRAGMENT_CACHE_TIMEOUT = (
+    60 if CACHE_BACKEND == 'locmem' else 24 * 60 * 60)
@@ -3,12 +3,16 @@ from __future__ import unicode_literals
 from django.conf.urls import url
 from django.contrib.auth import views as auth_views
 
-from youtube import views
+from youtube import feeds, views
 
 urlpatterns = [
     url(r'^$', views.index, name='index'),
+    url(r'^feed.xml$', feeds.video_feed, name='feed'),
+    url(r'^channel/(?P<author>.+)/feed.xml$', feeds.video_feed,
+        name='channel-feed'),
     url(r'^channel/(?P<author>.+)/$', views.channel, name='channel'),
     url(r'^admin/$', views.admin, name='admin'),
+    url(r'^metrics$', views.prometheus_metrics, name='metrics'),
     url(r'^admin/(?P<channelid>\d+)/delete/$', views.channel_delete,
         name='channel-delete'),
     url(r'^admin/(?P<channelid>\d+)/toggle-hidden/$',
@@ -0,0 +1,130 @@
+'''
+Keys and invalidation for data cached in the default cache.
+'''
+from __future__ import unicode_literals
+import functools
+import hashlib
+import time
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.db import transaction
+
+from .profiling import record_cache
+
+# The lists of visible/hidden channels, shown in the navigation bar, cached for
+# `YOUTUBE_CHANNELS_CACHE_TIMEOUT` seconds.
+VISIBLE_CHANNELS_KEY = 'youtube:channels:visible'
+HIDDEN_CHANNELS_KEY = 'youtube:channels:hidden'
+# The generation of the feeds, part of the keys of the cached pages and video
+# tiles, see `feed_generation`.
+FEED_GENERATION_KEY = 'youtube:feeds:generation'
+PAGE_KEY = 'youtube:page:%s:%s'
+
+
+def get_or_set(key, default, timeout=None):
+    '''
+    Returns the value cached under the key, if it's not cached default is
+    called and the result is cached, by default for
+    `YOUTUBE_CHANNELS_CACHE_TIMEOUT` seconds.
+    '''
+    value = cache.get(key)
+    record_cache(hit=value is not None)
+    if value is None:
+        value = default()
+        if timeout is None:
+            timeout = settings.YOUTUBE_CHANNELS_CACHE_TIMEOUT
+        cache.add(key, value, timeout)
+    return value
+
+
+def invalidate_channels():
+    '''
+    Removes the cached channel lists, should be called when a channel is
+    added, deleted or changed.
+
+    The lists are removed right away as well as when the current transaction
+    commits, so a request that runs in between does not cache stale data.
+    '''
+    def invalidate():
+        cache.delete_many([VISIBLE_CHANNELS_KEY, HIDDEN_CHANNELS_KEY])
+
+    invalidate()
+    transaction.on_commit(invalidate)
+    # The channel lists are part of the cached pages.
+    invalidate_feeds()
+
+
+def feed_generation():
+    '''
+    Returns the current generation of the feeds. Cached pages and video
+    tiles are keyed by it, so they are invalidated all at once by
+    `invalidate_feeds`.
+    '''
+    generation = cache.get(FEED_GENERATION_KEY)
+    if generation is None:
+        # Start from the current time, so pages cached before the generation
+        # was evicted from the cache are never used again.
+        cache.add(FEED_GENERATION_KEY, int(time.time() * 1000), None)
+        generation = cache.get(FEED_GENERATION_KEY)
+    return generation
+
+
+def invalidate_feeds():
+    '''
+    Bumps the generation of the feeds, should be called when videos are
+    added, changed or deleted.
+
+    Like `invalidate_channels` this is done right away as well as when the
+    current transaction commits.
+    '''
+    def invalidate():
+        try:
+            cache.incr(FEED_GENERATION_KEY)
+        except ValueError:
+            # Not cached, `feed_generation` starts a new generation.
+            pass
+
+    invalidate()
+    transaction.on_commit(invalidate)
+
+
+def cache_anonymous_page(view):
+    '''
+    Decorator caching the responses of a feed view for anonymous users, by
+    the generation of the feeds and the full URL (with the query and page),
+    for `YOUTUBE_PAGE_CACHE_TIMEOUT` seconds.
+
+    The relative upload times on the page are at most that old, the rest of
+    the page is invalidated along with the generation.
+    '''
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        timeout = settings.YOUTUBE_PAGE_CACHE_TIMEOUT
+        if (not timeout or request.method not in ('GET', 'HEAD') or
+                request.user.is_authenticated or
+                len(messages.get_messages(request))):
+            return view(request, *args, **kwargs)
+
+        key = PAGE_KEY % (feed_generation(), hashlib.md5(
+            request.build_absolute_uri().encode('utf-8')).hexdigest())
+        response = cache.get(key)
+        record_cache(hit=response is not None)
+        if response is not None:
+            # The validators are computed again for each request.
+            for header in ('ETag', 'Last-Modified'):
+                del response[header]
+            return response
+
+        def set_response(response):
+            if response.status_code == 200 and not response.cookies:
+                cache.set(key, response, timeout)
+
+        response = view(request, *args, **kwargs)
+        if callable(getattr(response, 'render', None)):
+            response.add_post_render_callback(set_response)
+        else:
+            set_response(response)
+        return response
+    return wrapper
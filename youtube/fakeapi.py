@@ -0,0 +1,303 @@
+'''
+Offline stand-in for the Youtube API, as transport adapters for requests.
+
+`FakeYoutubeAdapter` serves channels, playlist items, videos and video
+categories from a synthetic dataset, or replays responses recorded by
+`RecordingAdapter`, without network access or quota. Select it by setting
+`YOUTUBE_API_ADAPTER` to 'youtube.fakeapi.FakeYoutubeAdapter', the dataset
+is configured by the `YOUTUBE_FAKE_API` setting:
+
+- CHANNELS: the number of channels, with ids UCfake000000, UCfake000001...
+  and usernames fake0, fake1...
+- VIDEOS_PER_CHANNEL: the number of videos uploaded by each channel.
+- CATEGORIES: the number of video categories.
+- PAGE_SIZE: the max number of playlist items per page.
+- LATENCY: seconds to wait before each response.
+- FIXTURES: a directory of recorded responses to replay instead.
+'''
+from __future__ import unicode_literals
+import datetime
+import hashlib
+import json
+import os
+import re
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+# All uploads are made before this time, so the dataset never changes.
+UPLOADED_BEFORE = datetime.datetime(2020, 1, 1)
+
+CHANNEL_RE = re.compile(r'^UCfake(\d{6})$')
+PLAYLIST_RE = re.compile(r'^UUfake(\d{6})$')
+VIDEO_RE = re.compile(r'^fake(\d{6})v(\d{6})$')
+USERNAME_RE = re.compile(r'^fake(\d+)$')
+
+REASONS = {
+    200: 'OK',
+    304: 'Not Modified',
+    404: 'Not Found',
+}
+
+
+def _split_request(request):
+    '''
+    Returns the endpoint and the parameters (without the API key) of a
+    request against the API.
+    '''
+    url = urlsplit(request.url)
+    params = dict(parse_qsl(url.query))
+    params.pop('key', None)
+    return url.path.rstrip('/').rsplit('/', 1)[-1], params
+
+
+def fixture_path(directory, request):
+    '''
+    Returns the path of the recorded response for a request, in the
+    directory of fixtures.
+    '''
+    endpoint, params = _split_request(request)
+    return os.path.join(directory, endpoint, '%s.json' % hashlib.sha1(
+        json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest())
+
+
+def _response(request, status_code, data=None, headers=None):
+    resp = requests.Response()
+    resp.status_code = status_code
+    resp.reason = REASONS[status_code]
+    resp.headers = CaseInsensitiveDict(headers or {})
+    resp.encoding = 'utf-8'
+    resp.url = request.url
+    resp.request = request
+    resp._content = b''
+    if data is not None:
+        resp.headers['Content-Type'] = 'application/json; charset=UTF-8'
+        resp._content = json.dumps(data).encode('utf-8')
+    return resp
+
+
+class FakeDataset(object):
+    '''
+    Synthetic dataset of channels and videos, generated on the fly.
+    '''
+    def __init__(self, channels=100, videos_per_channel=500, categories=10,
+                 page_size=50):
+        self.channels = channels
+        self.videos_per_channel = videos_per_channel
+        self.categories = categories
+        self.page_size = page_size
+
+    def _channel_number(self, regex, value):
+        match = regex.match(value or '')
+        if match and int(match.group(1)) < self.channels:
+            return int(match.group(1))
+
+    def channels_list(self, params):
+        if 'forUsername' in params:
+            match = USERNAME_RE.match(params['forUsername'])
+            numbers = [int(match.group(1))] if match else []
+            numbers = [e for e in numbers if e < self.channels]
+        else:
+            numbers = [
+                self._channel_number(CHANNEL_RE, channelid)
+                for channelid in params.get('id', '').split(',')]
+        items = [
+            self.channel(number) for number in numbers if number is not None]
+        return {
+            'kind': 'youtube#channelListResponse',
+            'pageInfo': {
+                'totalResults': len(items),
+                'resultsPerPage': len(items),
+            },
+            'items': items,
+        }
+
+    def channel(self, number):
+        return {
+            'kind': 'youtube#channel',
+            'id': 'UCfake%06d' % number,
+            'snippet': {
+                'title': 'Fake channel %d' % number,
+                'description': 'Synthetic channel number %d' % number,
+                'thumbnails': {
+                    'default': {
+                        'url': 'https://example.com/fake%d.jpg' % number,
+                    },
+                },
+            },
+            'contentDetails': {
+                'relatedPlaylists': {
+                    'uploads': 'UUfake%06d' % number,
+                },
+            },
+        }
+
+    def playlist_items_list(self, params):
+        number = self._channel_number(PLAYLIST_RE, params.get('playlistId'))
+        if number is None:
+            return None
+        page_size = min(int(params.get('maxResults', 5)), self.page_size)
+        start = int(params.get('pageToken') or 0)
+        end = min(start + page_size, self.videos_per_channel)
+        data = {
+            'kind': 'youtube#playlistItemListResponse',
+            'pageInfo': {
+                'totalResults': self.videos_per_channel,
+                'resultsPerPage': page_size,
+            },
+            'items': [{
+                'kind': 'youtube#playlistItem',
+                'contentDetails': {
+                    'videoId': 'fake%06dv%06d' % (number, index),
+                },
+            } for index in range(start, end)],
+        }
+        if end < self.videos_per_channel:
+            data['nextPageToken'] = str(end)
+        return data
+
+    def videos_list(self, params):
+        items = []
+        for videoid in params.get('id', '').split(','):
+            match = VIDEO_RE.match(videoid)
+            if match is None:
+                continue
+            number, index = int(match.group(1)), int(match.group(2))
+            if number < self.channels and index < self.videos_per_channel:
+                items.append(self.video(number, index))
+        return {
+            'kind': 'youtube#videoListResponse',
+            'pageInfo': {
+                'totalResults': len(items),
+                'resultsPerPage': len(items),
+            },
+            'items': items,
+        }
+
+    def video(self, number, index):
+        # Channels upload every 1 to 48 hours, newest video first.
+        uploaded = UPLOADED_BEFORE - datetime.timedelta(
+            hours=(index + 1) * (number % 48 + 1))
+        videoid = 'fake%06dv%06d' % (number, index)
+        seed = number * 7919 + index
+        return {
+            'kind': 'youtube#video',
+            'id': videoid,
+            'snippet': {
+                'publishedAt': uploaded.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+                'channelId': 'UCfake%06d' % number,
+                'title': 'Fake video %d of channel %d' % (index, number),
+                'description': 'Synthetic video %s, about topic %d' % (
+                    videoid, seed % 97),
+                'categoryId': str(seed % self.categories + 1),
+            },
+            'contentDetails': {
+                'duration': 'PT%dM%dS' % (seed % 60, seed % 59),
+            },
+            'statistics': {
+                'viewCount': str(seed * 31 % 1000000),
+                'favoriteCount': '0',
+            },
+        }
+
+    def video_categories_list(self, params):
+        items = [{
+            'kind': 'youtube#videoCategory',
+            'id': categoryid,
+            'snippet': {
+                'title': 'Fake category %s' % categoryid,
+            },
+        } for categoryid in params.get('id', '').split(',')
+            if categoryid.isdigit() and
+            0 < int(categoryid) <= self.categories]
+        return {
+            'kind': 'youtube#videoCategoryListResponse',
+            'items': items,
+        }
+
+    def get(self, endpoint, params):
+        '''
+        Returns the response data for a request, or None if not found.
+        '''
+        handler = {
+            'channels': self.channels_list,
+            'playlistItems': self.playlist_items_list,
+            'videos': self.videos_list,
+            'videoCategories': self.video_categories_list,
+        }.get(endpoint)
+        if handler is not None:
+            return handler(params)
+
+
+class FakeYoutubeAdapter(BaseAdapter):
+    '''
+    Transport adapter answering requests against the Youtube API from a
+    synthetic dataset, or from recorded fixtures, see the module docstring.
+
+    Responses have an ETag and requests with a matching If-None-Match header
+    get a 304, like the real API.
+    '''
+    def __init__(self, **options):
+        super(FakeYoutubeAdapter, self).__init__()
+        options = dict(settings.YOUTUBE_FAKE_API, **options)
+        self.latency = options.get('LATENCY', 0)
+        self.fixtures = options.get('FIXTURES')
+        self.dataset = FakeDataset(
+            channels=options.get('CHANNELS', 100),
+            videos_per_channel=options.get('VIDEOS_PER_CHANNEL', 500),
+            categories=options.get('CATEGORIES', 10),
+            page_size=options.get('PAGE_SIZE', 50),
+        )
+
+    def send(self, request, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+
+        if self.fixtures:
+            data = self._replay(request)
+        else:
+            data = self.dataset.get(*_split_request(request))
+        if data is None:
+            return _response(request, 404, {
+                'error': {'code': 404, 'message': 'Not found'}})
+
+        body = json.dumps(data, sort_keys=True).encode('utf-8')
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        if request.headers.get('If-None-Match') == etag:
+            return _response(request, 304, headers={'ETag': etag})
+        return _response(request, 200, data, headers={'ETag': etag})
+
+    def _replay(self, request):
+        try:
+            with open(fixture_path(self.fixtures, request)) as f:
+                return json.load(f)
+        except IOError:
+            return None
+
+    def close(self):
+        pass
+
+
+class RecordingAdapter(HTTPAdapter):
+    '''
+    Transport adapter doing real requests against the API, while recording
+    the successful responses in the `FIXTURES` directory of the
+    `YOUTUBE_FAKE_API` setting, for replaying with `FakeYoutubeAdapter`.
+    '''
+    def __init__(self, fixtures=None, **kwargs):
+        super(RecordingAdapter, self).__init__(**kwargs)
+        self.fixtures = fixtures or settings.YOUTUBE_FAKE_API['FIXTURES']
+
+    def send(self, request, **kwargs):
+        resp = super(RecordingAdapter, self).send(request, **kwargs)
+        if resp.status_code == 200:
+            path = fixture_path(self.fixtures, request)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                json.dump(resp.json(), f, indent=2, sort_keys=True)
+        return resp
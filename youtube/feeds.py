@@ -0,0 +1,81 @@
+'''
+Atom feeds of the newest videos, for feed readers.
+'''
+from __future__ import unicode_literals
+
+from django.contrib.syndication.views import Feed
+from django.urls import reverse
+from django.utils.feedgenerator import Atom1Feed
+
+from .views import channel_videos, feed_view, index_videos
+
+# The number of videos in a feed.
+FEED_SIZE = 50
+
+
+class VideoFeed(Feed):
+    '''
+    The newest videos of the index, or of a channel if an author is given,
+    matching the search query (`q`) if any.
+    '''
+    feed_type = Atom1Feed
+
+    def __call__(self, request, *args, **kwargs):
+        response = super(VideoFeed, self).__call__(request, *args, **kwargs)
+        # The feed sets the date of the newest video, while `feed_view`
+        # checks (and sets) the validators of the channels.
+        del response['Last-Modified']
+        return response
+
+    def get_object(self, request, author=None):
+        if author is None:
+            channel, videos = None, index_videos(request)
+        else:
+            channel, videos = channel_videos(request, author)
+        return {
+            'channel': channel,
+            'videos': videos,
+            'query': request.GET.get('q', ''),
+        }
+
+    def title(self, obj):
+        title = 'New youtube videos'
+        if obj['channel'] is not None:
+            title = 'New videos from %s' % (
+                obj['channel'].title or obj['channel'].author)
+        if obj['query']:
+            title = '%s matching "%s"' % (title, obj['query'])
+        return title
+
+    def link(self, obj):
+        if obj['channel'] is None:
+            return reverse('index')
+        return reverse('channel', kwargs={'author': obj['channel'].author})
+
+    def subtitle(self, obj):
+        return 'Aggregating youtube videos since 2015'
+
+    def items(self, obj):
+        return obj['videos'][:FEED_SIZE]
+
+    def item_title(self, item):
+        return item.title
+
+    def item_description(self, item):
+        return item.description
+
+    def item_link(self, item):
+        return item.url
+
+    def item_author_name(self, item):
+        return item.uploader.title or item.uploader.author
+
+    def item_pubdate(self, item):
+        return item.uploaded
+
+    def item_updateddate(self, item):
+        return item.updated
+
+
+# Feeds have no relative upload times, they only change with the videos.
+video_feed = feed_view(VideoFeed(), relative_times=False)
@@ -0,0 +1,271 @@
+from __future__ import unicode_literals
+import datetime
+import html
+import json
+import math
+import re
+import time
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from ...fakeapi import FakeYoutubeAdapter
+from ...models import Category, Channel, Video
+from ...youtubeapi import create_session, set_session
+
+# Words used for titles and descriptions of the seeded videos, and searched
+# for by the search benchmark.
+WORDS = [
+    'music', 'live', 'cooking', 'review', 'tutorial', 'python', 'django',
+    'travel', 'vlog', 'news', 'gaming', 'trailer', 'science', 'history',
+    'guitar', 'football', 'podcast', 'interview', 'unboxing', 'highlights',
+]
+SEARCHES = ['music', 'cooking review', 'pyth', 'nothing matches this']
+# The link to the next page of a feed.
+NEXT_URL_RE = re.compile(r'<li class="next">\s*<a href="([^"]+)"')
+
+
+def percentile(values, percent):
+    '''
+    Returns the percentile of the values, using the nearest-rank method.
+    '''
+    values = sorted(values)
+    rank = int(math.ceil(percent / 100.0 * len(values)))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+def measure(func):
+    '''
+    Calls func, returning the time it took in milliseconds and the number of
+    database queries made.
+    '''
+    with CaptureQueriesContext(connection) as queries:
+        start = time.time()
+        func()
+        elapsed = (time.time() - start) * 1000
+    return elapsed, len(queries.captured_queries)
+
+
+class Command(BaseCommand):
+    help = ('Seeds a throwaway database with a synthetic dataset and '
+            'measures ingest, feed rendering, search and the admin page.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--channels', type=int, default=50,
+                            help='Number of channels to seed.')
+        parser.add_argument('--videos', type=int, default=2000,
+                            help='Number of videos to seed per channel.')
+        parser.add_argument('--categories', type=int, default=10,
+                            help='Number of categories to seed.')
+        parser.add_argument('--ingest-channels', type=int, default=3,
+                            help='Number of channels to ingest from the fake '
+                                 'API.')
+        parser.add_argument('--ingest-videos', type=int, default=500,
+                            help='Number of videos per ingested channel.')
+        parser.add_argument('--pages', type=int, default=5,
+                            help='Number of feed pages to walk through.')
+        parser.add_argument('--repeat', type=int, default=10,
+                            help='Number of times to repeat each request.')
+        parser.add_argument('--save', metavar='PATH',
+                            help='Save the results as a baseline.')
+        parser.add_argument('--compare', metavar='PATH',
+                            help='Compare the results to a saved baseline.')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed slowdown of the p50 compared to '
+                                 'the baseline, as a fraction.')
+
+    def handle(self, *args, **options):
+        # Never touch the real database, the test database is created from
+        # scratch using the migrations and destroyed afterwards.
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            # Measure the rendering of the pages, not the page cache.
+            with override_settings(
+                    ALLOWED_HOSTS=['testserver'],
+                    YOUTUBE_API_ETAG_CACHE=None,
+                    YOUTUBE_PAGE_CACHE_TIMEOUT=0):
+                for cache in caches.all():
+                    cache.clear()
+                results = self.run_benchmarks(options)
+        finally:
+            set_session(None)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.report(results)
+        if options.get('save'):
+            with open(options['save'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+        if options.get('compare'):
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+            self.compare(results, baseline, options.get('tolerance'))
+
+    def run_benchmarks(self, options):
+        start = time.time()
+        channels = self.seed(options)
+        self.stdout.write('Seeded %s videos in %.1f seconds' % (
+            Video.objects.count(), time.time() - start))
+
+        results = {}
+        results['ingest'] = self.benchmark_ingest(options)
+
+        client = Client()
+        repeat = options.get('repeat')
+        results['index'] = self.benchmark_feed(
+            client, reverse('index'), options.get('pages'), repeat)
+        results['channel'] = self.benchmark_feed(
+            client, reverse('channel', kwargs={'author': channels[0].author}),
+            options.get('pages'), repeat)
+        results['search'] = self.summarize([
+            measure(lambda: list(
+                Video.objects.exclude_deleted().text_search(
+                    query)[:72]))
+            for query in SEARCHES for _ in range(repeat)])
+        results['search_ranked'] = self.summarize([
+            measure(lambda: list(
+                Video.objects.exclude_deleted().text_search(
+                    query, ranked=True)[:72]))
+            for query in SEARCHES for _ in range(repeat)])
+
+        client.force_login(User.objects.create_superuser(
+            'benchmark', '', 'benchmark'))
+        results['admin'] = self.summarize([
+            measure(lambda: self.get(client, reverse('admin')))
+            for _ in range(repeat)])
+        return results
+
+    def seed(self, options):
+        Category.objects.bulk_create([
+            Category(id=idx + 1, category='Category %d' % (idx + 1))
+            for idx in range(options.get('categories'))])
+        Channel.objects.bulk_create([
+            Channel(
+                channelid='seed%06d' % idx, author='seed%d' % idx,
+                title='Seeded channel %d' % idx,
+                uploads_playlist='seeduploads%06d' % idx)
+            for idx in range(options.get('channels'))])
+        channels = list(Channel.objects.order_by('id'))
+
+        now = timezone.now()
+        for number, channel in enumerate(channels):
+            videos = []
+            for index in range(options.get('videos')):
+                seed = number * 7919 + index
+                uploaded = now - datetime.timedelta(
+                    hours=index * (number % 48 + 1), minutes=number)
+                videos.append(Video(
+                    youtubeid='seed%06dv%06d' % (number, index),
+                    uploader=channel,
+                    category_id=seed % options.get('categories') + 1,
+                    title='%s %s %d' % (
+                        WORDS[seed % len(WORDS)],
+                        WORDS[seed * 7 % len(WORDS)], index),
+                    description=' '.join(
+                        WORDS[(seed + e) * 13 % len(WORDS)]
+                        for e in range(12)),
+                    duration=seed % 3600,
+                    view_count=seed * 31 % 1000000,
+                    deleted=seed % 50 == 0,
+                    uploaded=uploaded,
+                    updated=uploaded,
+                ))
+            # Leave the batch size to Django, SQLite limits the size of
+            # the INSERTs.
+            Video.objects.bulk_create(videos)
+        Channel.objects.all().update_counters()
+        return channels
+
+    def benchmark_ingest(self, options):
+        count = options.get('ingest_channels')
+        set_session(create_session(FakeYoutubeAdapter(
+            CHANNELS=count,
+            VIDEOS_PER_CHANNEL=options.get('ingest_videos'),
+            CATEGORIES=options.get('categories'),
+            LATENCY=0,
+            FIXTURES=None,
+        )))
+        channels = Channel.objects.filter(pk__in=[
+            Channel.objects.create(
+                channelid='UCfake%06d' % idx, author='fake%d' % idx).pk
+            for idx in range(count)])
+        channels.update_channel_info()
+
+        timings = []
+        for channel in channels:
+            timings.append(measure(
+                lambda: channel.fetch_videos(full_fetch=True)))
+        # Fetching again, with all the videos known and unchanged.
+        for channel in channels:
+            timings.append(measure(
+                lambda: channel.fetch_videos(full_fetch=True)))
+        return self.summarize(timings)
+
+    def benchmark_feed(self, client, url, pages, repeat):
+        '''
+        Walks through the pages of the feed, following the links to the
+        older videos, measuring each page. Each walk starts without cached
+        video tiles.
+        '''
+        timings = []
+        for _ in range(repeat):
+            caches['template_fragments'].clear()
+            page_url = url
+            for _ in range(pages):
+                response = []
+                timings.append(measure(
+                    lambda: response.append(self.get(client, page_url))))
+                match = NEXT_URL_RE.search(response[0].content.decode('utf-8'))
+                if match is None:
+                    break
+                page_url = url + html.unescape(match.group(1))
+        return self.summarize(timings)
+
+    def get(self, client, url):
+        response = client.get(url)
+        if response.status_code != 200:
+            raise CommandError('Got %s from %s' % (
+                response.status_code, url))
+        return response
+
+    def summarize(self, timings):
+        elapsed = [e for e, _ in timings]
+        return {
+            'count': len(timings),
+            'p50': percentile(elapsed, 50),
+            'p95': percentile(elapsed, 95),
+            'p99': percentile(elapsed, 99),
+            'queries': max(queries for _, queries in timings),
+        }
+
+    def report(self, results):
+        self.stdout.write('%-14s %6s %10s %10s %10s %8s' % (
+            'benchmark', 'count', 'p50 ms', 'p95 ms', 'p99 ms', 'queries'))
+        for name, result in sorted(results.items()):
+            self.stdout.write('%-14s %6d %10.2f %10.2f %10.2f %8d' % (
+                name, result['count'], result['p50'], result['p95'],
+                result['p99'], result['queries']))
+
+    def compare(self, results, baseline, tolerance):
+        regressions = []
+        for name, result in sorted(results.items()):
+            if name not in baseline:
+                continue
+            before = baseline[name]
+            change = (
+                (result['p50'] - before['p50']) / max(before['p50'], 0.001))
+            self.stdout.write('%-14s p50 %+7.1f%%, queries %d -> %d' % (
+                name, change * 100, before['queries'], result['queries']))
+            if change > tolerance or result['queries'] > before['queries']:
+                regressions.append(name)
+        if regressions:
+            raise CommandError(
+                'Regressions compared to the baseline: %s' % (
+                    ', '.join(regressions)))
@@ -0,0 +1,39 @@
+from __future__ import unicode_literals
+import timeit
+
+import dateutil.parser
+import isodate
+from django.core.management import BaseCommand
+
+from ...parsers import parse_datetime, parse_duration
+
+# Typical values as returned by the API.
+DURATIONS = ['PT3M40S', 'PT1H2M3S', 'PT59S', 'P1DT2H', 'P0D']
+DATETIMES = ['2014-01-01T12:00:00Z', '2019-12-31T23:59:59.000Z']
+
+
+def _isodate_duration(value):
+    return int(isodate.parse_duration(value).total_seconds())
+
+
+class Command(BaseCommand):
+    help = ('Compares the speed of the fast parsers for durations and '
+            'timestamps to the generic parsers of isodate and dateutil.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--number', dest='number', type=int,
+                            default=10000,
+                            help='Number of times to parse each value.')
+
+    def handle(self, *args, **options):
+        number = options.get('number')
+        for name, func, values in [
+                ('parse_duration', parse_duration, DURATIONS),
+                ('isodate.parse_duration', _isodate_duration, DURATIONS),
+                ('parse_datetime', parse_datetime, DATETIMES),
+                ('dateutil.parser.parse', dateutil.parser.parse, DATETIMES),
+        ]:
+            seconds = timeit.timeit(
+                lambda: [func(value) for value in values], number=number)
+            self.stdout.write('%-24s %8.2f us per value' % (
+                name, seconds / (number * len(values)) * 1000000))
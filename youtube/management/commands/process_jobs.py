@@ -0,0 +1,48 @@
+from __future__ import unicode_literals
+import logging
+import time
+
+from django.core.management import BaseCommand
+from django.db import connection
+
+from ... import metrics
+from ...models import Job
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Runs the fetches queued from the admin, in the background.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', dest='once', action='store_true',
+                            help='Exit when there are no more queued jobs.')
+        parser.add_argument('--sleep', dest='sleep', type=float, default=5,
+                            help='Seconds to wait between checking for new '
+                                 'jobs.')
+
+    def handle(self, *args, **options):
+        logger.info('Starting')
+        while True:
+            job = Job.objects.claim()
+            if job is None:
+                if options.get('once'):
+                    break
+                # Don't keep an idle connection open while waiting.
+                connection.close()
+                time.sleep(options.get('sleep'))
+                continue
+
+            logger.info('Running %s of channel: %s',
+                        job.get_kind_display(), job.channel.author)
+            start = time.time()
+            job.run()
+            metrics.CHANNEL_SECONDS.observe(time.time() - start)
+            metrics.CHANNEL_LAST_SECONDS.set(
+                time.time() - start, channel=job.channel.author)
+            metrics.save()
+            if job.status == Job.FAILED:
+                logger.error('  failed: %s', job.error)
+            else:
+                logger.info('  fetched %s videos', job.fetched)
+        logger.info('Done')
@@ -0,0 +1,16 @@
+from __future__ import unicode_literals
+import logging
+
+from django.core.management import BaseCommand
+
+from ...models import Channel
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the denormalized video counters on all channels.'
+
+    def handle(self, *args, **options):
+        updated = Channel.objects.all().update_counters()
+        logger.info('Updated video counters on %s channels', updated)
@@ -1,21 +1,157 @@
 from __future__ import unicode_literals
+import itertools
+import json
 import logging
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 import requests
+from django.conf import settings
 from django.core.management import BaseCommand
-from django.db import transaction
+from django.db import connection, transaction
 from django.utils import timezone
 
-from ...models import Channel, Video
+from ... import metrics
+from ...models import ApiUsage, Channel, Video
 
 logger = logging.getLogger(__name__)
 
+# The number of quota units used for fetching a page of videos, one for the
+# page of the uploads playlist and one for the videos on it.
+PAGE_COST = 2
+# The number of channels or videos looked up per quota unit.
+ITEMS_PER_CALL = 50
+# The number of videos checked for being deleted by default, unless only the
+# channels due are fetched (which is done often, so no videos are checked).
+CHECK_DELETED = 500
+
+
+def retry(func, *args, **kwargs):
+    '''
+    Calls func with the given arguments, trying again up to 5 times in total
+    if a request against the Youtube API fails.
+    '''
+    for attempt in range(5):
+        try:
+            return func(*args, **kwargs)
+        except requests.exceptions.RequestException as e:  # pragma: nocover
+            # If we're at the last attempt, raise.
+            if attempt == 4:
+                raise
+
+            # Otherwise try again until 5 attempts have been made.
+            logger.warning('Got exception trying to fetch youtube data')
+            logger.exception(e)
+            try:
+                logger.error('Body: %s', e.response.text)
+            except AttributeError:
+                logger.error('Body: <no request found>')
+            metrics.API_RETRIES.inc()
+            # Wait for a second before trying again.
+            time.sleep(5)
+
+
+def observe_channel(channel, seconds):
+    '''
+    Records the time it took to update the channel in the metrics.
+    '''
+    metrics.CHANNEL_SECONDS.observe(seconds)
+    metrics.CHANNEL_LAST_SECONDS.set(seconds, channel=channel.author)
+
+
+def _calls(count):
+    return (count + ITEMS_PER_CALL - 1) // ITEMS_PER_CALL
+
+
+def plan_budget(channel_count, budget, full_fetch, incremental,
+                check_deleted):
+    '''
+    Plans how to spend a budget of quota units on updating channels.
+
+    The channel info (a unit per 50 channels) and the first page of videos
+    for as many channels as possible comes first, then the deletion check (a
+    unit per 50 videos). The rest is spread evenly over the channels as extra
+    pages, when doing full or incremental fetches.
+
+    Returns a (channel count, max pages, check deleted) tuple.
+    '''
+    count = channel_count
+    while count and _calls(count) + count * PAGE_COST > budget:
+        count -= 1
+    remaining = budget - _calls(count) - count * PAGE_COST
+
+    check_deleted = max(0, min(check_deleted, remaining * ITEMS_PER_CALL))
+    remaining -= _calls(check_deleted)
+
+    max_pages = 1
+    if count and (full_fetch or incremental):
+        max_pages += remaining // (count * PAGE_COST)
+    return count, max_pages, check_deleted
+
+
+def update_channel(channel, full_fetch, incremental, max_pages=None):
+    '''
+    Fetches videos for the channel, storing them as we go along. Returns the
+    number of videos fetched.
+    '''
+    # Fetch data about videos on the given channel.
+    fetched = channel.fetch_videos(
+        full_fetch=full_fetch, incremental=incremental, max_pages=max_pages)
+    channel.updated = timezone.now()
+    channel.schedule_refresh()
+    channel.save()
+    return fetched
+
+
+def download_channel(channel, full_fetch, incremental, max_pages=None):
+    '''
+    Fetches pages of videos for the channel from the API, without writing
+    anything to the database.
+
+    Used from worker threads, returns the list of pages to store and the
+    time it took in seconds.
+    '''
+    def download():
+        return list(channel.fetch_video_pages(
+            full_fetch=full_fetch, incremental=incremental,
+            max_pages=max_pages))
+
+    start = time.time()
+    try:
+        return retry(download), time.time() - start
+    finally:
+        # Each thread gets its own database connection, don't leak it.
+        connection.close()
+
 
 class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('-f', '--full', dest='full', action='store_true',
                             help='Do full fetch on all channels.')
+        parser.add_argument('-i', '--incremental', dest='incremental',
+                            action='store_true',
+                            help='Fetch videos until already known videos '
+                                 'are reached.')
+        parser.add_argument('-w', '--workers', dest='workers', type=int,
+                            default=1,
+                            help='Number of channels to fetch in parallel.')
+        parser.add_argument('--check-deleted', dest='check_deleted',
+                            type=int,
+                            help='Number of videos to check for being '
+                                 'deleted, 0 disables the check. Defaults '
+                                 'to %s, or 0 with --due.' % CHECK_DELETED)
+        parser.add_argument('--rotate-deleted', dest='rotate_deleted',
+                            action='store_true',
+                            help='Check the least recently checked videos '
+                                 'instead of the newest, sweeping the whole '
+                                 'library across runs.')
+        parser.add_argument('--quota-budget', dest='quota_budget', type=int,
+                            help='Maximum number of API quota units to use, '
+                                 'the least recently updated channels are '
+                                 'fetched first.')
+        parser.add_argument('--due', dest='due', action='store_true',
+                            help='Only fetch channels that are due for a '
+                                 'refresh, based on how often they upload.')
 
     def handle(self, *args, **options):
         logger.info('Starting')
@@ -25,66 +161,143 @@ class Command(BaseCommand):
         if full_fetch:
             logger.warning('Doing full fetch on all channels, this might take '
                            'a long time.')
+        incremental = options.get('incremental', False)
 
         # Fetch the channels.
         channels = Channel.objects.all()
+        if options.get('due'):
+            channels = channels.due()
         channel_len = len(channels)
 
         if channel_len == 0:
-            logger.warning('There are no channels to update.')
+            if options.get('due'):
+                logger.info('There are no channels due for a refresh.')
+            else:
+                logger.warning('There are no channels to update.')
             return
 
+        check_deleted = options.get('check_deleted')
+        if check_deleted is None:
+            check_deleted = 0 if options.get('due') else CHECK_DELETED
+        max_pages = None
+        units_used = ApiUsage.objects.units_used()
+        quota_budget = options.get('quota_budget')
+        if quota_budget is not None:
+            # Never go beyond what is left of the daily quota.
+            budget = min(
+                quota_budget, settings.YOUTUBE_API_DAILY_QUOTA - units_used)
+            channel_len, max_pages, check_deleted = plan_budget(
+                channel_len, budget, full_fetch, incremental, check_deleted)
+            logger.info('Planned %s channels with at most %s pages each, '
+                        'and checking %s videos, for %s quota units',
+                        channel_len, max_pages, check_deleted, budget)
+            channels = channels.order_by('updated')[:channel_len]
+
+        try:
+            if channel_len:
+                self.update_channels_and_videos(
+                    channels, full_fetch, incremental, max_pages,
+                    options.get('workers') or 1)
+
+            # Check the videos against the API, marking missing ones as
+            # deleted.
+            if check_deleted:
+                logger.info('Marking deleted videos as deleted')
+                videos = Video.objects.exclude_deleted()
+                if options.get('rotate_deleted'):
+                    videos = videos.least_recently_checked()
+                else:
+                    videos = videos.order_by('-id')
+                for youtubeid in retry(videos[:check_deleted].mark_deleted):
+                    logger.info('  Marking %s as deleted', youtubeid)
+        finally:
+            ApiUsage.objects.record()
+            units_used_today = ApiUsage.objects.units_used()
+            logger.info('Used %s quota units, %s units used today',
+                        units_used_today - units_used, units_used_today)
+            logger.info('Metrics: %s', json.dumps(
+                metrics.save(), sort_keys=True))
+
+        # All done
+        logger.info('Done')
+
+    def update_channels_and_videos(
+            self, channels, full_fetch, incremental, max_pages, workers):
+        # Refresh the info of all channels up front, 50 channels per request.
+        # This updates the channel instances, so the uploads playlists are
+        # known when fetching the videos below.
+        logger.info('Updating channel info')
+        changed = retry(channels.update_channel_info)
+        logger.info('  updated info for %s channels', len(changed))
+
+        if workers > 1:
+            self.update_channels_concurrently(
+                channels, full_fetch, incremental, max_pages, workers)
+        else:
+            self.update_channels(channels, full_fetch, incremental, max_pages)
+
+    def update_channels(self, channels, full_fetch, incremental, max_pages):
         # Iterate on each channel, fetching data as we go along.
+        channel_len = len(channels)
         for idx, channel in enumerate(channels):
             logger.info('  [%s/%s] fetching for channel: %s',
                         idx + 1, channel_len, channel.author)
+            start = time.time()
             with transaction.atomic():
-                for attempt in range(5):
-                    try:
-                        # Fetch data for the channel, updating if needed.
-                        channel.update_channel_info()
-                        # Fetch data about videos on the given channel.
-                        fetched = channel.fetch_videos(full_fetch=full_fetch)
-                        channel.updated = timezone.now()
-                        channel.save()
-                    except requests.exceptions.RequestException as e:  # pragma: nocover  # NOQA
-                        # If we're at the last attempt, raise.
-                        if attempt == 4:
-                            raise
-
-                        # Otherwise try again until 5 attempts have been made.
-                        logger.warning(
-                            'Got exception trying to fetch youtube data')
-                        logger.exception(e)
-                        try:
-                            logger.error('Body: %s', e.response.text)
-                        except AttributeError:
-                            logger.error('Body: <no request found>')
-                        # Wait for a second before trying again.
-                        time.sleep(5)
-                    else:
-                        # No exception, proceed with next channel.
-                        break
+                fetched = retry(
+                    update_channel, channel, full_fetch, incremental,
+                    max_pages)
+            observe_channel(channel, time.time() - start)
+            ApiUsage.objects.record()
             logger.info('    fetched %s videos', fetched)
 
-        # Iterate on the last 500 videos, checking HEAD state of thumbnail.
-        logger.info('Marking deleted videos as deleted')
-        for video in Video.objects.exclude_deleted().order_by('-id')[:500]:
-            with transaction.atomic():
-                # Do HTTP HEAD request, to fetch status code without body.
-                resp = requests.head(video.get_thumbnail())
-
-                if resp.status_code == 200:
-                    # The video is still accessible.
-                    continue
-                elif resp.status_code == 404:
-                    # The video has been deleted, mark it as such.
-                    video.deleted = True
-                    video.save()
-                    logger.info('  Marking %s as deleted', video.youtubeid)
-                else:
-                    # WTF, let's see what happens.
-                    resp.raise_for_status()
+    def update_channels_concurrently(
+            self, channels, full_fetch, incremental, max_pages, workers):
+        '''
+        Fetches data for the channels from the API in a pool of worker
+        threads, while storing the results from this thread only. This keeps
+        the database writes serialized, one transaction per channel, which is
+        safe on SQLite as well as postgres.
+        '''
+        channel_len = len(channels)
+        logger.info('Fetching %s channels using %s workers',
+                    channel_len, workers)
+        pending = iter(channels)
+        futures = {}
+        idx = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            def submit(channel):
+                futures[executor.submit(
+                    download_channel, channel, full_fetch, incremental,
+                    max_pages,
+                )] = channel
 
-        # All done
-        logger.info('Done')
+            # Only a couple of channels per worker are downloaded ahead, so
+            # the pages of all the channels are never held in memory. Done
+            # futures are dropped right away, for the same reason.
+            for channel in itertools.islice(pending, workers * 2):
+                submit(channel)
+            while futures:
+                future = next(iter(
+                    wait(futures, return_when=FIRST_COMPLETED).done))
+                channel = futures.pop(future)
+                pages, seconds = future.result()
+                del future
+                channel_next = next(pending, None)
+                if channel_next is not None:
+                    submit(channel_next)
+                idx += 1
+                start = time.time()
+                logger.info('  [%s/%s] storing videos for channel: %s',
+                            idx, channel_len, channel.author)
+                with transaction.atomic():
+                    fetched = 0
+                    for items in pages:
+                        fetched += channel.store_videos(items)
+                    channel.update_counters()
+                    channel.updated = timezone.now()
+                    channel.schedule_refresh()
+                    channel.save()
+                observe_channel(channel, seconds + time.time() - start)
+                ApiUsage.objects.record()
+                logger.info('    fetched %s videos', fetched)
@@ -0,0 +1,322 @@
+'''
+Counters, gauges and histograms of the ingest and the Youtube API client.
+
+Metrics are kept in memory by each process. Commands `save` them at the end
+of a run, adding them to the totals kept in the database (see `MetricValue`),
+which are served in the Prometheus text format by the `metrics` view.
+'''
+from __future__ import unicode_literals
+import json
+import threading
+
+from django.db import transaction
+
+# The upper bounds of the histogram buckets, in seconds.
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# All the metrics, by name.
+REGISTRY = {}
+
+
+def _number(value):
+    '''
+    Returns the number saved as a float as an int, if it is one.
+    '''
+    return int(value) if value == int(value) else value
+
+
+class Metric(object):
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def _key(self, labels):
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def describe(self):
+        return {'type': self.type, 'help': self.help}
+
+    def samples(self, reset=False):
+        with self._lock:
+            samples = [{
+                'labels': dict(zip(self.labels, key)),
+                'value': self._copy(value),
+            } for key, value in sorted(self._values.items())]
+            if reset:
+                self._values = {}
+            return samples
+
+    def _copy(self, value):
+        return value
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+    # Whether the saved values are added to (or replaced).
+    added = True
+
+    def fields(self, value):
+        '''
+        Returns the value of a sample as a dict of numbers by field, as saved.
+        '''
+        return {'value': value}
+
+    def from_fields(self, fields):
+        '''
+        Returns the value of a sample from the saved fields, or None if they
+        are incomplete.
+        '''
+        if 'value' in fields:
+            return _number(fields['value'])
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    @staticmethod
+    def merge(old, new):
+        return old + new
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    @staticmethod
+    def merge(old, new):
+        return new
+
+    added = False
+
+
+class Histogram(Metric):
+    '''
+    Histogram of observed values, the value of each sample is a dict with
+    the count per bucket (not cumulative, the last bucket is +Inf), the sum
+    and the count of the values.
+    '''
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def describe(self):
+        return dict(super(Histogram, self).describe(), buckets=self.buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            data = self._values.setdefault(key, {
+                'buckets': [0] * (len(self.buckets) + 1),
+                'sum': 0,
+                'count': 0,
+            })
+            index = len(self.buckets)
+            for idx, bound in enumerate(self.buckets):
+                if value <= bound:
+                    index = idx
+                    break
+            data['buckets'][index] += 1
+            data['sum'] += value
+            data['count'] += 1
+
+    def _copy(self, value):
+        return dict(value, buckets=list(value['buckets']))
+
+    def fields(self, value):
+        fields = dict(
+            ('bucket:%d' % idx, count)
+            for idx, count in enumerate(value['buckets']))
+        fields.update(sum=value['sum'], count=value['count'])
+        return fields
+
+    def from_fields(self, fields):
+        if 'count' not in fields:
+            return None
+        return {
+            'buckets': [
+                _number(fields.get('bucket:%d' % idx, 0))
+                for idx in range(len(self.buckets) + 1)],
+            'sum': fields.get('sum', 0),
+            'count': _number(fields['count']),
+        }
+
+    @staticmethod
+    def merge(old, new):
+        if len(old['buckets']) != len(new['buckets']):
+            # The buckets changed, start over.
+            return new
+        return {
+            'buckets': [a + b for a, b in zip(old['buckets'], new['buckets'])],
+            'sum': old['sum'] + new['sum'],
+            'count': old['count'] + new['count'],
+        }
+
+
+API_CALLS = Counter(
+    'youtube_api_calls_total',
+    'Calls made to the Youtube API, by endpoint and HTTP status.',
+    labels=('endpoint', 'status'))
+API_SECONDS = Histogram(
+    'youtube_api_request_seconds',
+    'Time spent on calls to the Youtube API, by endpoint.',
+    labels=('endpoint',))
+API_RETRIES = Counter(
+    'youtube_api_retries_total',
+    'Calls to the Youtube API tried again after failing.')
+API_QUOTA_UNITS = Counter(
+    'youtube_api_quota_units_total',
+    'Quota units used by calls to the Youtube API, by endpoint.',
+    labels=('endpoint',))
+VIDEOS = Counter(
+    'youtube_videos_total',
+    'Videos fetched from the API, by whether they were created, updated or '
+    'unchanged.',
+    labels=('result',))
+VIDEOS_DELETED = Counter(
+    'youtube_videos_deleted_total',
+    'Videos marked as deleted.')
+CHANNEL_SECONDS = Histogram(
+    'youtube_channel_update_seconds',
+    'Time spent updating the videos of a channel.')
+CHANNEL_LAST_SECONDS = Gauge(
+    'youtube_channel_last_update_seconds',
+    'Time spent on the last update of the videos of each channel.',
+    labels=('channel',))
+
+
+def snapshot(reset=False):
+    '''
+    Returns the metrics of this process, as a JSON serializable dict. If reset
+    is True the metrics are reset at the same time.
+    '''
+    return dict(
+        (name, dict(metric.describe(), samples=metric.samples(reset=reset)))
+        for name, metric in REGISTRY.items())
+
+
+def merge(old, new):
+    '''
+    Merges two snapshots, adding up counters and histograms, while gauges
+    take the new value.
+    '''
+    merged = dict(old)
+    for name, data in new.items():
+        if name not in old or name not in REGISTRY:
+            merged[name] = data
+            continue
+        samples = dict(
+            (tuple(sorted(e['labels'].items())), e['value'])
+            for e in old[name]['samples'])
+        for e in data['samples']:
+            key = tuple(sorted(e['labels'].items()))
+            if key in samples:
+                samples[key] = REGISTRY[name].merge(samples[key], e['value'])
+            else:
+                samples[key] = e['value']
+        merged[name] = dict(data, samples=[
+            {'labels': dict(key), 'value': value}
+            for key, value in sorted(samples.items())])
+    return merged
+
+
+def reset():
+    for metric in REGISTRY.values():
+        metric.reset()
+
+
+def load():
+    '''
+    Returns the totals saved by all the processes.
+    '''
+    from .models import MetricValue
+
+    samples = {}
+    for name, labels, field, value in MetricValue.objects.values_list(
+            'name', 'labels', 'field', 'value'):
+        if name in REGISTRY:
+            samples.setdefault((name, labels), {})[field] = value
+
+    loaded = {}
+    for (name, labels), fields in sorted(samples.items()):
+        metric = REGISTRY[name]
+        value = metric.from_fields(fields)
+        if value is None:
+            continue
+        data = loaded.setdefault(name, dict(metric.describe(), samples=[]))
+        data['samples'].append({'labels': json.loads(labels), 'value': value})
+    return loaded
+
+
+def save():
+    '''
+    Adds the metrics of this process to the saved totals and resets them.
+
+    Returns the snapshot of the metrics saved.
+    '''
+    from .models import MetricValue
+
+    saved = snapshot(reset=True)
+    # All at once, so the fields of a histogram stay consistent.
+    with transaction.atomic():
+        for name, data in saved.items():
+            metric = REGISTRY[name]
+            for sample in data['samples']:
+                MetricValue.objects.record(
+                    name, json.dumps(sample['labels'], sort_keys=True),
+                    metric.fields(sample['value']), add=metric.added)
+    return saved
+
+
+def _escape(value):
+    return (
+        value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"'))
+
+
+def _format(name, labels, value):
+    if labels:
+        name = '%s{%s}' % (name, ','.join(
+            '%s="%s"' % (label, _escape(labels[label]))
+            for label in sorted(labels)))
+    return '%s %s' % (name, value)
+
+
+def render(snapshot):
+    '''
+    Returns the snapshot in the Prometheus text format.
+    '''
+    lines = []
+    for name, data in sorted(snapshot.items()):
+        lines.append('# HELP %s %s' % (name, data['help']))
+        lines.append('# TYPE %s %s' % (name, data['type']))
+        for sample in data['samples']:
+            labels, value = sample['labels'], sample['value']
+            if data['type'] != 'histogram':
+                lines.append(_format(name, labels, value))
+                continue
+            cumulative = 0
+            bounds = ['%g' % e for e in data['buckets']] + ['+Inf']
+            for bound, count in zip(bounds, value['buckets']):
+                cumulative += count
+                lines.append(_format(
+                    name + '_bucket', dict(labels, le=bound), cumulative))
+            lines.append(_format(name + '_sum', labels, value['sum']))
+            lines.append(_format(name + '_count', labels, value['count']))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('youtube', '0017_video__performance_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='checked',
+            field=models.DateTimeField(db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations
+
+from youtube import search
+
+
+def install(apps, schema_editor):
+    search.install(schema_editor)
+
+
+def uninstall(apps, schema_editor):
+    search.uninstall(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('youtube', '0018_video_checked'),
+    ]
+
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
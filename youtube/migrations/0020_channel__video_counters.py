@@ -0,0 +1,52 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:23
+
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def update_counters(apps, schema_editor):
+    # The expressions are copied from the models, which may have changed
+    # since this migration was written.
+    Channel = apps.get_model('youtube', 'Channel')
+    Video = apps.get_model('youtube', 'Video')
+    videos = (
+        Video.objects.
+        filter(uploader=OuterRef('pk')).
+        order_by().
+        values('uploader'))
+    visible_videos = videos.filter(deleted=False)
+    Channel.objects.update(
+        video_count=Coalesce(Subquery(
+            visible_videos.annotate(count=Count('pk')).values('count')), 0),
+        total_video_count=Coalesce(Subquery(
+            videos.annotate(count=Count('pk')).values('count')), 0),
+        latest_upload=Subquery(
+            visible_videos.annotate(latest=Max('uploaded')).values('latest')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('youtube', '0019_video__fulltext_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='channel',
+            name='latest_upload',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='channel',
+            name='total_video_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='channel',
+            name='video_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(update_counters, migrations.RunPython.noop),
+    ]
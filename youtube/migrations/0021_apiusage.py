@@ -0,0 +1,29 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('youtube', '0020_channel__video_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ApiUsage',
+            fields=[
+                ('id', models.AutoField(
+                    auto_created=True, primary_key=True, serialize=False,
+                    verbose_name='ID')),
+                ('date', models.DateField()),
+                ('endpoint', models.TextField()),
+                ('calls', models.IntegerField(default=0)),
+                ('units', models.IntegerField(default=0)),
+                ('seconds', models.FloatField(default=0)),
+            ],
+            options={
+                'unique_together': {('date', 'endpoint')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('youtube', '0021_apiusage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='channel',
+            name='next_refresh',
+            field=models.DateTimeField(db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='channel',
+            name='upload_interval',
+            field=models.IntegerField(null=True),
+        ),
+    ]
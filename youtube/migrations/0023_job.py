@@ -0,0 +1,41 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('youtube', '0022_channel__refresh_schedule'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.AutoField(
+                    auto_created=True, primary_key=True, serialize=False,
+                    verbose_name='ID')),
+                ('kind', models.TextField(choices=[
+                    ('add', 'Add'),
+                    ('fetch', 'Fast fetch'),
+                    ('full_fetch', 'Full fetch'),
+                ])),
+                ('status', models.TextField(choices=[
+                    ('queued', 'Queued'),
+                    ('running', 'Running'),
+                    ('done', 'Done'),
+                    ('failed', 'Failed'),
+                ], db_index=True, default='queued')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(null=True)),
+                ('finished', models.DateTimeField(null=True)),
+                ('fetched', models.IntegerField(null=True)),
+                ('error', models.TextField(default='')),
+                ('channel', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE,
+                    related_name='jobs', to='youtube.Channel')),
+            ],
+        ),
+    ]
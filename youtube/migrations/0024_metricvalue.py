@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('youtube', '0023_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetricValue',
+            fields=[
+                ('id', models.AutoField(
+                    auto_created=True, primary_key=True, serialize=False,
+                    verbose_name='ID')),
+                ('name', models.TextField()),
+                ('labels', models.TextField()),
+                ('field', models.TextField()),
+                ('value', models.FloatField(default=0)),
+            ],
+            options={
+                'unique_together': {('name', 'labels', 'field')},
+            },
+        ),
+    ]
@@ -1,19 +1,79 @@
 from __future__ import unicode_literals
+import datetime
+import traceback
 
-import dateutil.parser
-from django.db import models
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.utils import timezone
-from isodate import parse_duration
 
+from . import caching, metrics, search
+from .parsers import parse_datetime, parse_duration
 from .youtubeapi import (
+    NotModified,
     fetch_channel_info,
+    fetch_channels_info,
     fetch_videocategories,
     fetch_videos_from_playlist,
     fetch_videos,
+    pop_usage,
 )
 
 
+class ChannelQuerySet(models.QuerySet):
+    def update_counters(self):
+        '''
+        Recomputes the denormalized video counters of the channels, using a
+        single UPDATE query.
+
+        Returns the number of channels updated.
+        '''
+        # Called whenever the videos of the channels change.
+        caching.invalidate_feeds()
+        return self.update(**video_counter_expressions())
+
+    def due(self, now=None):
+        '''
+        Filters the channels to the ones due for a refresh, channels that have
+        never been scheduled are always due.
+        '''
+        return self.filter(
+            Q(next_refresh__isnull=True) |
+            Q(next_refresh__lte=now or timezone.now()))
+
+    def update_channel_info(self):
+        '''
+        Fetches info for the channels from the API, 50 channels per request,
+        and updates the channels that changed using a single bulk update.
+
+        Returns the list of channels that changed.
+        '''
+        channels = list(self)
+        changed = []
+        for chunk in _chunked(channels, 50):
+            try:
+                items = fetch_channels_info(
+                    [channel.channelid for channel in chunk],
+                    conditional=True)
+            except NotModified as e:
+                items = e.data.get('items', [])
+            info = dict((item['id'], item) for item in items)
+
+            for channel in chunk:
+                if (channel.channelid in info and
+                        channel.set_channel_info(info[channel.channelid])):
+                    changed.append(channel)
+
+        if changed:
+            self.model.objects.bulk_update(changed, CHANNEL_INFO_FIELDS)
+            caching.invalidate_channels()
+        return changed
+
+
 class Channel(models.Model):
+    objects = ChannelQuerySet.as_manager()
+
     channelid = models.TextField(unique=True)
     author = models.TextField(unique=True, null=True)
     title = models.TextField(default='', db_index=True)
@@ -22,6 +82,14 @@ class Channel(models.Model):
     hidden = models.BooleanField(default=False, db_index=True)
     thumbnail = models.TextField(default='')
     uploads_playlist = models.TextField(default='')
+    # Denormalized counters, maintained by `update_counters`.
+    video_count = models.IntegerField(default=0)  # not deleted
+    total_video_count = models.IntegerField(default=0)
+    latest_upload = models.DateTimeField(null=True)
+    # The average time between uploads in seconds, and when to refresh the
+    # channel next, maintained by `schedule_refresh`.
+    upload_interval = models.IntegerField(null=True)
+    next_refresh = models.DateTimeField(null=True, db_index=True)
 
     def __unicode__(self):
         return 'id: %s, author: %s' % (
@@ -29,59 +97,174 @@ class Channel(models.Model):
             self.author,
         )
 
-    def update_channel_info(self, save=True):
-        # Retrieve the channel info.
-        info = fetch_channel_info(self.channelid)
+    def save(self, *args, **kwargs):
+        super(Channel, self).save(*args, **kwargs)
+        caching.invalidate_channels()
 
-        # Save details from channel.
-        self.title = info['snippet']['title']
-        self.thumbnail = info['snippet']['thumbnails']['default']['url']
-        self.uploads_playlist = (
-            info['contentDetails']['relatedPlaylists']['uploads'])
+    def delete(self, *args, **kwargs):
+        result = super(Channel, self).delete(*args, **kwargs)
+        caching.invalidate_channels()
+        return result
 
-        if save:
+    def update_channel_info(self, save=True):
+        # Retrieve the channel info, once the channel has been fetched before
+        # the API tells us if nothing has changed since the last time.
+        try:
+            info = fetch_channel_info(
+                self.channelid, conditional=bool(self.uploads_playlist))
+        except NotModified as e:
+            info = e.data['items'][0]
+
+        # Save details from channel, if anything changed.
+        if self.set_channel_info(info) and save:
             self.save()
 
-    def fetch_videos(self, full_fetch=False):
+    def set_channel_info(self, info):
         '''
-        Fetch new videos from the channel.
-
-        If full_fetch is True all videos for the given channel is fetched.
-
-        Returns the number of videos fetched (if any).
+        Sets the details of the channel from the channel info given by the
+        API, returns True if anything changed.
         '''
-        fetched = 0
+        fields = {
+            'title': info['snippet']['title'],
+            'thumbnail': info['snippet']['thumbnails']['default']['url'],
+            'uploads_playlist': (
+                info['contentDetails']['relatedPlaylists']['uploads']),
+        }
+        changed = False
+        for name in CHANNEL_INFO_FIELDS:
+            if getattr(self, name) != fields[name]:
+                setattr(self, name, fields[name])
+                changed = True
+        return changed
+
+    def fetch_video_pages(self, full_fetch=False, incremental=False,
+                          max_pages=None):
+        '''
+        Generator fetching video data for the channel from the API, without
+        touching the database.
 
+        Yields a list of video dicts for each page of the uploads playlist, if
+        full_fetch is False only the first page is fetched. If incremental is
+        True pages are fetched until a page with only known videos is reached.
+        At most max_pages pages are fetched, if given.
+        '''
         next_page_token = None
         content_exists = True
+        pages = 0
 
         while content_exists:
-            # Read response as JSON and fetch all videoids.
-            items, next_page_token = fetch_videos_from_playlist(
-                self.uploads_playlist, next_page_token=next_page_token)
+            # Read response as JSON and fetch all videoids. Unless doing a full
+            # fetch, the first page is skipped when the API tells us it has not
+            # changed and all the videos on it are known.
+            try:
+                items, next_page_token = fetch_videos_from_playlist(
+                    self.uploads_playlist, next_page_token=next_page_token,
+                    conditional=not full_fetch and next_page_token is None)
+            except NotModified as e:
+                items = e.data['items']
+                next_page_token = e.data.get('nextPageToken')
+                if self._all_known(items):
+                    return
             videoids = set(
                 [item['contentDetails']['videoId'] for item in items])
 
             # Fetch the next page token, if it exists and the callers wants it.
-            if not full_fetch or not next_page_token:
+            if not next_page_token:
+                content_exists = False
+            elif not full_fetch:
+                content_exists = incremental and not self._all_known(items)
+            pages += 1
+            if max_pages is not None and pages >= max_pages:
                 content_exists = False
 
             # Not fetch videodata based on the video ids.
-            items = fetch_videos(videoids)
+            yield fetch_videos(videoids)
 
-            # Create all categories used, and not already in the backend.
-            Category.objects.get_categoryids([
-                e['snippet']['categoryId'] for e in items])
+    def _all_known(self, items):
+        '''
+        Returns True if all the videos in the playlist items are stored.
+        '''
+        videoids = set(item['contentDetails']['videoId'] for item in items)
+        return (
+            Video.objects.filter(youtubeid__in=videoids).count() ==
+            len(videoids))
 
-            # Read response as JSON and iterate on items updating/creating
-            # Video objects as we go along.
-            for item in items:
-                fetched += 1
-                Video.objects.create_or_update(self, item)
+    def store_videos(self, items):
+        '''
+        Creates or updates videos for the channel, from a list of video dicts
+        as returned by the API.
+
+        Returns the number of videos stored.
+        '''
+        # Create all categories used, and not already in the backend.
+        Category.objects.get_categoryids([
+            e['snippet']['categoryId'] for e in items])
+
+        # Create or update all the videos on the page in bulk.
+        result = Video.objects.bulk_create_or_update(self, items)
+        for key, count in result.items():
+            metrics.VIDEOS.inc(count, result=key)
+
+        return len(items)
+
+    def fetch_videos(self, full_fetch=False, incremental=False,
+                     max_pages=None):
+        '''
+        Fetch new videos from the channel.
+
+        If full_fetch is True all videos for the given channel is fetched, if
+        incremental is True videos are fetched until the already known videos
+        are reached. At most max_pages pages of videos are fetched, if given.
+
+        Returns the number of videos fetched (if any).
+        '''
+        fetched = 0
+        for items in self.fetch_video_pages(
+                full_fetch=full_fetch, incremental=incremental,
+                max_pages=max_pages):
+            fetched += self.store_videos(items)
+        self.update_counters()
 
         # All done, return the number of videos fetched.
         return fetched
 
+    def schedule_refresh(self, now=None):
+        '''
+        Computes the upload interval of the channel from its latest uploads,
+        and schedules the next refresh of the channel to a fraction of it.
+
+        Channels that have not uploaded for longer than their interval back
+        off, based on the time since the latest upload. Does not save.
+        '''
+        now = now or timezone.now()
+        uploads = list(
+            self.videos.exclude_deleted().order_by('-uploaded').values_list(
+                'uploaded', flat=True)[:settings.YOUTUBE_REFRESH_UPLOADS])
+
+        self.upload_interval = None
+        if len(uploads) > 1:
+            self.upload_interval = int(
+                (uploads[0] - uploads[-1]).total_seconds() /
+                (len(uploads) - 1))
+
+        if uploads:
+            interval = max(
+                self.upload_interval or 0,
+                (now - uploads[0]).total_seconds())
+            delay = interval / settings.YOUTUBE_REFRESH_FACTOR
+        else:
+            delay = settings.YOUTUBE_REFRESH_MAX_INTERVAL
+        delay = min(max(delay, settings.YOUTUBE_REFRESH_MIN_INTERVAL),
+                    settings.YOUTUBE_REFRESH_MAX_INTERVAL)
+        self.next_refresh = now + datetime.timedelta(seconds=delay)
+
+    def update_counters(self):
+        '''
+        Recomputes the video counters of the channel.
+        '''
+        Channel.objects.filter(pk=self.pk).update_counters()
+        self.refresh_from_db(fields=COUNTER_FIELDS)
+
     @property
     def url(self):
         return 'https://www.youtube.com/user/%(author)s/videos' % {
@@ -89,6 +272,34 @@ class Channel(models.Model):
         }
 
 
+# The fields on `Channel` that are populated from the API.
+CHANNEL_INFO_FIELDS = ['title', 'thumbnail', 'uploads_playlist']
+
+# The denormalized video counters on `Channel`.
+COUNTER_FIELDS = ['video_count', 'total_video_count', 'latest_upload']
+
+
+def video_counter_expressions():
+    '''
+    Returns a dict of expressions for computing the video counters of a
+    channel, for use in an UPDATE of channels.
+    '''
+    videos = (
+        Video.objects.
+        filter(uploader=OuterRef('pk')).
+        order_by().
+        values('uploader'))
+    visible_videos = videos.filter(deleted=False)
+    return {
+        'video_count': Coalesce(Subquery(
+            visible_videos.annotate(count=Count('pk')).values('count')), 0),
+        'total_video_count': Coalesce(Subquery(
+            videos.annotate(count=Count('pk')).values('count')), 0),
+        'latest_upload': Subquery(
+            visible_videos.annotate(latest=Max('uploaded')).values('latest')),
+    }
+
+
 class CategoryQuerySet(models.QuerySet):
     def get_categoryids(self, categoryids):
         '''
@@ -99,26 +310,23 @@ class CategoryQuerySet(models.QuerySet):
         does not exist a query against the youtube API is executed to fetch and
         create a new `Category` object.
         '''
-        # Fetch existing categories from the backend.
-        categories = self.filter(id__in=categoryids)
-        existing_categoryids = categories.values_list('pk', flat=True)
+        # Fetch existing categories from the backend, the API gives the ids
+        # as strings.
+        categoryids = set(int(e) for e in categoryids)
+        categories = list(self.filter(id__in=categoryids))
+        existing_categoryids = set(e.pk for e in categories)
 
         # Figure out what we're missing (if we're missing anything).
-        missing_categoryids = set([
-            e for e in categoryids if e not in existing_categoryids])
+        missing_categoryids = categoryids - existing_categoryids
 
-        # Fetch missing categories and create them in the backend.
+        # Fetch missing categories and create them in the backend, all at
+        # once.
         if missing_categoryids:
-
-            # Iterate and create new categories, adding them to the existing
-            # list of categories.
-            categories = list(categories)
-            for item in fetch_videocategories(missing_categoryids):
-                categories.append(self.get_or_create(
-                    id=item['id'],
-                    defaults={
-                        'category': item['snippet']['title'],
-                    })[0])
+            created = [
+                Category(id=int(item['id']), category=item['snippet']['title'])
+                for item in fetch_videocategories(missing_categoryids)]
+            self.bulk_create(created, ignore_conflicts=True)
+            categories.extend(created)
 
         return categories
 
@@ -138,36 +346,154 @@ class VideoQuerySet(models.QuerySet):
     def exclude_deleted(self):
         return self.exclude(deleted=True)
 
-    def text_search(self, search_query):
+    def least_recently_checked(self):
+        '''
+        Orders the videos so the ones that have been checked for deletion the
+        longest time ago (or never) comes first.
+        '''
+        return self.order_by(F('checked').asc(nulls_first=True), 'id')
+
+    def mark_deleted(self):
+        '''
+        Checks the videos against the API, in chunks of 50 videos per request,
+        and marks the videos that are no longer returned as deleted.
+
+        Returns a list of the youtubeids of the videos marked as deleted.
+        '''
+        videos = list(self.values_list('pk', 'youtubeid'))
+        missing = []
+        for chunk in _chunked(videos, 50):
+            youtubeids = [youtubeid for _, youtubeid in chunk]
+            found = set(item['id'] for item in fetch_videos(
+                youtubeids, parts=('id',)))
+            missing.extend(e for e in youtubeids if e not in found)
+            # Saved per chunk, so a failing run still rotates the videos
+            # checked so far.
+            Video.objects.filter(pk__in=[pk for pk, _ in chunk]).update(
+                checked=timezone.now())
+
+        if missing:
+            metrics.VIDEOS_DELETED.inc(len(missing))
+            Video.objects.filter(youtubeid__in=missing).update(deleted=True)
+            Channel.objects.filter(pk__in=Video.objects.filter(
+                youtubeid__in=missing).values('uploader')).update_counters()
+        return missing
+
+    def text_search(self, search_query, ranked=False):
+        '''
+        Does a full-text search on the title and description of the videos,
+        if ranked is True the best matches are returned first.
+        '''
         if search_query:
-            return self.filter(title__icontains=search_query)
+            return search.text_search(self, search_query, ranked=ranked)
         return self
 
     def create_or_update(self, channel, data):
         '''
         Creates or updates a `Video` object with the data given, for the
-        channel given.
-        '''
-        # Fetch video details, if it exists.
-        duration = parse_duration(data['contentDetails']['duration'])
-
-        return Video.objects.update_or_create(
-            youtubeid=data['id'],
-            defaults={
-                'uploader': channel,
-                'title': data['snippet']['title'],
-                'category_id': data['snippet']['categoryId'],
-                'description': data['snippet']['description'],
-                'duration': duration.total_seconds(),
-                'view_count': data.get('statistics', {}).get('viewCount'),
-                'favorite_count': data.get(
-                    'statistics', {}).get('favoriteCount'),
-                'uploaded': dateutil.parser.parse(
-                    data['snippet']['publishedAt']),
-                'updated': dateutil.parser.parse(
-                    data['snippet']['publishedAt']),
-            },
-        )[0]
+        channel given. Only the fields that changed are written.
+        '''
+        fields = _video_fields(channel, data)
+        video = self.filter(youtubeid=data['id']).first()
+        if video is None:
+            return self.create(youtubeid=data['id'], **fields)
+
+        changed = _set_changed_fields(video, fields)
+        if changed:
+            video.save(update_fields=changed)
+        return video
+
+    def bulk_create_or_update(self, channel, items):
+        '''
+        Creates or updates `Video` objects for a list of video data, like a
+        page of videos from the API, for the channel given.
+
+        Existing videos are looked up in a single query and compared to the
+        data, after which new videos are inserted in bulk and the changed
+        fields of existing videos are updated in bulk. Videos that did not
+        change are not written at all.
+
+        Returns a dict with the number of videos created, updated and
+        unchanged.
+        '''
+        values = dict((data['id'], _video_fields(channel, data))
+                      for data in items)
+        existing = self.in_bulk(list(values), field_name='youtubeid')
+
+        created, updated, unchanged = [], {}, 0
+        for youtubeid, fields in values.items():
+            video = existing.get(youtubeid)
+            if video is None:
+                created.append(Video(youtubeid=youtubeid, **fields))
+                continue
+            changed = _set_changed_fields(video, fields)
+            if changed:
+                # Group the videos by the fields changed, usually only the
+                # statistics, to update them with as few queries as possible.
+                updated.setdefault(tuple(changed), []).append(video)
+            else:
+                unchanged += 1
+
+        if created:
+            self.bulk_create(created)
+        for changed, videos in updated.items():
+            self.bulk_update(videos, changed)
+
+        return {
+            'created': len(created),
+            'updated': sum(len(videos) for videos in updated.values()),
+            'unchanged': unchanged,
+        }
+
+
+def _chunked(items, size):
+    '''
+    Splits the list of items into lists of at most size items.
+    '''
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def _int_or_none(value):
+    if value is None:
+        return None
+    return int(value)
+
+
+def _set_changed_fields(video, fields):
+    '''
+    Sets the field values (by attribute name) that differ from the values
+    on the video, returning the sorted list of names of the changed fields.
+    '''
+    changed = []
+    for attname, value in fields.items():
+        if getattr(video, attname) != value:
+            setattr(video, attname, value)
+            changed.append(video._meta.get_field(attname).name)
+    return sorted(changed)
+
+
+def _video_fields(channel, data):
+    '''
+    Returns a dict of `Video` field values, from the video data given by the
+    API.
+
+    The values have the same types as when loaded from the database, so they
+    can be compared to the stored values.
+    '''
+    statistics = data.get('statistics', {})
+    published = parse_datetime(data['snippet']['publishedAt'])
+
+    return {
+        'uploader_id': channel.pk,
+        'title': data['snippet']['title'],
+        'category_id': int(data['snippet']['categoryId']),
+        'description': data['snippet']['description'],
+        'duration': parse_duration(data['contentDetails']['duration']),
+        'view_count': _int_or_none(statistics.get('viewCount')),
+        'favorite_count': _int_or_none(statistics.get('favoriteCount')),
+        'uploaded': published,
+        'updated': published,
+    }
 
 
 class Video(models.Model):
@@ -187,6 +513,8 @@ class Video(models.Model):
     updated = models.DateTimeField()
     description = models.TextField(default='')
     deleted = models.BooleanField(default=False, db_index=True)
+    # When the video was last checked for being deleted.
+    checked = models.DateTimeField(null=True, db_index=True)
 
     class Meta:
         ordering = ['-uploaded']
@@ -217,3 +545,211 @@ class Video(models.Model):
             self.updated = self.uploaded
 
         super(Video, self).save(*args, **kwargs)
+        caching.invalidate_feeds()
+
+
+class ApiUsageQuerySet(models.QuerySet):
+    def record(self, usage=None):
+        '''
+        Adds the usage of the Youtube API to the ledger for today, by default
+        the usage since the last time it was recorded (see `pop_usage`).
+
+        Returns the usage recorded.
+        '''
+        if usage is None:
+            usage = pop_usage()
+        date = timezone.localdate()
+        for endpoint, (calls, units, seconds) in usage.items():
+            changes = {
+                'calls': F('calls') + calls,
+                'units': F('units') + units,
+                'seconds': F('seconds') + seconds,
+            }
+            if self.filter(date=date, endpoint=endpoint).update(**changes):
+                continue
+            try:
+                with transaction.atomic():
+                    self.create(
+                        date=date, endpoint=endpoint,
+                        calls=calls, units=units, seconds=seconds)
+            except IntegrityError:
+                # Created by someone else in the meantime.
+                self.filter(date=date, endpoint=endpoint).update(**changes)
+        return usage
+
+    def units_used(self, date=None):
+        '''
+        Returns the number of quota units used on the date, by default today.
+        '''
+        return self.filter(date=date or timezone.localdate()).aggregate(
+            units=Sum('units'))['units'] or 0
+
+
+class ApiUsage(models.Model):
+    '''
+    Ledger of the calls made against the Youtube API, per day and endpoint.
+    '''
+    objects = ApiUsageQuerySet.as_manager()
+
+    date = models.DateField()
+    endpoint = models.TextField()
+    calls = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)  # of quota
+    seconds = models.FloatField(default=0)  # spent waiting for responses
+
+    class Meta:
+        unique_together = [('date', 'endpoint')]
+
+    def __unicode__(self):
+        return '%s %s: %s units' % (self.date, self.endpoint, self.units)
+
+
+class MetricValueQuerySet(models.QuerySet):
+    def record(self, name, labels, fields, add=True):
+        '''
+        Adds the numbers by field to the saved values of the sample of the
+        metric with the labels (as JSON), or replaces them if add is False.
+        '''
+        for field, value in fields.items():
+            lookup = {'name': name, 'labels': labels, 'field': field}
+            change = F('value') + value if add else value
+            if self.filter(**lookup).update(value=change):
+                continue
+            try:
+                with transaction.atomic():
+                    self.create(value=value, **lookup)
+            except IntegrityError:
+                # Created by someone else in the meantime.
+                self.filter(**lookup).update(value=change)
+
+
+class MetricValue(models.Model):
+    '''
+    The totals of the metrics saved by the commands, one row per field of each
+    sample (the value, or the buckets, sum and count of histograms).
+    '''
+    objects = MetricValueQuerySet.as_manager()
+
+    name = models.TextField()
+    labels = models.TextField()  # as JSON, sorted by label
+    field = models.TextField()
+    value = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = [('name', 'labels', 'field')]
+
+    def __unicode__(self):
+        return '%s%s %s: %s' % (self.name, self.labels, self.field, self.value)
+
+
+class JobQuerySet(models.QuerySet):
+    def enqueue(self, channel, kind):
+        '''
+        Queues a job of the kind for the channel, unless the same job is
+        already queued. Returns the job.
+        '''
+        job = self.filter(
+            channel=channel, kind=kind, status=Job.QUEUED).first()
+        return job or self.create(channel=channel, kind=kind)
+
+    def claim(self):
+        '''
+        Claims the oldest queued job, marking it as running, or returns None if
+        there are no queued jobs. Running jobs started more than
+        `YOUTUBE_JOB_TIMEOUT` seconds ago are claimed again, their worker is
+        assumed to have died.
+
+        The job is claimed using a conditional update, so multiple workers can
+        claim jobs from the same queue.
+        '''
+        now = timezone.now()
+        claimable = Q(status=Job.QUEUED) | Q(
+            status=Job.RUNNING,
+            started__lt=now - datetime.timedelta(
+                seconds=settings.YOUTUBE_JOB_TIMEOUT))
+        for job in self.filter(claimable).order_by('id')[:10]:
+            claimed = self.filter(claimable, pk=job.pk).update(
+                status=Job.RUNNING, started=now)
+            if claimed:
+                job = self.select_related('channel').filter(pk=job.pk).first()
+                if job is not None:
+                    return job
+
+
+class Job(models.Model):
+    '''
+    A fetch of a channel queued from the admin, run in the background by the
+    `process_jobs` command.
+    '''
+    ADD = 'add'
+    FETCH = 'fetch'
+    FULL_FETCH = 'full_fetch'
+    KIND_CHOICES = (
+        (ADD, 'Add'),
+        (FETCH, 'Fast fetch'),
+        (FULL_FETCH, 'Full fetch'),
+    )
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    objects = JobQuerySet.as_manager()
+
+    channel = models.ForeignKey(
+        Channel, related_name='jobs', on_delete=models.CASCADE)
+    kind = models.TextField(choices=KIND_CHOICES)
+    status = models.TextField(
+        choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True)
+    finished = models.DateTimeField(null=True)
+    fetched = models.IntegerField(null=True)
+    error = models.TextField(default='')
+
+    def __unicode__(self):
+        return '%s of %s: %s' % (self.kind, self.channel_id, self.status)
+
+    def run(self):
+        '''
+        Fetches the channel info and videos of the channel, marking the job as
+        done or failed.
+        '''
+        try:
+            channel = Channel.objects.get(pk=self.channel_id)
+            channel.update_channel_info(save=False)
+            # The transactions are not held open while fetching, the videos
+            # are stored a page at a time.
+            self.fetched = 0
+            for items in channel.fetch_video_pages(
+                    full_fetch=self.kind == Job.FULL_FETCH):
+                with transaction.atomic():
+                    self.fetched += channel.store_videos(items)
+            with transaction.atomic():
+                channel.update_counters()
+                channel.updated = timezone.now()
+                channel.schedule_refresh()
+                # Updating only, fails rather than recreating the channel if
+                # it has been deleted in the meantime.
+                channel.save(update_fields=CHANNEL_INFO_FIELDS + [
+                    'updated', 'upload_interval', 'next_refresh'])
+            self.status = Job.DONE
+        except Exception:
+            self.status = Job.FAILED
+            self.error = traceback.format_exc()
+        finally:
+            ApiUsage.objects.record()
+
+        # The channel (and the job) might have been deleted in the meantime,
+        # so only update the job if it still exists.
+        self.finished = timezone.now()
+        Job.objects.filter(pk=self.pk).update(
+            status=self.status, finished=self.finished,
+            fetched=self.fetched, error=self.error)
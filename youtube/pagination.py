@@ -0,0 +1,101 @@
+'''
+Keyset (cursor) based pagination of video feeds.
+
+Pages are ordered by `uploaded` and `id`, newest first, and navigated using
+cursors pointing at the first/last video of the page. Unlike offset based
+pagination, deep pages are as cheap as the first one and no count is needed.
+'''
+from __future__ import unicode_literals
+import datetime
+
+from django.db.models import Q
+from django.utils import timezone
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def encode_cursor(video):
+    '''
+    Returns a cursor string for the position of the video in a feed.
+    '''
+    delta = video.uploaded - EPOCH
+    microseconds = (
+        (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds)
+    return '%d-%d' % (microseconds, video.pk)
+
+
+def decode_cursor(cursor):
+    '''
+    Returns the (uploaded, id) tuple for a cursor string, or None if the
+    cursor is invalid.
+    '''
+    try:
+        microseconds, pk = cursor.rsplit('-', 1)
+        return (EPOCH + datetime.timedelta(microseconds=int(microseconds)),
+                int(pk))
+    except (AttributeError, ValueError, OverflowError):
+        return None
+
+
+class KeysetPage(object):
+    def __init__(self, object_list, query, has_next, has_previous):
+        self.object_list = object_list
+        self.query = query
+        self.has_next = has_next and bool(object_list)
+        self.has_previous = has_previous and bool(object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def _url(self, param, video):
+        query = self.query.copy()
+        query.pop('after', None)
+        query.pop('before', None)
+        query[param] = encode_cursor(video)
+        return '?' + query.urlencode()
+
+    @property
+    def next_url(self):
+        if self.has_next:
+            return self._url('after', self.object_list[-1])
+
+    @property
+    def previous_url(self):
+        if self.has_previous:
+            return self._url('before', self.object_list[0])
+
+
+def paginate(queryset, query, per_page):
+    '''
+    Returns a `KeysetPage` with the videos of the queryset, based on the
+    `after` or `before` cursor in the query (the GET QueryDict of the
+    request). Without a (valid) cursor the first page is returned.
+    '''
+    after = decode_cursor(query.get('after'))
+    before = decode_cursor(query.get('before'))
+
+    if before and not after:
+        uploaded, pk = before
+        videos = list(
+            queryset.
+            filter(uploaded__gte=uploaded).
+            filter(Q(uploaded__gt=uploaded) | Q(id__gt=pk)).
+            order_by('uploaded', 'id')[:per_page + 1])
+        has_previous = len(videos) > per_page
+        return KeysetPage(
+            videos[:per_page][::-1], query,
+            has_next=True, has_previous=has_previous)
+
+    if after:
+        uploaded, pk = after
+        queryset = (
+            queryset.
+            filter(uploaded__lte=uploaded).
+            filter(Q(uploaded__lt=uploaded) | Q(id__lt=pk)))
+    videos = list(queryset.order_by('-uploaded', '-id')[:per_page + 1])
+    return KeysetPage(
+        videos[:per_page], query,
+        has_next=len(videos) > per_page, has_previous=bool(after))
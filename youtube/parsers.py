@@ -0,0 +1,45 @@
+'''
+Fast parsers for the duration and timestamp formats used by the Youtube API.
+
+The API always uses the same few formats, these are parsed using a single
+regular expression each, falling back to the generic (and much slower)
+parsers of isodate and dateutil for anything else.
+'''
+from __future__ import unicode_literals
+import datetime
+import re
+
+import dateutil.parser
+import isodate
+from django.utils import timezone
+
+# Durations like P1DT2H3M4S, PT3M40S or P0D.
+DURATION_RE = re.compile(
+    r'^P(?:(\d+)D)?(?:T(?=\d)(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$')
+# Timestamps in UTC like 2014-01-01T12:00:00Z or 2014-01-01T12:00:00.000Z.
+DATETIME_RE = re.compile(
+    r'^(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:\.(\d{1,6}))?Z$')
+
+
+def parse_duration(value):
+    '''
+    Parses an ISO 8601 duration, returning the number of seconds as an int.
+    '''
+    match = DURATION_RE.match(value)
+    if match is None or value == 'P':
+        return int(isodate.parse_duration(value).total_seconds())
+    days, hours, minutes, seconds = [int(e or 0) for e in match.groups()]
+    return ((days * 24 + hours) * 60 + minutes) * 60 + seconds
+
+
+def parse_datetime(value):
+    '''
+    Parses an ISO 8601 timestamp, returning a timezone aware datetime.
+    '''
+    match = DATETIME_RE.match(value)
+    if match is None:
+        return dateutil.parser.parse(value)
+    year, month, day, hour, minute, second, fraction = match.groups()
+    return datetime.datetime(
+        int(year), int(month), int(day), int(hour), int(minute), int(second),
+        int((fraction or '0').ljust(6, '0')), tzinfo=timezone.utc)
@@ -0,0 +1,150 @@
+'''
+Opt-in profiling of requests, see `ProfilingMiddleware`.
+'''
+from __future__ import unicode_literals
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+# The profile of the request handled by the current thread, if any.
+_local = threading.local()
+
+
+def record_cache(hit):
+    '''
+    Counts a cache hit or miss in the profile of the current request.
+    '''
+    profile = getattr(_local, 'profile', None)
+    if profile is not None:
+        if hit:
+            profile.cache_hits += 1
+        else:
+            profile.cache_misses += 1
+
+
+class Profile(object):
+    '''
+    Where the time of a single request goes, all durations in seconds.
+    '''
+    def __init__(self):
+        self.start = time.time()
+        self.total = None
+        self.view_start = None
+        self.view = None
+        self.render_start = None
+        self.render = None
+        # (duration, sql) of each query.
+        self.queries = []
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def execute(self, execute, sql, params, many, context):
+        '''
+        Database execute wrapper timing each query.
+        '''
+        start = time.time()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((time.time() - start, sql))
+
+    def start_render(self):
+        self.render_start = time.time()
+        self.view = self.render_start - self.view_start
+
+    def end_render(self, response):
+        self.render = time.time() - self.render_start
+
+    def finish(self):
+        now = time.time()
+        self.total = now - self.start
+        if self.view is None and self.view_start is not None:
+            self.view = now - self.view_start
+
+    @property
+    def query_time(self):
+        return sum(duration for duration, _ in self.queries)
+
+    def server_timing(self):
+        '''
+        Returns the value of the Server-Timing header.
+        '''
+        metrics = [
+            'sql;dur=%.1f;desc="%d queries"' % (
+                self.query_time * 1000, len(self.queries)),
+            'cache;desc="%d hits, %d misses"' % (
+                self.cache_hits, self.cache_misses),
+        ]
+        if self.view is not None:
+            metrics.append('view;dur=%.1f' % (self.view * 1000))
+        if self.render is not None:
+            metrics.append('render;dur=%.1f' % (self.render * 1000))
+        metrics.append('total;dur=%.1f' % (self.total * 1000))
+        return ', '.join(metrics)
+
+    def top_queries(self, count):
+        return sorted(self.queries, key=lambda e: e[0], reverse=True)[:count]
+
+
+class ProfilingMiddleware(object):
+    '''
+    Adds a Server-Timing header with the number and time of the SQL queries,
+    the cache hits and misses, the view, template render and total time to
+    the responses of the views named in `YOUTUBE_PROFILING_VIEWS`.
+
+    A fraction (`YOUTUBE_PROFILING_SAMPLE_RATE`) of the requests slower than
+    `YOUTUBE_PROFILING_SLOW_REQUEST` milliseconds is logged with its slowest
+    queries. Unless `YOUTUBE_PROFILING` is set, the middleware is not used at
+    all.
+    '''
+    def __init__(self, get_response):
+        if not settings.YOUTUBE_PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.views = set(settings.YOUTUBE_PROFILING_VIEWS)
+
+    def __call__(self, request):
+        profile = Profile()
+        _local.profile = profile
+        try:
+            with connection.execute_wrapper(profile.execute):
+                response = self.get_response(request)
+        finally:
+            _local.profile = None
+        profile.finish()
+
+        match = request.resolver_match
+        if match is None or match.url_name not in self.views:
+            return response
+        response['Server-Timing'] = profile.server_timing()
+        slow = settings.YOUTUBE_PROFILING_SLOW_REQUEST / 1000.0
+        if (random.random() < settings.YOUTUBE_PROFILING_SAMPLE_RATE and
+                profile.total >= slow):
+            self.log(request, profile)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        _local.profile.view_start = time.time()
+
+    def process_template_response(self, request, response):
+        profile = _local.profile
+        profile.start_render()
+        response.add_post_render_callback(profile.end_render)
+        return response
+
+    def log(self, request, profile):
+        logger.warning(
+            'Slow request %s: %.1fms, %d queries in %.1fms\n%s',
+            request.get_full_path(), profile.total * 1000,
+            len(profile.queries), profile.query_time * 1000,
+            '\n'.join(
+                '%8.1fms %s' % (duration * 1000, sql)
+                for duration, sql in profile.top_queries(
+                    settings.YOUTUBE_PROFILING_TOP_QUERIES)))
@@ -0,0 +1,167 @@
+'''
+Full-text search on the title and description of videos.
+
+On SQLite an FTS5 table is kept in sync with the video table by triggers, on
+postgres a GIN index on the tsvector of the video is used. Other backends (or
+SQLite without FTS5) falls back to a simple search on the title.
+'''
+from __future__ import unicode_literals
+import re
+
+from django.db import connections
+from django.db.models.expressions import RawSQL
+
+SQLITE_INSTALL = [
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS youtube_video_fts USING fts5(
+        title, description,
+        content='youtube_video', content_rowid='id')
+    ''',
+    'DROP TRIGGER IF EXISTS youtube_video_fts_insert',
+    '''
+    CREATE TRIGGER youtube_video_fts_insert AFTER INSERT ON youtube_video
+    BEGIN
+        INSERT INTO youtube_video_fts(rowid, title, description)
+        VALUES (new.id, new.title, new.description);
+    END
+    ''',
+    'DROP TRIGGER IF EXISTS youtube_video_fts_delete',
+    '''
+    CREATE TRIGGER youtube_video_fts_delete AFTER DELETE ON youtube_video
+    BEGIN
+        INSERT INTO youtube_video_fts(
+            youtube_video_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+    END
+    ''',
+    'DROP TRIGGER IF EXISTS youtube_video_fts_update',
+    '''
+    CREATE TRIGGER youtube_video_fts_update
+    AFTER UPDATE OF title, description ON youtube_video
+    BEGIN
+        INSERT INTO youtube_video_fts(
+            youtube_video_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO youtube_video_fts(rowid, title, description)
+        VALUES (new.id, new.title, new.description);
+    END
+    ''',
+    "INSERT INTO youtube_video_fts(youtube_video_fts) VALUES ('rebuild')",
+]
+SQLITE_UNINSTALL = [
+    'DROP TRIGGER IF EXISTS youtube_video_fts_insert',
+    'DROP TRIGGER IF EXISTS youtube_video_fts_delete',
+    'DROP TRIGGER IF EXISTS youtube_video_fts_update',
+    'DROP TABLE IF EXISTS youtube_video_fts',
+]
+SQLITE_MATCH = (
+    'youtube_video.id IN (SELECT rowid FROM youtube_video_fts '
+    'WHERE youtube_video_fts MATCH %s)')
+# When ranking, the FTS table is joined instead, so the MATCH runs once and
+# bm25() can be selected. It returns negative numbers, the lowest is the best.
+SQLITE_JOIN = [
+    'youtube_video_fts.rowid = youtube_video.id',
+    'youtube_video_fts MATCH %s',
+]
+SQLITE_RANK = '-bm25(youtube_video_fts)'
+
+# The expression must match the one in the index, for the index to be used.
+POSTGRES_VECTOR = (
+    "to_tsvector('simple', youtube_video.title || ' ' || "
+    "youtube_video.description)")
+POSTGRES_INSTALL = [
+    'CREATE INDEX IF NOT EXISTS youtube_video_search_idx ON youtube_video '
+    'USING GIN (%s)' % POSTGRES_VECTOR,
+]
+POSTGRES_UNINSTALL = [
+    'DROP INDEX IF EXISTS youtube_video_search_idx',
+]
+POSTGRES_MATCH = "%s @@ to_tsquery('simple', %%s)" % POSTGRES_VECTOR
+POSTGRES_RANK = "ts_rank(%s, to_tsquery('simple', %%s))" % POSTGRES_VECTOR
+
+_installed = {}
+
+
+def _sqlite_has_fts5(connection):
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        return 'ENABLE_FTS5' in [row[0] for row in cursor.fetchall()]
+
+
+def install(schema_editor):
+    '''
+    Creates the search table/index for the database of the schema editor.
+
+    Can be run multiple times, on SQLite it has to be run again after
+    migrations that rebuild the video table, since that drops the triggers.
+    '''
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite' and _sqlite_has_fts5(connection):
+        statements = SQLITE_INSTALL
+    elif connection.vendor == 'postgresql':
+        statements = POSTGRES_INSTALL
+    else:
+        return
+    for sql in statements:
+        schema_editor.execute(sql, params=None)
+    _installed.clear()
+
+
+def uninstall(schema_editor):
+    '''
+    Removes the search table/index for the database of the schema editor.
+    '''
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        statements = SQLITE_UNINSTALL
+    elif connection.vendor == 'postgresql':
+        statements = POSTGRES_UNINSTALL
+    else:
+        return
+    for sql in statements:
+        schema_editor.execute(sql, params=None)
+    _installed.clear()
+
+
+def is_installed(connection):
+    '''
+    Returns True if full-text search is available for the connection.
+    '''
+    key = (connection.alias, connection.settings_dict['NAME'])
+    if key not in _installed:
+        if connection.vendor == 'sqlite':
+            _installed[key] = (
+                'youtube_video_fts' in connection.introspection.table_names())
+        else:
+            _installed[key] = connection.vendor == 'postgresql'
+    return _installed[key]
+
+
+def text_search(queryset, search_query, ranked=False):
+    '''
+    Filters the video queryset to the videos matching all the words in the
+    search query, as a prefix of a word in the title or description.
+
+    If ranked is True the videos are annotated with a `search_rank`, where
+    higher is a better match, and ordered by it.
+    '''
+    connection = connections[queryset.db]
+    terms = re.findall(r'\w+', search_query, re.UNICODE)
+    if not terms or not is_installed(connection):
+        return queryset.filter(title__icontains=search_query)
+
+    if connection.vendor == 'sqlite':
+        match = ' '.join('"%s"*' % term for term in terms)
+        if not ranked:
+            return queryset.extra(where=[SQLITE_MATCH], params=[match])
+        queryset = queryset.extra(
+            tables=['youtube_video_fts'], where=SQLITE_JOIN, params=[match],
+            select={'search_rank': SQLITE_RANK})
+    else:
+        match = ' & '.join('%s:*' % term for term in terms)
+        queryset = queryset.extra(where=[POSTGRES_MATCH], params=[match])
+        if not ranked:
+            return queryset
+        queryset = queryset.annotate(
+            search_rank=RawSQL(POSTGRES_RANK, [match]))
+    return queryset.order_by('-search_rank', '-uploaded')
@@ -5,19 +5,30 @@ from django import template
 from django.utils import timezone
 from django.utils.html import format_html
 
+from .. import caching
 from ..models import Channel
 
 register = template.Library()
 
 
+def _channels(hidden):
+    return list(
+        Channel.objects.
+        filter(hidden=hidden).
+        only('author', 'title', 'thumbnail').
+        order_by('title'))
+
+
 @register.simple_tag
 def visible_channels():
-    return Channel.objects.filter(hidden=False).order_by('title')
+    return caching.get_or_set(
+        caching.VISIBLE_CHANNELS_KEY, lambda: _channels(hidden=False))
 
 
 @register.simple_tag
 def hidden_channels():
-    return Channel.objects.filter(hidden=True).order_by('title')
+    return caching.get_or_set(
+        caching.HIDDEN_CHANNELS_KEY, lambda: _channels(hidden=True))
 
 
 @register.filter
@@ -1,10 +1,26 @@
+import datetime
+import io
+import json
 import logging
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 import mock
-from django.test import TestCase
-from django.core.management import call_command
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.test import TestCase, override_settings
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.utils import timezone
 
-from ..models import Channel, Video, Category
+from .. import metrics
+from ..management.commands.benchmark import Command as BenchmarkCommand
+from ..management.commands.benchmark import percentile
+from ..management.commands.update_channels import plan_budget
+from ..models import (
+    ApiUsage, Channel, ChannelQuerySet, Job, Video, Category)
 
 
 class UpdateChannelsTest(TestCase):
@@ -19,7 +35,7 @@ class UpdateChannelsTest(TestCase):
     def test__no_channels(self):
         call_command('update_channels')
 
-    @mock.patch.object(Channel, 'update_channel_info')
+    @mock.patch.object(ChannelQuerySet, 'update_channel_info')
     @mock.patch.object(Channel, 'fetch_videos')
     def test__single_channel__no_videos(self, fetch_videos_patch,
                                         update_channel_info_patch):
@@ -30,7 +46,24 @@ class UpdateChannelsTest(TestCase):
         self.assertTrue(fetch_videos_patch.called)
         self.assertTrue(update_channel_info_patch.called)
 
-    @mock.patch.object(Channel, 'update_channel_info')
+    @mock.patch.object(ChannelQuerySet, 'update_channel_info')
+    @mock.patch.object(Channel, 'fetch_videos')
+    def test__single_channel__metrics(self, fetch_videos_patch,
+                                      update_channel_info_patch):
+        cache.clear()
+        metrics.reset()
+        Channel.objects.create(author='testauthor')
+
+        call_command('update_channels')
+
+        samples = metrics.load()['youtube_channel_last_update_seconds'][
+            'samples']
+        self.assertEqual(
+            [e['labels'] for e in samples], [{'channel': 'testauthor'}])
+        # Saving resets the metrics of this process.
+        self.assertEqual(metrics.CHANNEL_LAST_SECONDS.samples(), [])
+
+    @mock.patch.object(ChannelQuerySet, 'update_channel_info')
     @mock.patch.object(Channel, 'fetch_videos')
     def test__single_channel__no_videos__full_fetch(
             self, fetch_videos_patch, update_channel_info_patch):
@@ -41,51 +74,145 @@ class UpdateChannelsTest(TestCase):
         self.assertTrue(fetch_videos_patch.called)
         self.assertTrue(update_channel_info_patch.called)
 
-    @mock.patch('youtube.management.commands.update_channels.requests')
-    @mock.patch.object(Channel, 'update_channel_info')
+    @mock.patch.object(ChannelQuerySet, 'update_channel_info')
+    @mock.patch.object(Channel, 'fetch_videos')
+    def test__single_channel__no_videos__incremental(
+            self, fetch_videos_patch, update_channel_info_patch):
+        Channel.objects.create()
+
+        call_command('update_channels', '--incremental')
+
+        fetch_videos_patch.assert_called_with(
+            full_fetch=False, incremental=True, max_pages=None)
+        self.assertTrue(update_channel_info_patch.called)
+
+    @mock.patch.object(ChannelQuerySet, 'update_channel_info')
+    @mock.patch.object(Channel, 'fetch_video_pages')
+    @mock.patch.object(Channel, 'store_videos')
+    def test__multiple_channels__workers(
+            self, store_videos_patch, fetch_video_pages_patch,
+            update_channel_info_patch):
+        Channel.objects.create(channelid='a', author='a')
+        Channel.objects.create(channelid='b', author='b')
+        fetch_video_pages_patch.side_effect = lambda **kwargs: iter([
+            [{'id': 'abcdef'}],
+        ])
+        store_videos_patch.return_value = 1
+
+        call_command('update_channels', '--workers', '2')
+
+        update_channel_info_patch.assert_called_once_with()
+        self.assertEqual(fetch_video_pages_patch.call_count, 2)
+        fetch_video_pages_patch.assert_called_with(
+            full_fetch=False, incremental=False, max_pages=None)
+        self.assertEqual(store_videos_patch.call_count, 2)
+        store_videos_patch.assert_called_with([{'id': 'abcdef'}])
+        for channel in Channel.objects.all():
+            self.assertGreater(channel.updated, channel.created)
+
+    @mock.patch.object(ChannelQuerySet, 'update_channel_info')
+    @mock.patch.object(Channel, 'fetch_video_pages')
+    @mock.patch.object(Channel, 'store_videos')
+    def test__multiple_channels__workers__bounded(
+            self, store_videos_patch, fetch_video_pages_patch,
+            update_channel_info_patch):
+        for idx in range(10):
+            Channel.objects.create(channelid='c%d' % idx, author='c%d' % idx)
+        fetch_video_pages_patch.side_effect = lambda **kwargs: iter([
+            [{'id': 'abcdef'}],
+        ])
+        submitted = []
+        in_flight = []
+        submit = ThreadPoolExecutor.submit
+
+        def submit_patch(executor, *args, **kwargs):
+            submitted.append(args)
+            return submit(executor, *args, **kwargs)
+
+        def store_videos(items):
+            in_flight.append(len(submitted) - len(in_flight))
+            return 1
+        store_videos_patch.side_effect = store_videos
+
+        with mock.patch.object(ThreadPoolExecutor, 'submit', submit_patch):
+            call_command('update_channels', '--workers', '2')
+
+        self.assertEqual(len(submitted), 10)
+        self.assertEqual(store_videos_patch.call_count, 10)
+        # Two downloads per worker ahead of the channel being stored.
+        self.assertLessEqual(max(in_flight), 5)
+
+    @mock.patch('youtube.models.fetch_videos')
+    @mock.patch.object(ChannelQuerySet, 'update_channel_info')
     @mock.patch.object(Channel, 'fetch_videos')
     def test__no_channels__single_video__still_exists(
             self, fetch_videos_patch, update_channel_info_patch,
-            requests_patch):
-        requests_patch.head().status_code = 200
-        Video.objects.create(
+            api_fetch_videos_patch):
+        video = Video.objects.create(
+            youtubeid='abcdef',
             category=Category.objects.create(
                 id=1,
             ),
             uploader=Channel.objects.create(),
         )
+        api_fetch_videos_patch.return_value = [{'id': 'abcdef'}]
 
         call_command('update_channels')
 
-        self.assertTrue(requests_patch.head.called)
+        api_fetch_videos_patch.assert_called_with(['abcdef'], parts=('id',))
+        video = Video.objects.get(pk=video.pk)
+        self.assertFalse(video.deleted)
+        self.assertIsNotNone(video.checked)
 
-    @mock.patch('youtube.management.commands.update_channels.requests')
-    @mock.patch.object(Channel, 'update_channel_info')
+    @mock.patch('youtube.models.fetch_videos')
+    @mock.patch.object(ChannelQuerySet, 'update_channel_info')
     @mock.patch.object(Channel, 'fetch_videos')
     def test__no_channels__single_video__not_found(
             self, fetch_videos_patch, update_channel_info_patch,
-            requests_patch):
-        requests_patch.head().status_code = 404
+            api_fetch_videos_patch):
         video = Video.objects.create(
+            youtubeid='abcdef',
             category=Category.objects.create(
                 id=1,
             ),
             uploader=Channel.objects.create(),
         )
+        api_fetch_videos_patch.return_value = []
 
         call_command('update_channels')
 
-        self.assertTrue(requests_patch.head.called)
+        self.assertTrue(api_fetch_videos_patch.called)
         video = Video.objects.get(pk=video.pk)
         self.assertTrue(video.deleted)
 
-    @mock.patch('youtube.management.commands.update_channels.requests')
-    @mock.patch.object(Channel, 'update_channel_info')
+    @mock.patch('youtube.models.fetch_videos')
+    @mock.patch.object(ChannelQuerySet, 'update_channel_info')
     @mock.patch.object(Channel, 'fetch_videos')
-    def test__no_channels__single_video__weird_status_code(
+    def test__no_channels__rotate_deleted(
             self, fetch_videos_patch, update_channel_info_patch,
-            requests_patch):
-        requests_patch.head().status_code = 500
+            api_fetch_videos_patch):
+        category = Category.objects.create(id=1)
+        channel = Channel.objects.create()
+        for youtubeid in ['a', 'b', 'c']:
+            Video.objects.create(
+                youtubeid=youtubeid, category=category, uploader=channel)
+        api_fetch_videos_patch.side_effect = lambda ids, parts: [
+            {'id': e} for e in ids]
+
+        call_command('update_channels', '--check-deleted', '2',
+                     '--rotate-deleted')
+        api_fetch_videos_patch.assert_called_with(['a', 'b'], parts=('id',))
+
+        call_command('update_channels', '--check-deleted', '2',
+                     '--rotate-deleted')
+        api_fetch_videos_patch.assert_called_with(['c', 'a'], parts=('id',))
+
+    @mock.patch('youtube.models.fetch_videos')
+    @mock.patch.object(ChannelQuerySet, 'update_channel_info')
+    @mock.patch.object(Channel, 'fetch_videos')
+    def test__no_channels__check_deleted_disabled(
+            self, fetch_videos_patch, update_channel_info_patch,
+            api_fetch_videos_patch):
         Video.objects.create(
             category=Category.objects.create(
                 id=1,
@@ -93,7 +220,267 @@ class UpdateChannelsTest(TestCase):
             uploader=Channel.objects.create(),
         )
 
-        call_command('update_channels')
+        call_command('update_channels', '--check-deleted', '0')
+
+        self.assertFalse(api_fetch_videos_patch.called)
+
+    @mock.patch.object(ChannelQuerySet, 'update_channel_info')
+    @mock.patch.object(Channel, 'fetch_videos')
+    def test__due(self, fetch_videos_patch, update_channel_info_patch):
+        channel = Channel.objects.create(channelid='a', author='a')
+        Channel.objects.create(
+            channelid='b', author='b',
+            next_refresh=timezone.now() + datetime.timedelta(hours=1))
+        fetch_videos_patch.return_value = 0
+
+        call_command('update_channels', '--due', '--check-deleted', '0')
+
+        self.assertEqual(fetch_videos_patch.call_count, 1)
+        channel.refresh_from_db()
+        self.assertGreater(channel.next_refresh, timezone.now())
+
+        call_command('update_channels', '--due', '--check-deleted', '0')
+
+        self.assertEqual(fetch_videos_patch.call_count, 1)
+
+    @mock.patch('youtube.models.fetch_videos')
+    @mock.patch.object(ChannelQuerySet, 'update_channel_info')
+    @mock.patch.object(Channel, 'fetch_videos')
+    def test__due__no_check_deleted(
+            self, fetch_videos_patch, update_channel_info_patch,
+            api_fetch_videos_patch):
+        channel = Channel.objects.create(channelid='a', author='a')
+        Video.objects.create(
+            youtubeid='abcdef', uploader=channel,
+            category=Category.objects.create(id=1))
+        fetch_videos_patch.return_value = 0
+
+        call_command('update_channels', '--due')
+
+        self.assertEqual(fetch_videos_patch.call_count, 1)
+        self.assertFalse(api_fetch_videos_patch.called)
+
+        call_command('update_channels', '--check-deleted', '10')
+
+        self.assertTrue(api_fetch_videos_patch.called)
+
+    @mock.patch('youtube.models.fetch_videos')
+    @mock.patch.object(ChannelQuerySet, 'update_channel_info')
+    @mock.patch.object(Channel, 'fetch_videos')
+    def test__quota_budget(
+            self, fetch_videos_patch, update_channel_info_patch,
+            api_fetch_videos_patch):
+        stale = Channel.objects.create(channelid='a', author='a')
+        Channel.objects.create(channelid='b', author='b')
+        Channel.objects.filter(pk=stale.pk).update(
+            updated=stale.updated.replace(year=2000))
+        fetched = []
+        fetch_videos_patch.side_effect = (
+            lambda **kwargs: fetched.append(kwargs) or 0)
+
+        # 1 unit for the channel info and 2 for the first page.
+        call_command('update_channels', '--quota-budget', '3',
+                     '--incremental')
+
+        self.assertEqual(fetched, [
+            {'full_fetch': False, 'incremental': True, 'max_pages': 1}])
+        stale.refresh_from_db()
+        self.assertGreater(stale.updated.year, 2000)
+        self.assertFalse(api_fetch_videos_patch.called)
+
+    @override_settings(YOUTUBE_API_DAILY_QUOTA=10)
+    @mock.patch('youtube.models.fetch_videos')
+    @mock.patch.object(ChannelQuerySet, 'update_channel_info')
+    @mock.patch.object(Channel, 'fetch_videos')
+    def test__quota_budget__daily_quota_used(
+            self, fetch_videos_patch, update_channel_info_patch,
+            api_fetch_videos_patch):
+        Channel.objects.create()
+        ApiUsage.objects.record({'videos': (9, 9, 1.0)})
+
+        call_command('update_channels', '--quota-budget', '100')
+
+        self.assertFalse(update_channel_info_patch.called)
+        self.assertFalse(fetch_videos_patch.called)
+        self.assertFalse(api_fetch_videos_patch.called)
+
+
+class PlanBudgetTest(TestCase):
+    def test(self):
+        # 1 + 10 * 2 units for the channels and 2 for 100 videos.
+        self.assertEqual(plan_budget(10, 23, False, False, 100),
+                         (10, 1, 100))
+
+    def test__not_enough_for_all_channels(self):
+        self.assertEqual(plan_budget(10, 11, False, False, 100),
+                         (5, 1, 0))
+
+    def test__deleted_check_limited(self):
+        self.assertEqual(plan_budget(1, 4, False, False, 500),
+                         (1, 1, 50))
+
+    def test__extra_pages(self):
+        # 1 + 2 * 2 units for the first pages, 1 unit for deleted videos,
+        # leaving 11 units for 2 extra pages per channel.
+        self.assertEqual(plan_budget(2, 17, False, True, 50),
+                         (2, 3, 50))
+        self.assertEqual(plan_budget(2, 17, False, False, 50),
+                         (2, 1, 50))
+
+    def test__no_budget(self):
+        self.assertEqual(plan_budget(10, -5, True, False, 500),
+                         (0, 1, 0))
+
+
+class UpdateChannelCountersTest(TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger(
+            'youtube.management.commands.update_channel_counters')
+        self.logger.disabled = True
+
+    def tearDown(self):
+        self.logger.disabled = False
+
+    def test(self):
+        channel = Channel.objects.create()
+        Video.objects.create(
+            category=Category.objects.create(
+                id=1,
+            ),
+            uploader=channel,
+        )
+
+        call_command('update_channel_counters')
+
+        channel.refresh_from_db()
+        self.assertEqual(channel.video_count, 1)
+        self.assertEqual(channel.total_video_count, 1)
+
+
+class ProcessJobsTest(TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger(
+            'youtube.management.commands.process_jobs')
+        self.logger.disabled = True
+
+    def tearDown(self):
+        self.logger.disabled = False
+
+    @mock.patch.object(Job, 'run')
+    def test__once(self, run_patch):
+        channel = Channel.objects.create()
+        Job.objects.enqueue(channel, Job.ADD)
+        Job.objects.enqueue(channel, Job.FETCH)
+
+        call_command('process_jobs', '--once')
+
+        self.assertEqual(run_patch.call_count, 2)
+        self.assertFalse(Job.objects.filter(status=Job.QUEUED).exists())
+
+    @mock.patch('youtube.management.commands.process_jobs.time')
+    @mock.patch.object(Job, 'run')
+    def test__wait_for_jobs(self, run_patch, time_patch):
+        time_patch.sleep.side_effect = KeyboardInterrupt()
+
+        with self.assertRaises(KeyboardInterrupt):
+            call_command('process_jobs', '--sleep', '2')
+
+        time_patch.sleep.assert_called_with(2)
+        self.assertFalse(run_patch.called)
+
+
+class BenchmarkParsersTest(TestCase):
+    def test(self):
+        out = io.StringIO()
+
+        call_command('benchmark_parsers', '--number', '1', stdout=out)
+
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[0].startswith('parse_duration '))
+
+
+@mock.patch.object(connection.creation, 'destroy_test_db')
+@mock.patch.object(connection.creation, 'create_test_db')
+class BenchmarkTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.baseline = os.path.join(self.directory, 'baseline.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def benchmark(self, *args, **kwargs):
+        out = io.StringIO()
+        call_command(
+            'benchmark', '--channels', '2',
+            '--videos', str(kwargs.get('videos', 80)),
+            '--ingest-channels', '1', '--ingest-videos', '60',
+            '--pages', '2', '--repeat', '1', *args, stdout=out)
+        return out.getvalue()
+
+    def test__many_videos(
+            self, create_test_db_patch, destroy_test_db_patch):
+        out = self.benchmark(videos=600)
+
+        self.assertIn('Seeded 1200 videos', out)
+
+    def test__uncached_pages(
+            self, create_test_db_patch, destroy_test_db_patch):
+        timeouts = []
+        get = BenchmarkCommand.get
+
+        def get_patch(command, client, url):
+            timeouts.append(settings.YOUTUBE_PAGE_CACHE_TIMEOUT)
+            return get(command, client, url)
+
+        fragments = caches['template_fragments']
+        with mock.patch.object(BenchmarkCommand, 'get', get_patch), \
+                mock.patch.object(
+                    fragments, 'clear', wraps=fragments.clear) as clear_patch:
+            self.benchmark('--repeat', '2')
+
+        self.assertEqual(set(timeouts), {0})
+        # Cleared before each walk through the index and channel pages.
+        self.assertGreaterEqual(clear_patch.call_count, 4)
+
+    def test(self, create_test_db_patch, destroy_test_db_patch):
+        out = self.benchmark('--save', self.baseline)
+
+        self.assertTrue(create_test_db_patch.called)
+        self.assertTrue(destroy_test_db_patch.called)
+        with open(self.baseline) as f:
+            results = json.load(f)
+        self.assertEqual(sorted(results), [
+            'admin', 'channel', 'index', 'ingest', 'search',
+            'search_ranked'])
+        self.assertEqual(results['index']['count'], 2)
+        self.assertIn('index', out)
+        self.assertEqual(Video.objects.filter(
+            youtubeid__startswith='fake').count(), 60)
+
+    def test__compare(self, create_test_db_patch, destroy_test_db_patch):
+        with open(self.baseline, 'w') as f:
+            json.dump({'index': {'p50': 1000000, 'queries': 100}}, f)
+
+        out = self.benchmark('--compare', self.baseline)
+
+        self.assertIn('queries 100 ->', out)
+
+    def test__compare__regression(
+            self, create_test_db_patch, destroy_test_db_patch):
+        with open(self.baseline, 'w') as f:
+            json.dump({'index': {'p50': 1000000, 'queries': 0}}, f)
+
+        with self.assertRaises(CommandError):
+            self.benchmark('--compare', self.baseline)
+
+
+class PercentileTest(TestCase):
+    def test(self):
+        values = list(range(1, 101))
 
-        self.assertTrue(requests_patch.head.called)
-        self.assertTrue(requests_patch.head().raise_for_status)
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([3], 99), 3)
@@ -0,0 +1,156 @@
+from __future__ import unicode_literals
+import json
+import os
+import shutil
+import tempfile
+
+import mock
+import requests
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from ..fakeapi import FakeYoutubeAdapter, RecordingAdapter, fixture_path
+from ..models import Channel
+from ..youtubeapi import (
+    API_URL,
+    NotModified,
+    check_channel_id_exists,
+    create_session,
+    fetch_channel_id_for_author,
+    fetch_channels_info,
+    fetch_videocategories,
+    fetch_videos,
+    fetch_videos_from_playlist,
+    set_session,
+)
+
+
+@override_settings(YOUTUBE_API_ETAG_CACHE='default')
+class FakeYoutubeAdapterTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.adapter = FakeYoutubeAdapter(
+            CHANNELS=3, VIDEOS_PER_CHANNEL=120, CATEGORIES=5, LATENCY=0,
+            FIXTURES=None)
+        set_session(create_session(self.adapter))
+
+    def tearDown(self):
+        set_session(None)
+
+    def test__channels(self):
+        self.assertEqual(fetch_channel_id_for_author('fake1'), 'UCfake000001')
+        self.assertIsNone(fetch_channel_id_for_author('fake3'))
+        self.assertTrue(check_channel_id_exists('UCfake000002'))
+        self.assertFalse(check_channel_id_exists('UCother'))
+
+        items = fetch_channels_info(['UCfake000000', 'UCfake000003'])
+        self.assertEqual([item['id'] for item in items], ['UCfake000000'])
+        self.assertEqual(
+            items[0]['contentDetails']['relatedPlaylists']['uploads'],
+            'UUfake000000')
+
+    def test__playlist_items(self):
+        items, next_page_token = fetch_videos_from_playlist('UUfake000001')
+        self.assertEqual(len(items), 50)
+        self.assertEqual(
+            items[0]['contentDetails']['videoId'], 'fake000001v000000')
+
+        items, next_page_token = fetch_videos_from_playlist(
+            'UUfake000001', next_page_token='100')
+        self.assertEqual(len(items), 20)
+        self.assertIsNone(next_page_token)
+
+        with self.assertRaises(requests.exceptions.HTTPError):
+            fetch_videos_from_playlist('UUother')
+
+    def test__videos(self):
+        items = fetch_videos(['fake000001v000000', 'fake000001v000200'])
+
+        self.assertEqual(len(items), 1)
+        self.assertEqual(items[0]['id'], 'fake000001v000000')
+        self.assertEqual(items[0], self.adapter.dataset.video(1, 0))
+        self.assertEqual(
+            items[0]['snippet']['publishedAt'], '2019-12-31T22:00:00.000Z')
+
+    def test__video_categories(self):
+        items = fetch_videocategories([1, 6])
+
+        self.assertEqual([item['id'] for item in items], ['1'])
+
+    def test__not_modified(self):
+        fetch_videos_from_playlist('UUfake000001', conditional=True)
+
+        with self.assertRaises(NotModified):
+            fetch_videos_from_playlist('UUfake000001', conditional=True)
+
+    @mock.patch('youtube.fakeapi.time')
+    def test__latency(self, time_patch):
+        self.adapter.latency = 0.5
+
+        fetch_videos(['fake000001v000000'])
+
+        time_patch.sleep.assert_called_with(0.5)
+
+    def test__fetch_videos(self):
+        channel = Channel.objects.create(
+            channelid='UCfake000002', author='fake2')
+        channel.update_channel_info()
+
+        self.assertEqual(channel.fetch_videos(full_fetch=True), 120)
+
+        channel.refresh_from_db()
+        self.assertEqual(channel.title, 'Fake channel 2')
+        self.assertEqual(channel.video_count, 120)
+        # The first fast fetch stores the ETag of the first page, after which
+        # nothing is fetched until the channel uploads.
+        self.assertEqual(channel.fetch_videos(), 50)
+        self.assertEqual(channel.fetch_videos(), 0)
+
+
+class FixturesTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        set_session(None)
+
+    def test__record_and_replay(self):
+        fake = FakeYoutubeAdapter(CHANNELS=1, FIXTURES=None)
+        adapter = RecordingAdapter(fixtures=self.directory)
+        with mock.patch(
+                'requests.adapters.HTTPAdapter.send', side_effect=fake.send):
+            set_session(create_session(adapter))
+            recorded = fetch_videos_from_playlist('UUfake000000')
+
+        set_session(create_session(
+            FakeYoutubeAdapter(FIXTURES=self.directory)))
+
+        self.assertEqual(fetch_videos_from_playlist('UUfake000000'), recorded)
+        with self.assertRaises(requests.exceptions.HTTPError):
+            fetch_videos_from_playlist('UUfake000001')
+
+    def test__fixture_path(self):
+        request = requests.Request(
+            'GET', API_URL + 'videos', params={'id': 'a', 'key': 'secret'},
+        ).prepare()
+
+        path = fixture_path(self.directory, request)
+
+        self.assertTrue(path.startswith(
+            os.path.join(self.directory, 'videos', '')))
+        self.assertEqual(path, fixture_path(self.directory, requests.Request(
+            'GET', API_URL + 'videos', params={'id': 'a'}).prepare()))
+
+    def test__replay(self):
+        request = requests.Request(
+            'GET', API_URL + 'videos', params={'part': 'id', 'id': 'a'},
+        ).prepare()
+        path = fixture_path(self.directory, request)
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            json.dump({'items': [{'id': 'a'}]}, f)
+        set_session(create_session(
+            FakeYoutubeAdapter(FIXTURES=self.directory)))
+
+        self.assertEqual(fetch_videos(['a'], parts=('id',)), [{'id': 'a'}])
@@ -0,0 +1,144 @@
+from __future__ import unicode_literals
+import datetime
+import xml.etree.ElementTree as ET
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from ..models import Category, Channel, Video
+
+ATOM = '{http://www.w3.org/2005/Atom}'
+
+
+class VideoFeedTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.channel = Channel.objects.create(
+            channelid='channelid', author='testauthor', title='Test channel')
+        self.category = Category.objects.create(pk=1, category='testcategory')
+        Video.objects.create(
+            youtubeid='video1', uploader=self.channel, category=self.category,
+            title='first video', description='about cooking')
+        Video.objects.create(
+            youtubeid='video2', uploader=self.channel, category=self.category,
+            title='second video', description='about music')
+        Video.objects.create(
+            youtubeid='video3', uploader=self.channel, category=self.category,
+            title='deleted video', deleted=True)
+        self.channel.update_counters()
+
+    def get_entries(self, url, **kwargs):
+        resp = self.client.get(url, **kwargs)
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(
+            resp['Content-Type'].startswith('application/atom+xml'))
+        feed = ET.fromstring(resp.content)
+        return feed, [
+            entry.find(ATOM + 'title').text
+            for entry in feed.findall(ATOM + 'entry')]
+
+    def test__index(self):
+        feed, entries = self.get_entries(reverse('feed'))
+
+        self.assertEqual(feed.find(ATOM + 'title').text, 'New youtube videos')
+        self.assertEqual(
+            sorted(entries), ['first video', 'second video'])
+        entry = feed.find(ATOM + 'entry')
+        self.assertTrue(entry.find(ATOM + 'link').get('href').startswith(
+            'https://www.youtube.com/watch?v=video'))
+        self.assertEqual(
+            entry.find(ATOM + 'author').find(ATOM + 'name').text,
+            'Test channel')
+
+    def test__index__hidden_channel(self):
+        self.channel.hidden = True
+        self.channel.save()
+
+        feed, entries = self.get_entries(reverse('feed'))
+
+        self.assertEqual(entries, [])
+
+    def test__search(self):
+        feed, entries = self.get_entries(reverse('feed'), data={'q': 'music'})
+
+        self.assertEqual(
+            feed.find(ATOM + 'title').text,
+            'New youtube videos matching "music"')
+        self.assertEqual(entries, ['second video'])
+
+    def test__channel(self):
+        Channel.objects.create(channelid='other', author='other')
+
+        feed, entries = self.get_entries(reverse('channel-feed', kwargs={
+            'author': 'testauthor',
+        }))
+
+        self.assertEqual(
+            feed.find(ATOM + 'title').text, 'New videos from Test channel')
+        self.assertEqual(sorted(entries), ['first video', 'second video'])
+
+    def test__channel__not_found(self):
+        resp = self.client.get(reverse('channel-feed', kwargs={
+            'author': 'unknown',
+        }))
+
+        self.assertEqual(resp.status_code, 404)
+
+    def test__cached(self):
+        self.client.get(reverse('feed'))
+
+        with CaptureQueriesContext(connection) as queries:
+            feed, entries = self.get_entries(reverse('feed'))
+
+        self.assertEqual(len(entries), 2)
+        # Only the validators are computed, from the channels.
+        self.assertEqual(len(queries), 1)
+
+    def test__cached__new_video(self):
+        self.client.get(reverse('feed'))
+        Video.objects.create(
+            youtubeid='video4', uploader=self.channel, category=self.category,
+            title='third video')
+        self.channel.update_counters()
+
+        feed, entries = self.get_entries(reverse('feed'))
+
+        self.assertIn('third video', entries)
+
+    def test__conditional_get(self):
+        resp = self.client.get(reverse('feed'))
+
+        resp = self.client.get(
+            reverse('feed'), HTTP_IF_NONE_MATCH=resp['ETag'])
+
+        self.assertEqual(resp.status_code, 304)
+
+    def test__conditional_get__if_modified_since(self):
+        # Uploaded long before the channel was updated.
+        uploaded = datetime.datetime(2019, 12, 1, tzinfo=timezone.utc)
+        Video.objects.update(uploaded=uploaded, updated=uploaded)
+        self.channel.update_counters()
+        resp = self.client.get(reverse('feed'))
+        last_modified = resp['Last-Modified']
+        # Served from the page cache.
+        self.assertEqual(
+            self.client.get(reverse('feed'))['Last-Modified'], last_modified)
+
+        resp = self.client.get(
+            reverse('feed'), HTTP_IF_MODIFIED_SINCE=last_modified)
+
+        self.assertEqual(resp.status_code, 304)
+
+    def test__link(self):
+        resp = self.client.get(reverse('channel', kwargs={
+            'author': 'testauthor',
+        }), {'q': 'a b'})
+
+        self.assertContains(
+            resp, 'href="%s?q=a%%20b"' % reverse('channel-feed', kwargs={
+                'author': 'testauthor',
+            }))
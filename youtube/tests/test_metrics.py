@@ -0,0 +1,159 @@
+from __future__ import unicode_literals
+
+import mock
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from .. import metrics
+from ..youtubeapi import _request
+
+
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        metrics.reset()
+
+    def tearDown(self):
+        metrics.reset()
+
+
+class MetricsTest(MetricsTestCase):
+    def test__counter(self):
+        metrics.API_CALLS.inc(endpoint='videos', status=200)
+        metrics.API_CALLS.inc(2, endpoint='videos', status=200)
+        metrics.API_CALLS.inc(endpoint='videos', status=404)
+
+        self.assertEqual(metrics.API_CALLS.samples(), [
+            {'labels': {'endpoint': 'videos', 'status': '200'}, 'value': 3},
+            {'labels': {'endpoint': 'videos', 'status': '404'}, 'value': 1},
+        ])
+
+    def test__counter__missing_label(self):
+        with self.assertRaises(KeyError):
+            metrics.API_CALLS.inc(endpoint='videos')
+
+    def test__histogram(self):
+        metrics.CHANNEL_SECONDS.observe(0.01)
+        metrics.CHANNEL_SECONDS.observe(0.3)
+        metrics.CHANNEL_SECONDS.observe(100)
+
+        value = metrics.CHANNEL_SECONDS.samples()[0]['value']
+        self.assertEqual(value['buckets'], [1, 0, 0, 1, 0, 0, 0, 0, 0, 0, 1])
+        self.assertEqual(value['count'], 3)
+        self.assertAlmostEqual(value['sum'], 100.31)
+
+    def test__merge(self):
+        metrics.API_RETRIES.inc()
+        metrics.CHANNEL_SECONDS.observe(1)
+        metrics.CHANNEL_LAST_SECONDS.set(1, channel='a')
+        old = metrics.snapshot()
+        metrics.reset()
+        metrics.API_RETRIES.inc()
+        metrics.CHANNEL_SECONDS.observe(2)
+        metrics.CHANNEL_LAST_SECONDS.set(2, channel='a')
+        metrics.CHANNEL_LAST_SECONDS.set(3, channel='b')
+
+        merged = metrics.merge(old, metrics.snapshot())
+
+        self.assertEqual(
+            merged['youtube_api_retries_total']['samples'][0]['value'], 2)
+        self.assertEqual(
+            merged['youtube_channel_update_seconds']['samples'][0]['value'][
+                'count'], 2)
+        self.assertEqual(
+            merged['youtube_channel_last_update_seconds']['samples'], [
+                {'labels': {'channel': 'a'}, 'value': 2},
+                {'labels': {'channel': 'b'}, 'value': 3},
+            ])
+
+    def test__save(self):
+        metrics.VIDEOS.inc(5, result='created')
+        saved = metrics.save()
+        metrics.VIDEOS.inc(2, result='created')
+        metrics.save()
+
+        self.assertEqual(
+            saved['youtube_videos_total']['samples'][0]['value'], 5)
+        self.assertEqual(
+            metrics.load()['youtube_videos_total']['samples'][0]['value'], 7)
+        self.assertEqual(metrics.VIDEOS.samples(), [])
+
+    def test__save__histogram_and_gauge(self):
+        metrics.CHANNEL_SECONDS.observe(0.3)
+        metrics.CHANNEL_LAST_SECONDS.set(1, channel='a')
+        metrics.save()
+        metrics.CHANNEL_SECONDS.observe(100)
+        metrics.CHANNEL_LAST_SECONDS.set(2, channel='a')
+        metrics.save()
+
+        loaded = metrics.load()
+        self.assertEqual(
+            loaded['youtube_channel_update_seconds']['samples'][0]['value'],
+            {'buckets': [0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 1],
+             'sum': 100.3, 'count': 2})
+        self.assertEqual(
+            loaded['youtube_channel_last_update_seconds']['samples'],
+            [{'labels': {'channel': 'a'}, 'value': 2}])
+
+    def test__render(self):
+        metrics.API_CALLS.inc(endpoint='videos', status=200)
+        metrics.API_SECONDS.observe(0.2, endpoint='videos')
+        metrics.CHANNEL_LAST_SECONDS.set(1.5, channel='a "b"')
+
+        text = metrics.render(metrics.snapshot())
+
+        self.assertIn(
+            '# TYPE youtube_api_calls_total counter\n'
+            'youtube_api_calls_total{endpoint="videos",status="200"} 1\n',
+            text)
+        self.assertIn(
+            'youtube_api_request_seconds_bucket{endpoint="videos",le="0.1"} '
+            '0\n'
+            'youtube_api_request_seconds_bucket{endpoint="videos",le="0.25"} '
+            '1\n', text)
+        self.assertIn(
+            'youtube_api_request_seconds_bucket{endpoint="videos",le="+Inf"} '
+            '1\n'
+            'youtube_api_request_seconds_sum{endpoint="videos"} 0.2\n'
+            'youtube_api_request_seconds_count{endpoint="videos"} 1\n', text)
+        self.assertIn(
+            'youtube_channel_last_update_seconds{channel="a \\"b\\""} 1.5\n',
+            text)
+
+
+class MetricsViewTest(MetricsTestCase):
+    def test__get(self):
+        metrics.VIDEOS.inc(5, result='created')
+        metrics.save()
+        metrics.VIDEOS.inc(1, result='created')
+
+        resp = self.client.get(reverse('metrics'))
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp['Content-Type'].startswith('text/plain'))
+        self.assertContains(resp, 'youtube_videos_total{result="created"} 6')
+
+    @override_settings(YOUTUBE_METRICS_TOKEN='secret')
+    def test__get__token(self):
+        resp = self.client.get(reverse('metrics'))
+
+        self.assertEqual(resp.status_code, 403)
+
+        resp = self.client.get(
+            reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+
+        self.assertEqual(resp.status_code, 200)
+
+
+class InstrumentationTest(MetricsTestCase):
+    @mock.patch('youtube.youtubeapi.get_session')
+    def test__api_calls(self, get_session_patch):
+        get_session_patch.return_value.get.return_value.status_code = 200
+
+        _request('videos', {})
+
+        self.assertEqual(metrics.API_CALLS.samples(), [
+            {'labels': {'endpoint': 'videos', 'status': '200'}, 'value': 1}])
+        self.assertEqual(metrics.API_QUOTA_UNITS.samples(), [
+            {'labels': {'endpoint': 'videos'}, 'value': 1}])
+        self.assertEqual(
+            metrics.API_SECONDS.samples()[0]['value']['count'], 1)
@@ -3,10 +3,15 @@ import datetime
 import mock
 
 import pytz
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
-from ..models import Channel, Category, Video
+from ..models import (
+    ApiUsage, Channel, Category, Job, MetricValue, MetricValueQuerySet, Video)
+from ..youtubeapi import NotModified
+from .. import search
 
 
 class ChannelTest(TestCase):
@@ -40,7 +45,38 @@ class ChannelTest(TestCase):
         self.assertEqual(
             self.channel.thumbnail, 'http://example.com/image.png')
         self.assertEqual(self.channel.uploads_playlist, 'uploadschannelid')
-        fetch_channel_info_patch.assert_called_with(self.channel.channelid)
+        fetch_channel_info_patch.assert_called_with(
+            self.channel.channelid, conditional=False)
+
+    @mock.patch('youtube.models.fetch_channel_info')
+    def test__update_channel_info__not_modified(
+            self, fetch_channel_info_patch):
+        self.channel.title = 'testchannel'
+        self.channel.thumbnail = 'http://example.com/image.png'
+        self.channel.uploads_playlist = 'uploadschannelid'
+        self.channel.save()
+        fetch_channel_info_patch.side_effect = NotModified({'items': [{
+            'snippet': {
+                'title': 'testchannel',
+                'thumbnails': {
+                    'default': {
+                        'url': 'http://example.com/image.png',
+                    },
+                },
+            },
+            'contentDetails': {
+                'relatedPlaylists': {
+                    'uploads': 'uploadschannelid',
+                },
+            },
+        }]})
+
+        with mock.patch.object(Channel, 'save') as save_patch:
+            self.channel.update_channel_info()
+
+        self.assertFalse(save_patch.called)
+        fetch_channel_info_patch.assert_called_with(
+            self.channel.channelid, conditional=True)
 
     @mock.patch('youtube.models.fetch_channel_info')
     def test__update_channel_info__no_save(self, fetch_channel_info_patch):
@@ -66,14 +102,15 @@ class ChannelTest(TestCase):
         self.assertEqual(self.channel.thumbnail,
                          'http://example.com/image.png')
         self.assertEqual(self.channel.uploads_playlist, 'uploadschannelid')
-        fetch_channel_info_patch.assert_called_with(self.channel.channelid)
+        fetch_channel_info_patch.assert_called_with(
+            self.channel.channelid, conditional=False)
 
     @mock.patch('youtube.models.fetch_videos')
     @mock.patch('youtube.models.fetch_videos_from_playlist')
     @mock.patch.object(Category.objects, 'get_categoryids')
-    @mock.patch.object(Video.objects, 'create_or_update')
+    @mock.patch.object(Video.objects, 'bulk_create_or_update')
     def test__fetch_videos(
-            self, create_or_update_patch,
+            self, bulk_create_or_update_patch,
             get_categoryids_patch,
             fetch_videos_from_playlist_patch,
             fetch_videos_patch):
@@ -97,17 +134,17 @@ class ChannelTest(TestCase):
         self.channel.fetch_videos()
 
         self.assertTrue(get_categoryids_patch.called)
-        self.assertTrue(create_or_update_patch.called)
+        self.assertTrue(bulk_create_or_update_patch.called)
         fetch_videos_from_playlist_patch.assert_called_with(
-            self.channel.channelid, next_page_token=None)
+            self.channel.channelid, next_page_token=None, conditional=True)
         fetch_videos_patch.assert_called_with({'abcdef'})
 
     @mock.patch('youtube.models.fetch_videos')
     @mock.patch('youtube.models.fetch_videos_from_playlist')
     @mock.patch.object(Category.objects, 'get_categoryids')
-    @mock.patch.object(Video.objects, 'create_or_update')
+    @mock.patch.object(Video.objects, 'bulk_create_or_update')
     def test__fetch_videos__full_fetch(
-            self, create_or_update_patch,
+            self, bulk_create_or_update_patch,
             get_categoryids_patch,
             fetch_videos_from_playlist_patch,
             fetch_videos_patch):
@@ -131,11 +168,241 @@ class ChannelTest(TestCase):
         self.channel.fetch_videos(full_fetch=True)
 
         self.assertTrue(get_categoryids_patch.called)
-        self.assertTrue(create_or_update_patch.called)
+        self.assertTrue(bulk_create_or_update_patch.called)
         fetch_videos_from_playlist_patch.assert_called_with(
-            self.channel.channelid, next_page_token=None)
+            self.channel.channelid, next_page_token=None, conditional=False)
         fetch_videos_patch.assert_called_with({'abcdef'})
 
+    @mock.patch('youtube.models.fetch_videos')
+    @mock.patch('youtube.models.fetch_videos_from_playlist')
+    @mock.patch.object(Channel, 'store_videos')
+    def test__fetch_videos__incremental(
+            self, store_videos_patch,
+            fetch_videos_from_playlist_patch,
+            fetch_videos_patch):
+        Video.objects.create(
+            youtubeid='known',
+            category=Category.objects.create(pk=1, category='testcategory'),
+            uploader=self.channel,
+        )
+        fetch_videos_from_playlist_patch.side_effect = [
+            ([{'contentDetails': {'videoId': 'new'}}], 'page2'),
+            ([{'contentDetails': {'videoId': 'known'}}], 'page3'),
+            ([{'contentDetails': {'videoId': 'old'}}], None),
+        ]
+        fetch_videos_patch.return_value = []
+        store_videos_patch.return_value = 1
+
+        self.assertEqual(self.channel.fetch_videos(incremental=True), 2)
+
+        self.assertEqual(fetch_videos_from_playlist_patch.call_count, 2)
+        fetch_videos_from_playlist_patch.assert_called_with(
+            self.channel.uploads_playlist, next_page_token='page2',
+            conditional=False)
+        fetch_videos_patch.assert_called_with({'known'})
+
+    @mock.patch('youtube.models.fetch_videos')
+    @mock.patch('youtube.models.fetch_videos_from_playlist')
+    @mock.patch.object(Channel, 'store_videos')
+    def test__fetch_videos__max_pages(
+            self, store_videos_patch,
+            fetch_videos_from_playlist_patch,
+            fetch_videos_patch):
+        fetch_videos_from_playlist_patch.side_effect = [
+            ([{'contentDetails': {'videoId': 'a'}}], 'page2'),
+            ([{'contentDetails': {'videoId': 'b'}}], 'page3'),
+            ([{'contentDetails': {'videoId': 'c'}}], None),
+        ]
+        fetch_videos_patch.return_value = []
+        store_videos_patch.return_value = 1
+
+        self.assertEqual(
+            self.channel.fetch_videos(full_fetch=True, max_pages=2), 2)
+
+        self.assertEqual(fetch_videos_from_playlist_patch.call_count, 2)
+
+    @mock.patch('youtube.models.fetch_videos')
+    @mock.patch('youtube.models.fetch_videos_from_playlist')
+    def test__fetch_videos__not_modified(
+            self, fetch_videos_from_playlist_patch, fetch_videos_patch):
+        Video.objects.create(
+            youtubeid='known',
+            category=Category.objects.create(pk=1, category='testcategory'),
+            uploader=self.channel,
+        )
+        fetch_videos_from_playlist_patch.side_effect = NotModified({
+            'items': [{'contentDetails': {'videoId': 'known'}}],
+        })
+
+        self.assertEqual(self.channel.fetch_videos(), 0)
+
+        self.assertFalse(fetch_videos_patch.called)
+
+    @mock.patch('youtube.models.fetch_videos')
+    @mock.patch('youtube.models.fetch_videos_from_playlist')
+    @mock.patch.object(Channel, 'store_videos')
+    def test__fetch_videos__not_modified__unknown_videos(
+            self, store_videos_patch, fetch_videos_from_playlist_patch,
+            fetch_videos_patch):
+        fetch_videos_from_playlist_patch.side_effect = NotModified({
+            'items': [{'contentDetails': {'videoId': 'unknown'}}],
+        })
+        fetch_videos_patch.return_value = []
+        store_videos_patch.return_value = 1
+
+        self.assertEqual(self.channel.fetch_videos(), 1)
+
+        fetch_videos_patch.assert_called_with({'unknown'})
+
+    def create_uploads(self, now, days):
+        category = Category.objects.create(pk=1, category='testcategory')
+        for idx, day in enumerate(days):
+            Video.objects.create(
+                youtubeid=str(idx), category=category, uploader=self.channel,
+                uploaded=now - datetime.timedelta(days=day))
+
+    def test__schedule_refresh(self):
+        now = timezone.now()
+        self.create_uploads(now, [0.5, 1.5, 2.5])
+
+        self.channel.schedule_refresh(now)
+
+        self.assertEqual(self.channel.upload_interval, 24 * 60 * 60)
+        self.assertEqual(
+            self.channel.next_refresh, now + datetime.timedelta(hours=6))
+
+    def test__schedule_refresh__dormant(self):
+        now = timezone.now()
+        self.create_uploads(now, [4, 5])
+
+        self.channel.schedule_refresh(now)
+
+        self.assertEqual(self.channel.upload_interval, 24 * 60 * 60)
+        self.assertEqual(
+            self.channel.next_refresh, now + datetime.timedelta(days=1))
+
+    def test__schedule_refresh__limits(self):
+        now = timezone.now()
+        self.create_uploads(now, [0, 0.01, 60, 90])
+        Video.objects.filter(youtubeid__in=['2', '3']).update(deleted=True)
+
+        self.channel.schedule_refresh(now)
+        self.assertEqual(
+            self.channel.next_refresh, now + datetime.timedelta(hours=1))
+
+        Video.objects.update(deleted=False)
+        self.channel.schedule_refresh(now)
+        self.assertEqual(
+            self.channel.next_refresh, now + datetime.timedelta(days=2))
+
+    def test__schedule_refresh__no_videos(self):
+        now = timezone.now()
+
+        self.channel.schedule_refresh(now)
+
+        self.assertIsNone(self.channel.upload_interval)
+        self.assertEqual(
+            self.channel.next_refresh, now + datetime.timedelta(days=2))
+
+    def test__update_counters(self):
+        category = Category.objects.create(pk=1, category='testcategory')
+        for idx in range(3):
+            Video.objects.create(
+                youtubeid='video%s' % idx, uploader=self.channel,
+                category=category, deleted=idx == 2,
+                uploaded=timezone.make_aware(
+                    datetime.datetime(2014, 1, 1 + idx), timezone.utc))
+
+        with self.assertNumQueries(2):
+            self.channel.update_counters()
+
+        self.assertEqual(self.channel.video_count, 2)
+        self.assertEqual(self.channel.total_video_count, 3)
+        self.assertEqual(
+            self.channel.latest_upload,
+            timezone.make_aware(datetime.datetime(2014, 1, 2), timezone.utc))
+
+    def test__update_counters__no_videos(self):
+        self.channel.video_count = 10
+        self.channel.save()
+
+        Channel.objects.all().update_counters()
+
+        self.channel.refresh_from_db()
+        self.assertEqual(self.channel.video_count, 0)
+        self.assertEqual(self.channel.total_video_count, 0)
+        self.assertIsNone(self.channel.latest_upload)
+
+
+def channel_info(channelid, title):
+    return {
+        'id': channelid,
+        'snippet': {
+            'title': title,
+            'thumbnails': {
+                'default': {
+                    'url': 'http://example.com/image.png',
+                },
+            },
+        },
+        'contentDetails': {
+            'relatedPlaylists': {
+                'uploads': 'uploads%s' % channelid,
+            },
+        },
+    }
+
+
+class ChannelQuerySetTest(TestCase):
+    def test__due(self):
+        now = timezone.now()
+        unscheduled = Channel.objects.create(channelid='a', author='a')
+        due = Channel.objects.create(
+            channelid='b', author='b', next_refresh=now)
+        Channel.objects.create(
+            channelid='c', author='c',
+            next_refresh=now + datetime.timedelta(seconds=1))
+
+        self.assertEqual(
+            set(Channel.objects.due(now)), set([unscheduled, due]))
+
+    @mock.patch('youtube.models.fetch_channels_info')
+    def test__update_channel_info(self, fetch_channels_info_patch):
+        for idx in range(60):
+            Channel.objects.create(channelid='c%02d' % idx, author=idx)
+        fetch_channels_info_patch.side_effect = lambda ids, conditional: [
+            channel_info(channelid, 'title') for channelid in ids
+            if channelid != 'c59']
+
+        with self.assertNumQueries(2):
+            changed = Channel.objects.order_by(
+                'channelid').update_channel_info()
+
+        self.assertEqual(len(changed), 59)
+        self.assertEqual(fetch_channels_info_patch.call_count, 2)
+        fetch_channels_info_patch.assert_called_with(
+            ['c%02d' % idx for idx in range(50, 60)], conditional=True)
+        channel = Channel.objects.get(channelid='c00')
+        self.assertEqual(channel.title, 'title')
+        self.assertEqual(channel.uploads_playlist, 'uploadsc00')
+        # Channels missing from the response are left untouched.
+        channel = Channel.objects.get(channelid='c59')
+        self.assertEqual(channel.uploads_playlist, '')
+
+    @mock.patch('youtube.models.fetch_channels_info')
+    def test__update_channel_info__not_modified(
+            self, fetch_channels_info_patch):
+        Channel.objects.create(
+            channelid='c1', title='title', uploads_playlist='uploadsc1',
+            thumbnail='http://example.com/image.png')
+        fetch_channels_info_patch.side_effect = NotModified({
+            'items': [channel_info('c1', 'title')]})
+
+        with self.assertNumQueries(1):
+            changed = Channel.objects.all().update_channel_info()
+
+        self.assertEqual(changed, [])
+
 
 class CategoryQuerySetTest(TestCase):
     def test__empty_ids(self):
@@ -235,3 +502,385 @@ class VideoQuerySetTest(TestCase):
         self.assertIsNotNone(video.uploaded)
         self.assertEqual(video.updated.astimezone(pytz.utc),
                          uploaded.astimezone(pytz.utc))
+
+    def test__create_or_update__unchanged_video(self):
+        Video.objects.create_or_update(self.channel, self.videodata)
+
+        with self.assertNumQueries(1):
+            Video.objects.create_or_update(self.channel, self.videodata)
+
+    def test__bulk_create_or_update(self):
+        Video.objects.create(
+            youtubeid='abcdef',
+            category=self.category,
+            uploader=self.channel,
+            duration=123,
+        )
+        newdata = dict(self.videodata, id='ghijkl')
+
+        with self.assertNumQueries(3):
+            result = Video.objects.bulk_create_or_update(
+                self.channel, [self.videodata, newdata])
+
+        self.assertEqual(
+            result, {'created': 1, 'updated': 1, 'unchanged': 0})
+        uploaded = timezone.make_aware(
+            datetime.datetime(2014, 1, 1, 12), timezone.get_current_timezone())
+        for video in Video.objects.all():
+            self.assertEqual(video.duration, 3 * 60 + 40)
+            self.assertEqual(video.uploader, self.channel)
+            self.assertEqual(video.category, self.category)
+            self.assertEqual(video.title, 'testvideo')
+            self.assertEqual(video.view_count, 1000)
+            self.assertEqual(video.uploaded, uploaded)
+            self.assertEqual(video.updated, uploaded)
+        self.assertEqual(Video.objects.count(), 2)
+
+    def test__bulk_create_or_update__empty(self):
+        with self.assertNumQueries(0):
+            result = Video.objects.bulk_create_or_update(self.channel, [])
+
+        self.assertEqual(
+            result, {'created': 0, 'updated': 0, 'unchanged': 0})
+
+    def test__bulk_create_or_update__unchanged(self):
+        newdata = dict(self.videodata, id='ghijkl')
+        Video.objects.bulk_create_or_update(
+            self.channel, [self.videodata, newdata])
+
+        with self.assertNumQueries(1):
+            result = Video.objects.bulk_create_or_update(
+                self.channel, [self.videodata, newdata])
+
+        self.assertEqual(
+            result, {'created': 0, 'updated': 0, 'unchanged': 2})
+
+    def test__bulk_create_or_update__changed_fields(self):
+        otherdata = dict(self.videodata, id='ghijkl')
+        thirddata = dict(self.videodata, id='mnopqr')
+        Video.objects.bulk_create_or_update(
+            self.channel, [self.videodata, otherdata, thirddata])
+        changed = [
+            dict(self.videodata, statistics={
+                'viewCount': '2000', 'favoriteCount': '20'}),
+            dict(otherdata, statistics={
+                'viewCount': '3000', 'favoriteCount': '20'}),
+            dict(thirddata, snippet=dict(
+                thirddata['snippet'], title='newtitle')),
+        ]
+
+        # One query for the lookup, and one update per set of fields changed.
+        with self.assertNumQueries(3):
+            result = Video.objects.bulk_create_or_update(
+                self.channel, changed)
+
+        self.assertEqual(
+            result, {'created': 0, 'updated': 3, 'unchanged': 0})
+        self.assertEqual(
+            Video.objects.get(youtubeid='ghijkl').view_count, 3000)
+        self.assertEqual(
+            Video.objects.get(youtubeid='mnopqr').title, 'newtitle')
+
+    @mock.patch('youtube.models.fetch_videos')
+    def test__mark_deleted(self, fetch_videos_patch):
+        for idx in range(60):
+            Video.objects.create(
+                youtubeid='video%02d' % idx,
+                category=self.category,
+                uploader=self.channel,
+            )
+        fetch_videos_patch.side_effect = lambda ids, parts: [
+            {'id': e} for e in ids if e not in ('video10', 'video55')]
+
+        with CaptureQueriesContext(connection) as queries:
+            result = Video.objects.order_by('youtubeid')[:60].mark_deleted()
+
+        self.assertEqual(result, ['video10', 'video55'])
+        self.assertEqual(fetch_videos_patch.call_count, 2)
+        # One update of the checked videos per chunk, by primary key.
+        self.assertEqual(len([
+            e for e in queries.captured_queries
+            if e['sql'].startswith('UPDATE') and '"checked"' in e['sql']]), 2)
+        self.assertEqual(
+            set(Video.objects.filter(deleted=True).values_list(
+                'youtubeid', flat=True)),
+            {'video10', 'video55'})
+        self.assertFalse(Video.objects.filter(checked=None).exists())
+        self.channel.refresh_from_db()
+        self.assertEqual(self.channel.video_count, 58)
+
+    @mock.patch('youtube.models.fetch_videos')
+    def test__mark_deleted__failed_chunk(self, fetch_videos_patch):
+        for idx in range(60):
+            Video.objects.create(
+                youtubeid='video%02d' % idx,
+                category=self.category,
+                uploader=self.channel,
+            )
+
+        def fetch_videos(ids, parts):
+            if 'video59' in ids:
+                raise ValueError('testerror')
+            return [{'id': e} for e in ids]
+        fetch_videos_patch.side_effect = fetch_videos
+
+        with self.assertRaises(ValueError):
+            Video.objects.order_by('youtubeid').mark_deleted()
+
+        # The first chunk is saved as checked, despite the failure.
+        self.assertEqual(Video.objects.filter(checked=None).count(), 10)
+
+
+class VideoTextSearchTest(TestCase):
+    def setUp(self):
+        channel = Channel.objects.create(
+            author='testchannel',
+        )
+        category = Category.objects.create(
+            pk=1,
+            category='testcategory',
+        )
+        self.video1 = Video.objects.create(
+            youtubeid='video1', uploader=channel, category=category,
+            title='Building a house', description='Bricks and mortar.')
+        self.video2 = Video.objects.create(
+            youtubeid='video2', uploader=channel, category=category,
+            title='Playing games', description='A house of cards.')
+        self.video3 = Video.objects.create(
+            youtubeid='video3', uploader=channel, category=category,
+            title='Cooking', description='')
+
+    def test__empty_query(self):
+        self.assertEqual(Video.objects.text_search('').count(), 3)
+
+    def test__title_and_description(self):
+        self.assertEqual(
+            set(Video.objects.text_search('house')),
+            {self.video1, self.video2})
+
+    def test__prefix_and_case(self):
+        self.assertEqual(
+            list(Video.objects.text_search('BUILD')), [self.video1])
+
+    def test__all_words(self):
+        self.assertEqual(
+            list(Video.objects.text_search('house cards')), [self.video2])
+
+    def test__special_characters(self):
+        self.assertEqual(
+            list(Video.objects.text_search('"cook* (')), [self.video3])
+
+    def test__updated_video(self):
+        self.video3.title = 'Cooking a house'
+        self.video3.save()
+
+        self.assertEqual(
+            set(Video.objects.text_search('house')),
+            {self.video1, self.video2, self.video3})
+
+    def test__deleted_video(self):
+        self.video1.delete()
+
+        self.assertEqual(
+            list(Video.objects.text_search('house')), [self.video2])
+
+    def test__ranked(self):
+        Video.objects.filter(pk=self.video2.pk).update(
+            title='House house house')
+
+        self.assertEqual(
+            list(Video.objects.text_search('house', ranked=True)),
+            [self.video2, self.video1])
+
+    def test__ranked__single_match(self):
+        queryset = Video.objects.text_search('house', ranked=True)
+
+        self.assertEqual(str(queryset.query).upper().count('MATCH'), 1)
+        self.assertEqual(len(queryset.filter(
+            uploader__author='testchannel').select_related('uploader')), 2)
+
+    @mock.patch.object(search, 'is_installed')
+    def test__not_installed(self, is_installed_patch):
+        is_installed_patch.return_value = False
+
+        self.assertEqual(
+            list(Video.objects.text_search('playing')), [self.video2])
+
+
+class ApiUsageQuerySetTest(TestCase):
+    def test__record(self):
+        ApiUsage.objects.record({
+            'videos': (2, 2, 0.5),
+        })
+        ApiUsage.objects.record({
+            'videos': (1, 1, 0.25),
+            'channels': (1, 1, 0.125),
+        })
+
+        usage = ApiUsage.objects.get(endpoint='videos')
+        self.assertEqual(usage.date, timezone.localdate())
+        self.assertEqual(usage.calls, 3)
+        self.assertEqual(usage.units, 3)
+        self.assertEqual(usage.seconds, 0.75)
+        self.assertEqual(ApiUsage.objects.units_used(), 4)
+
+    @mock.patch('youtube.models.pop_usage')
+    def test__record__since_last_time(self, pop_usage_patch):
+        pop_usage_patch.return_value = {'videos': (1, 1, 0.5)}
+
+        ApiUsage.objects.record()
+
+        self.assertEqual(ApiUsage.objects.units_used(), 1)
+
+    def test__units_used(self):
+        yesterday = timezone.localdate() - datetime.timedelta(days=1)
+        ApiUsage.objects.create(date=yesterday, endpoint='videos', units=5)
+
+        self.assertEqual(ApiUsage.objects.units_used(), 0)
+        self.assertEqual(ApiUsage.objects.units_used(yesterday), 5)
+
+
+class MetricValueQuerySetTest(TestCase):
+    def test__record(self):
+        MetricValue.objects.record('a', '{}', {'sum': 1.5, 'count': 1})
+        MetricValue.objects.record('a', '{}', {'sum': 2, 'count': 1})
+        MetricValue.objects.record('b', '{}', {'value': 1}, add=False)
+        MetricValue.objects.record('b', '{}', {'value': 3}, add=False)
+
+        self.assertEqual(
+            dict(MetricValue.objects.filter(name='a').values_list(
+                'field', 'value')),
+            {'sum': 3.5, 'count': 2})
+        self.assertEqual(MetricValue.objects.get(name='b').value, 3)
+
+    def test__record__created_meanwhile(self):
+        MetricValue.objects.create(
+            name='a', labels='{}', field='value', value=1)
+        update = MetricValueQuerySet.update
+        calls = []
+
+        def update_patch(queryset, **kwargs):
+            # The row is created by someone else after the first update.
+            calls.append(kwargs)
+            if len(calls) == 1:
+                return 0
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(MetricValueQuerySet, 'update', update_patch):
+            MetricValue.objects.record('a', '{}', {'value': 1})
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(MetricValue.objects.get(name='a').value, 2)
+
+
+class JobTest(TestCase):
+    def setUp(self):
+        self.channel = Channel.objects.create(author='testauthor')
+
+    def test__enqueue(self):
+        job = Job.objects.enqueue(self.channel, Job.FETCH)
+
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertEqual(Job.objects.enqueue(self.channel, Job.FETCH), job)
+        self.assertNotEqual(
+            Job.objects.enqueue(self.channel, Job.FULL_FETCH), job)
+
+    def test__claim(self):
+        first = Job.objects.enqueue(self.channel, Job.FETCH)
+        second = Job.objects.enqueue(self.channel, Job.FULL_FETCH)
+
+        job = Job.objects.claim()
+        self.assertEqual(job, first)
+        self.assertEqual(job.status, Job.RUNNING)
+        self.assertIsNotNone(job.started)
+        self.assertEqual(Job.objects.claim(), second)
+        self.assertIsNone(Job.objects.claim())
+
+    @override_settings(YOUTUBE_JOB_TIMEOUT=60)
+    def test__claim__stale(self):
+        Job.objects.enqueue(self.channel, Job.FETCH)
+        job = Job.objects.claim()
+        self.assertIsNone(Job.objects.claim())
+
+        Job.objects.filter(pk=job.pk).update(
+            started=timezone.now() - datetime.timedelta(seconds=61))
+
+        claimed = Job.objects.claim()
+        self.assertEqual(claimed, job)
+        self.assertGreater(claimed.started, job.started)
+        self.assertIsNone(Job.objects.claim())
+
+    @mock.patch.object(Channel, 'update_channel_info')
+    @mock.patch.object(Channel, 'fetch_video_pages')
+    @mock.patch.object(Channel, 'store_videos')
+    def test__run(self, store_videos_patch, fetch_video_pages_patch,
+                  update_channel_info_patch):
+        fetch_video_pages_patch.return_value = iter([['a'] * 10, ['b'] * 2])
+        store_videos_patch.side_effect = len
+        Job.objects.enqueue(self.channel, Job.FULL_FETCH)
+
+        job = Job.objects.claim()
+        job.run()
+
+        fetch_video_pages_patch.assert_called_with(full_fetch=True)
+        self.assertEqual(store_videos_patch.call_count, 2)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.DONE)
+        self.assertEqual(job.fetched, 12)
+        self.assertIsNotNone(job.finished)
+        self.channel.refresh_from_db()
+        self.assertIsNotNone(self.channel.next_refresh)
+
+    @mock.patch.object(Channel, 'update_channel_info')
+    @mock.patch.object(Channel, 'fetch_video_pages')
+    @mock.patch.object(Channel, 'store_videos')
+    def test__run__failed_page(
+            self, store_videos_patch, fetch_video_pages_patch,
+            update_channel_info_patch):
+        category = Category.objects.create(pk=1, category='testcategory')
+
+        def store_videos(items):
+            for youtubeid in items:
+                Video.objects.create(
+                    youtubeid=youtubeid, uploader=self.channel,
+                    category=category)
+            if 'video2' in items:
+                raise ValueError('testerror')
+            return len(items)
+        fetch_video_pages_patch.return_value = iter([['video1'], ['video2']])
+        store_videos_patch.side_effect = store_videos
+        Job.objects.enqueue(self.channel, Job.FETCH)
+
+        job = Job.objects.claim()
+        job.run()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        # The pages stored before the failure are kept.
+        self.assertEqual(
+            list(Video.objects.values_list('youtubeid', flat=True)),
+            ['video1'])
+
+    @mock.patch.object(Channel, 'update_channel_info')
+    def test__run__failed(self, update_channel_info_patch):
+        update_channel_info_patch.side_effect = ValueError('testerror')
+        Job.objects.enqueue(self.channel, Job.FETCH)
+
+        job = Job.objects.claim()
+        job.run()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn('testerror', job.error)
+
+    @mock.patch.object(Channel, 'update_channel_info')
+    @mock.patch.object(Channel, 'fetch_video_pages')
+    def test__run__channel_deleted(
+            self, fetch_video_pages_patch, update_channel_info_patch):
+        Job.objects.enqueue(self.channel, Job.FETCH)
+        job = Job.objects.claim()
+        Channel.objects.filter(pk=self.channel.pk).delete()
+
+        job.run()
+
+        self.assertFalse(Job.objects.exists())
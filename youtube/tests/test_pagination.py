@@ -0,0 +1,87 @@
+from __future__ import unicode_literals
+import datetime
+
+from django.http import QueryDict
+from django.test import TestCase
+from django.utils import timezone
+
+from ..models import Channel, Category, Video
+from ..pagination import decode_cursor, encode_cursor, paginate
+
+
+class PaginateTest(TestCase):
+    def setUp(self):
+        channel = Channel.objects.create(
+            author='testchannel',
+        )
+        category = Category.objects.create(
+            pk=1,
+            category='testcategory',
+        )
+        uploaded = timezone.make_aware(
+            datetime.datetime(2014, 1, 1, 12), timezone.utc)
+        # Two videos share the same upload time, ids break the tie.
+        self.videos = [
+            Video.objects.create(
+                youtubeid='video%s' % idx, uploader=channel,
+                category=category,
+                uploaded=uploaded - datetime.timedelta(hours=idx // 2 * 2))
+            for idx in range(5)
+        ]
+        self.videos.sort(key=lambda e: (e.uploaded, e.pk), reverse=True)
+
+    def paginate(self, query=''):
+        return paginate(Video.objects.all(), QueryDict(query), 2)
+
+    def test__cursor(self):
+        video = self.videos[0]
+
+        self.assertEqual(
+            decode_cursor(encode_cursor(video)), (video.uploaded, video.pk))
+
+    def test__cursor__invalid(self):
+        self.assertIsNone(decode_cursor(None))
+        self.assertIsNone(decode_cursor('abc'))
+        self.assertIsNone(decode_cursor('1-b'))
+
+    def test__first_page(self):
+        page = self.paginate()
+
+        self.assertEqual(page.object_list, self.videos[:2])
+        self.assertTrue(page.has_next)
+        self.assertFalse(page.has_previous)
+        self.assertIsNone(page.previous_url)
+
+    def test__walk_forward_and_back(self):
+        page1 = self.paginate('q=test')
+        page2 = self.paginate(page1.next_url[1:])
+        page3 = self.paginate(page2.next_url[1:])
+
+        self.assertEqual(page2.object_list, self.videos[2:4])
+        self.assertEqual(page3.object_list, self.videos[4:])
+        self.assertFalse(page3.has_next)
+        self.assertTrue(page3.has_previous)
+        self.assertIn('q=test', page3.previous_url)
+
+        back = self.paginate(page3.previous_url[1:])
+        self.assertEqual(back.object_list, page2.object_list)
+        self.assertTrue(back.has_next)
+        self.assertTrue(back.has_previous)
+
+        back = self.paginate(back.previous_url[1:])
+        self.assertEqual(back.object_list, page1.object_list)
+        self.assertFalse(back.has_previous)
+
+    def test__invalid_cursor(self):
+        page = self.paginate('after=invalid')
+
+        self.assertEqual(page.object_list, self.videos[:2])
+
+    def test__empty(self):
+        Video.objects.all().delete()
+
+        page = self.paginate()
+
+        self.assertEqual(page.object_list, [])
+        self.assertFalse(page.has_next)
+        self.assertFalse(page.has_previous)
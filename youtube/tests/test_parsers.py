@@ -0,0 +1,60 @@
+from __future__ import unicode_literals
+import datetime
+
+import dateutil.parser
+import isodate
+from django.test import TestCase
+from django.utils import timezone
+
+from ..parsers import parse_datetime, parse_duration
+
+
+class ParseDurationTest(TestCase):
+    def test(self):
+        self.assertEqual(parse_duration('PT3M40S'), 3 * 60 + 40)
+        self.assertEqual(parse_duration('PT1H'), 60 * 60)
+        self.assertEqual(parse_duration('PT1H2M3S'), 60 * 60 + 2 * 60 + 3)
+        self.assertEqual(parse_duration('PT59S'), 59)
+        self.assertEqual(parse_duration('P1DT1S'), 24 * 60 * 60 + 1)
+        self.assertEqual(parse_duration('P2D'), 2 * 24 * 60 * 60)
+        self.assertEqual(parse_duration('P0D'), 0)
+
+    def test__same_as_isodate(self):
+        for value in ['PT15M33S', 'PT10H', 'P1DT23H59M59S', 'PT0S']:
+            self.assertEqual(
+                parse_duration(value),
+                isodate.parse_duration(value).total_seconds())
+
+    def test__fallback(self):
+        self.assertEqual(parse_duration('P1W'), 7 * 24 * 60 * 60)
+        self.assertEqual(parse_duration('PT1.5S'), 1)
+
+    def test__invalid(self):
+        for value in ['', 'P', '3M40S']:
+            with self.assertRaises(isodate.ISO8601Error):
+                parse_duration(value)
+
+
+class ParseDatetimeTest(TestCase):
+    def test(self):
+        self.assertEqual(
+            parse_datetime('2014-01-01T12:00:00Z'),
+            datetime.datetime(2014, 1, 1, 12, tzinfo=timezone.utc))
+        self.assertEqual(
+            parse_datetime('2014-01-01T12:00:00.123Z'),
+            datetime.datetime(2014, 1, 1, 12, 0, 0, 123000,
+                              tzinfo=timezone.utc))
+
+    def test__same_as_dateutil(self):
+        for value in ['2019-12-31T23:59:59.000Z', '2006-05-07T08:09:10Z']:
+            self.assertEqual(
+                parse_datetime(value), dateutil.parser.parse(value))
+
+    def test__fallback(self):
+        self.assertEqual(
+            parse_datetime('2014-01-01T14:00:00+02:00'),
+            datetime.datetime(2014, 1, 1, 12, tzinfo=timezone.utc))
+
+    def test__invalid(self):
+        with self.assertRaises(ValueError):
+            parse_datetime('not a date')
@@ -0,0 +1,90 @@
+from __future__ import unicode_literals
+import re
+
+import mock
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from ..models import Channel
+from ..profiling import Profile, record_cache
+
+SERVER_TIMING_RE = re.compile(
+    r'^sql;dur=[\d.]+;desc="(\d+) queries", '
+    r'cache;desc="(\d+) hits, (\d+) misses", '
+    r'view;dur=[\d.]+, render;dur=[\d.]+, total;dur=[\d.]+$')
+
+
+@override_settings(
+    YOUTUBE_PROFILING=True,
+    YOUTUBE_PROFILING_SAMPLE_RATE=0,
+    YOUTUBE_PROFILING_SLOW_REQUEST=0)
+class ProfilingMiddlewareTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        Channel.objects.create(author='testauthor')
+
+    def test__server_timing(self):
+        resp = self.client.get(reverse('index'))
+
+        match = SERVER_TIMING_RE.match(resp['Server-Timing'])
+        self.assertIsNotNone(match, resp['Server-Timing'])
+        self.assertGreater(int(match.group(1)), 0)
+        # The page and the visible channels are cached by the first request.
+        self.assertEqual(match.group(2, 3), ('0', '2'))
+
+        resp = self.client.get(reverse('channel', kwargs={
+            'author': 'testauthor',
+        }))
+
+        match = SERVER_TIMING_RE.match(resp['Server-Timing'])
+        self.assertEqual(match.group(2, 3), ('1', '1'))
+
+    def test__other_views(self):
+        resp = self.client.get(reverse('login'))
+
+        self.assertNotIn('Server-Timing', resp)
+
+    @override_settings(YOUTUBE_PROFILING=False)
+    def test__disabled(self):
+        resp = self.client.get(reverse('index'))
+
+        self.assertNotIn('Server-Timing', resp)
+
+    @mock.patch('youtube.profiling.logger')
+    def test__slow_request_log(self, logger_patch):
+        with override_settings(YOUTUBE_PROFILING_SAMPLE_RATE=1):
+            self.client.get(reverse('index'))
+
+        self.assertEqual(logger_patch.warning.call_count, 1)
+        message = logger_patch.warning.call_args[0][0] % (
+            logger_patch.warning.call_args[0][1:])
+        self.assertTrue(message.startswith('Slow request /: '))
+        self.assertIn('youtube_channel', message)
+
+    @mock.patch('youtube.profiling.logger')
+    def test__slow_request_log__not_sampled(self, logger_patch):
+        self.client.get(reverse('index'))
+
+        self.assertFalse(logger_patch.warning.called)
+
+    @mock.patch('youtube.profiling.logger')
+    def test__slow_request_log__fast_request(self, logger_patch):
+        with override_settings(YOUTUBE_PROFILING_SAMPLE_RATE=1,
+                               YOUTUBE_PROFILING_SLOW_REQUEST=60000):
+            self.client.get(reverse('index'))
+
+        self.assertFalse(logger_patch.warning.called)
+
+
+class ProfileTest(TestCase):
+    def test__top_queries(self):
+        profile = Profile()
+        profile.queries = [(0.1, 'a'), (0.3, 'b'), (0.2, 'c')]
+
+        self.assertEqual(profile.top_queries(2), [(0.3, 'b'), (0.2, 'c')])
+        self.assertAlmostEqual(profile.query_time, 0.6)
+
+    def test__record_cache__outside_request(self):
+        # Does nothing.
+        record_cache(hit=True)
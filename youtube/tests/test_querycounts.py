@@ -0,0 +1,224 @@
+'''
+Guards the hot paths against N+1 queries, by asserting the number of queries
+stays the same as the number of channels and videos grows.
+'''
+from __future__ import unicode_literals
+import datetime
+import itertools
+
+import mock
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from ..models import Category, Channel, Job, Video
+
+
+class QueryCountTestCase(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(pk=1, category='testcategory')
+        self.counter = itertools.count()
+
+    def assertConstantQueries(self, func, grow, sizes=(10, 1000),
+                              warm_up=False):
+        '''
+        Asserts that func makes the same number of queries after each call to
+        grow, with the sizes given. With warm_up, func is called once before
+        measuring, for things done once per process.
+        '''
+        counts = []
+        for size in sizes:
+            grow(size)
+            if warm_up and not counts:
+                func()
+            # Start from the same, cold, cache every time.
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                func()
+            counts.append(len(queries.captured_queries))
+        self.assertEqual(
+            len(set(counts)), 1,
+            'Number of queries grows with the size %s: %s\n%s' % (
+                list(sizes), counts,
+                '\n'.join(e['sql'] for e in queries.captured_queries)))
+
+    def create_channels(self, count, **kwargs):
+        channels = []
+        for _ in range(count):
+            number = next(self.counter)
+            channels.append(Channel.objects.create(
+                channelid='channel%d' % number, author='author%d' % number,
+                title='Channel %d' % number, **kwargs))
+        return channels
+
+    def create_videos(self, channel, count):
+        now = timezone.now()
+        Video.objects.bulk_create([
+            Video(
+                youtubeid='video%d' % number, uploader=channel,
+                category=self.category, title='Video %d' % number,
+                uploaded=now - datetime.timedelta(hours=number),
+                updated=now - datetime.timedelta(hours=number))
+            for number in [next(self.counter) for _ in range(count)]])
+        channel.update_counters()
+
+    def get(self, url):
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        return resp
+
+
+class ViewsQueryCountTest(QueryCountTestCase):
+    def test__index(self):
+        def grow(size):
+            for channel in self.create_channels(size // 10):
+                self.create_videos(channel, 10)
+            self.create_channels(2, hidden=True)
+
+        self.assertConstantQueries(lambda: self.get(reverse('index')), grow)
+
+    def test__index__older_page(self):
+        channel = self.create_channels(1)[0]
+
+        def grow(size):
+            self.create_videos(channel, size)
+
+        def func():
+            page = self.get(reverse('index')).context['page']
+            self.get(reverse('index') + page.next_url)
+
+        self.assertConstantQueries(func, grow, sizes=(100, 1000))
+
+    def test__channel(self):
+        channel = self.create_channels(1)[0]
+
+        def grow(size):
+            self.create_videos(channel, size)
+            self.create_channels(size // 10)
+
+        self.assertConstantQueries(lambda: self.get(reverse('channel', kwargs={
+            'author': channel.author,
+        })), grow)
+
+    def test__channel__search(self):
+        channel = self.create_channels(1)[0]
+
+        def grow(size):
+            self.create_videos(channel, size)
+
+        # Checking if full-text search is available is done only once.
+        self.assertConstantQueries(lambda: self.get(reverse('channel', kwargs={
+            'author': channel.author,
+        }) + '?q=video'), grow, warm_up=True)
+
+    def test__admin(self):
+        self.client.force_login(
+            User.objects.create_superuser('testuser', '', 'testpass'))
+
+        def grow(size):
+            for channel in self.create_channels(size // 10):
+                self.create_videos(channel, 10)
+                Job.objects.enqueue(channel, Job.FETCH)
+
+        self.assertConstantQueries(lambda: self.get(reverse('admin')), grow)
+
+    @mock.patch('youtube.views.messages')
+    @mock.patch('youtube.forms.fetch_channel_id_for_author')
+    def test__channel_add(
+            self, fetch_channel_id_for_author_patch, messages_patch):
+        self.client.force_login(
+            User.objects.create_superuser('testuser', '', 'testpass'))
+        fetch_channel_id_for_author_patch.side_effect = (
+            lambda author: 'id%s' % author)
+
+        def grow(size):
+            for channel in self.create_channels(size // 10):
+                self.create_videos(channel, 10)
+
+        def func():
+            resp = self.client.post(reverse('channel-add'), {
+                'channel': 'new%d' % next(self.counter),
+            })
+            self.assertRedirects(resp, reverse('admin'))
+
+        self.assertConstantQueries(func, grow)
+
+
+class IngestQueryCountTest(QueryCountTestCase):
+    def video_data(self, number):
+        return {
+            'id': 'video%d' % number,
+            'snippet': {
+                'title': 'Video %d' % number,
+                'description': 'Description of video %d' % number,
+                'categoryId': str(number + 2),
+                'publishedAt': '2014-01-01T12:00:00.000Z',
+            },
+            'contentDetails': {
+                'duration': 'PT3M40S',
+            },
+            'statistics': {
+                'viewCount': '1000',
+                'favoriteCount': '0',
+            },
+        }
+
+    @mock.patch('youtube.models.fetch_videocategories')
+    @mock.patch('youtube.models.fetch_videos')
+    @mock.patch('youtube.models.fetch_videos_from_playlist')
+    def test__fetch_videos(self, fetch_videos_from_playlist_patch,
+                           fetch_videos_patch, fetch_videocategories_patch):
+        channel = self.create_channels(1, uploads_playlist='uploads')[0]
+        page = []
+        fetch_videos_from_playlist_patch.side_effect = (
+            lambda *args, **kwargs: ([
+                {'contentDetails': {'videoId': data['id']}} for data in page
+            ], None))
+        fetch_videos_patch.side_effect = lambda videoids: [
+            data for data in page if data['id'] in videoids]
+        fetch_videocategories_patch.side_effect = lambda categoryids: [{
+            'id': str(categoryid),
+            'snippet': {'title': 'Category %s' % categoryid},
+        } for categoryid in categoryids]
+
+        def grow(size):
+            # New videos, in as many new categories.
+            page[:] = [
+                self.video_data(next(self.counter)) for _ in range(size)]
+
+        # A page of videos from the API has at most 50 videos.
+        self.assertConstantQueries(
+            lambda: channel.fetch_videos(), grow, sizes=(5, 50))
+        self.assertEqual(Video.objects.count(), 55)
+        self.assertEqual(Category.objects.count(), 56)
+
+    @mock.patch('youtube.models.fetch_videos')
+    @mock.patch('youtube.models.fetch_videos_from_playlist')
+    def test__fetch_videos__known_videos(
+            self, fetch_videos_from_playlist_patch, fetch_videos_patch):
+        channel = self.create_channels(1, uploads_playlist='uploads')[0]
+        page = []
+        fetch_videos_from_playlist_patch.side_effect = (
+            lambda *args, **kwargs: ([
+                {'contentDetails': {'videoId': data['id']}} for data in page
+            ], None))
+        fetch_videos_patch.side_effect = lambda videoids: [
+            data for data in page if data['id'] in videoids]
+
+        def grow(size):
+            page[:] = [
+                dict(self.video_data(next(self.counter)),
+                     snippet=dict(self.video_data(0)['snippet'],
+                                  categoryId='1'))
+                for _ in range(size)]
+            channel.fetch_videos()
+            # Change the statistics of all the videos.
+            for data in page:
+                data['statistics'] = {'viewCount': '2000'}
+
+        self.assertConstantQueries(
+            lambda: channel.fetch_videos(), grow, sizes=(5, 50))
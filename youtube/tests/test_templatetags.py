@@ -1,10 +1,17 @@
+import mock
 from dateutil.relativedelta import relativedelta
+from django.core.cache import cache
 from django.utils import timezone
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from freezegun import freeze_time
 
+from ..models import Channel
 from ..templatetags.pretty_duration import pretty_duration
-from ..templatetags.youtubetags import timesince_short
+from ..templatetags.youtubetags import (
+    hidden_channels,
+    timesince_short,
+    visible_channels,
+)
 
 
 class PrettyDurationTest(TestCase):
@@ -43,3 +50,63 @@ class TimesinceShortTest(TestCase):
         self.assertEqual(
             u'2h4m ago', timesince_short(
                 self.now - relativedelta(hours=2, minutes=4)))
+
+
+class ChannelsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.channel1 = Channel.objects.create(
+            channelid='1', author='author1', title='b')
+        self.channel2 = Channel.objects.create(
+            channelid='2', author='author2', title='a')
+        self.channel3 = Channel.objects.create(
+            channelid='3', author='author3', title='c', hidden=True)
+
+    def test__visible_channels(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                visible_channels(), [self.channel2, self.channel1])
+            self.assertEqual(
+                visible_channels(), [self.channel2, self.channel1])
+
+    @override_settings(YOUTUBE_CHANNELS_CACHE_TIMEOUT=60)
+    def test__visible_channels__timeout(self):
+        with mock.patch.object(cache, 'add', wraps=cache.add) as add_patch:
+            visible_channels()
+
+        self.assertEqual(add_patch.call_args[0][2], 60)
+
+    def test__hidden_channels(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(hidden_channels(), [self.channel3])
+            self.assertEqual(hidden_channels(), [self.channel3])
+
+    def test__invalidated__hidden(self):
+        visible_channels()
+        hidden_channels()
+
+        self.channel1.hidden = True
+        self.channel1.save(update_fields=['hidden'])
+
+        self.assertEqual(visible_channels(), [self.channel2])
+        self.assertEqual(hidden_channels(), [self.channel1, self.channel3])
+
+    def test__invalidated__title(self):
+        visible_channels()
+
+        self.channel1.title = '0'
+        self.channel1.save()
+
+        self.assertEqual(
+            [e.title for e in visible_channels()], ['0', 'a'])
+
+    def test__invalidated__added_and_deleted(self):
+        visible_channels()
+
+        channel4 = Channel.objects.create(
+            channelid='4', author='author4', title='d')
+        self.assertEqual(
+            visible_channels(), [self.channel2, self.channel1, channel4])
+
+        self.channel1.delete()
+        self.assertEqual(visible_channels(), [self.channel2, channel4])
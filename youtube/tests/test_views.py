@@ -1,11 +1,18 @@
 from __future__ import unicode_literals
 
+import datetime
+
 import mock
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.contrib.auth.models import User
+from django.utils import timezone
 
-from ..models import Channel
+from ..models import Category, Channel, Job, Video
+from ..views import PAGE_SIZE
 
 
 class LoggedInTestCase(TestCase):
@@ -15,6 +22,10 @@ class LoggedInTestCase(TestCase):
 
 
 class IndexTest(TestCase):
+    def setUp(self):
+        # Don't get the pages cached by other tests.
+        cache.clear()
+
     def test__get(self):
         resp = self.client.get(reverse('index'))
 
@@ -29,6 +40,26 @@ class IndexTest(TestCase):
         self.assertEqual(resp.status_code, 200)
         self.assertTemplateUsed(resp, 'youtube/index.html')
 
+    def test__get__pages(self):
+        channel = Channel.objects.create(author='testauthor')
+        category = Category.objects.create(pk=1, category='testcategory')
+        for idx in range(PAGE_SIZE + 1):
+            Video.objects.create(
+                youtubeid='video%s' % idx, uploader=channel,
+                category=category)
+
+        resp = self.client.get(reverse('index'))
+
+        self.assertEqual(len(resp.context['page']), PAGE_SIZE)
+        self.assertContains(resp, resp.context['page'].next_url)
+
+        resp = self.client.get(
+            reverse('index') + resp.context['page'].next_url)
+
+        self.assertEqual(len(resp.context['page']), 1)
+        self.assertFalse(resp.context['page'].has_next)
+        self.assertContains(resp, resp.context['page'].previous_url)
+
 
 class ChannelTest(TestCase):
     def setUp(self):
@@ -44,6 +75,26 @@ class ChannelTest(TestCase):
         self.assertEqual(resp.status_code, 200)
         self.assertTemplateUsed(resp, 'youtube/index.html')
 
+    def test__get__videos(self):
+        category = Category.objects.create(pk=1, category='testcategory')
+        Video.objects.create(
+            youtubeid='video1', uploader=self.channel, category=category,
+            title='testvideo')
+        Video.objects.create(
+            youtubeid='video2', uploader=self.channel, category=category,
+            deleted=True)
+        self.channel.update_counters()
+
+        resp = self.client.get(reverse('channel', kwargs={
+            'author': self.channel.author,
+        }))
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+            [e.youtubeid for e in resp.context['page']], ['video1'])
+        self.assertContains(resp, 'with a total of <b>1</b> videos')
+        self.assertContains(resp, 'testvideo')
+
     def test__get__hidden_not_logged_in(self):
         self.channel.hidden = True
         self.channel.save()
@@ -68,6 +119,190 @@ class ChannelTest(TestCase):
         self.assertTemplateUsed(resp, 'youtube/index.html')
 
 
+class PageCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.channel = Channel.objects.create(author='testauthor')
+        self.category = Category.objects.create(pk=1, category='testcategory')
+
+    def test__anonymous(self):
+        self.client.get(reverse('index'))
+
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(reverse('index'))
+
+        self.assertEqual(resp.status_code, 200)
+        # Only the validators are computed, from the channels.
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('youtube_video', queries[0]['sql'])
+        self.assertContains(resp, 'There are no videos to display.')
+
+    def test__anonymous__new_video(self):
+        self.client.get(reverse('index'))
+        Video.objects.create(
+            youtubeid='video1', uploader=self.channel, category=self.category,
+            title='testvideo')
+
+        resp = self.client.get(reverse('index'))
+
+        self.assertContains(resp, 'testvideo')
+
+    def test__anonymous__counters_updated(self):
+        url = reverse('channel', kwargs={'author': self.channel.author})
+        self.client.get(url)
+        Video.objects.bulk_create([Video(
+            youtubeid='video1', uploader=self.channel, category=self.category,
+            title='testvideo', uploaded=timezone.now(),
+            updated=timezone.now())])
+        Channel.objects.all().update_counters()
+
+        resp = self.client.get(url)
+
+        self.assertContains(resp, 'with a total of <b>1</b> videos')
+
+    def test__anonymous__query(self):
+        Video.objects.create(
+            youtubeid='video1', uploader=self.channel, category=self.category,
+            title='testvideo')
+        self.client.get(reverse('index'))
+
+        resp = self.client.get(reverse('index'), {'q': 'nothing'})
+
+        self.assertNotContains(resp, 'testvideo')
+
+    @override_settings(YOUTUBE_PAGE_CACHE_TIMEOUT=0)
+    def test__disabled(self):
+        self.client.get(reverse('index'))
+
+        resp = self.client.get(reverse('index'))
+
+        self.assertIsNotNone(resp.context)
+
+    def test__logged_in(self):
+        User.objects.create_superuser('testuser', '', 'testpass')
+        self.client.login(username='testuser', password='testpass')
+        self.client.get(reverse('index'))
+
+        resp = self.client.get(reverse('index'))
+
+        # Rendered again, not cached.
+        self.assertIsNotNone(resp.context)
+
+    @mock.patch('youtube.templatetags.youtubetags.timezone')
+    def test__tile_relative_time(self, timezone_patch):
+        uploaded = timezone.now()
+        Video.objects.create(
+            youtubeid='video1', uploader=self.channel, category=self.category,
+            title='testvideo', uploaded=uploaded)
+        User.objects.create_superuser('testuser', '', 'testpass')
+        self.client.login(username='testuser', password='testpass')
+        timezone_patch.now.return_value = uploaded + datetime.timedelta(
+            hours=1)
+        self.client.get(reverse('index'))
+        timezone_patch.now.return_value = uploaded + datetime.timedelta(
+            hours=2)
+
+        with mock.patch.object(Video, 'get_thumbnail') as thumbnail_patch:
+            resp = self.client.get(reverse('index'))
+
+        # The tile is cached, only the relative time is rendered again.
+        self.assertFalse(thumbnail_patch.called)
+        self.assertContains(resp, '2h0m ago')
+        self.assertContains(resp, 'testvideo')
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.channel = Channel.objects.create(author='testauthor')
+        self.category = Category.objects.create(pk=1, category='testcategory')
+
+    def test__headers(self):
+        resp = self.client.get(reverse('index'))
+
+        self.assertIn('ETag', resp)
+        self.assertIn('Last-Modified', resp)
+        self.assertIn('no-cache', resp['Cache-Control'])
+
+    def test__if_none_match(self):
+        etag = self.client.get(reverse('index'))['ETag']
+
+        resp = self.client.get(reverse('index'), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(resp.status_code, 304)
+
+    def test__if_modified_since(self):
+        url = reverse('channel', kwargs={'author': self.channel.author})
+        last_modified = self.client.get(url)['Last-Modified']
+
+        resp = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+
+        self.assertEqual(resp.status_code, 304)
+
+    def test__cached_page(self):
+        self.client.get(reverse('index'))
+        # Served from the page cache.
+        etag = self.client.get(reverse('index'))['ETag']
+
+        resp = self.client.get(reverse('index'), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(resp.status_code, 304)
+
+    def test__new_video(self):
+        etag = self.client.get(reverse('index'))['ETag']
+        Video.objects.create(
+            youtubeid='video1', uploader=self.channel, category=self.category,
+            title='testvideo')
+        self.channel.update_counters()
+
+        resp = self.client.get(reverse('index'), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertContains(resp, 'testvideo')
+
+    def test__channel_hidden(self):
+        etag = self.client.get(reverse('index'))['ETag']
+        self.channel.hidden = True
+        self.channel.save()
+
+        resp = self.client.get(reverse('index'), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(resp.status_code, 200)
+
+    def test__logged_in(self):
+        etag = self.client.get(reverse('index'))['ETag']
+        User.objects.create_superuser('testuser', '', 'testpass')
+        self.client.login(username='testuser', password='testpass')
+
+        resp = self.client.get(reverse('index'), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(resp.status_code, 200)
+
+    @mock.patch('youtube.views.messages')
+    def test__logged_in__toggle_hidden(self, messages_patch):
+        User.objects.create_superuser('testuser', '', 'testpass')
+        self.client.login(username='testuser', password='testpass')
+        etag = self.client.get(reverse('index'))['ETag']
+        self.client.post(reverse('toggle-hidden', kwargs={
+            'channelid': self.channel.pk,
+        }))
+
+        resp = self.client.get(reverse('index'), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(resp.status_code, 200)
+
+    @mock.patch('youtube.views.timezone')
+    def test__relative_times(self, timezone_patch):
+        now = timezone.now()
+        timezone_patch.now.return_value = now
+        etag = self.client.get(reverse('index'))['ETag']
+        timezone_patch.now.return_value = now + datetime.timedelta(minutes=5)
+
+        resp = self.client.get(reverse('index'), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(resp.status_code, 200)
+
+
 class AdminTest(LoggedInTestCase):
     def test__get(self):
         resp = self.client.get(reverse('admin'))
@@ -75,6 +310,26 @@ class AdminTest(LoggedInTestCase):
         self.assertEqual(resp.status_code, 200)
         self.assertTemplateUsed(resp, 'youtube/admin.html')
 
+    def test__get__channels(self):
+        Channel.objects.create(
+            author='testauthor', title='testtitle', total_video_count=1234)
+
+        resp = self.client.get(reverse('admin'))
+
+        self.assertContains(resp, 'testtitle')
+        self.assertContains(resp, '1,234')
+
+    def test__get__jobs(self):
+        channel = Channel.objects.create(author='testauthor')
+        Job.objects.create(
+            channel=channel, kind=Job.FULL_FETCH, status=Job.FAILED,
+            error='Traceback')
+
+        resp = self.client.get(reverse('admin'))
+
+        self.assertContains(resp, 'Full fetch')
+        self.assertContains(resp, 'title="Traceback"')
+
 
 class ChannelDeleteTest(LoggedInTestCase):
     def setUp(self):
@@ -108,8 +363,8 @@ class ChannelAddTest(LoggedInTestCase):
                 'channel': 'testchannel',
             })
 
-            self.assertTrue(channel_info_patch.called)
-            self.assertTrue(fetch_videos_patch.called)
+            self.assertFalse(channel_info_patch.called)
+            self.assertFalse(fetch_videos_patch.called)
 
         self.assertRedirects(resp, reverse('admin'))
         self.assertTrue(messages_patch.success.called)
@@ -117,6 +372,9 @@ class ChannelAddTest(LoggedInTestCase):
         channel = Channel.objects.filter(author='testchannel').first()
         self.assertIsNotNone(channel)
         self.assertEqual(channel.channelid, '1234')
+        job = channel.jobs.get()
+        self.assertEqual(job.kind, Job.ADD)
+        self.assertEqual(job.status, Job.QUEUED)
 
     @mock.patch('youtube.forms.fetch_channel_id_for_author')
     @mock.patch('youtube.forms.check_channel_id_exists')
@@ -191,13 +449,14 @@ class ChannelFullFetchTest(LoggedInTestCase):
                 'channelid': self.channel.pk,
             }))
 
-            self.assertTrue(channel_info_patch.called)
-            self.assertTrue(fetch_videos_patch.called)
-            self.assertEqual(fetch_videos_patch.call_args,
-                             mock.call(full_fetch=True))
+            self.assertFalse(channel_info_patch.called)
+            self.assertFalse(fetch_videos_patch.called)
 
         self.assertRedirects(resp, reverse('admin'))
         self.assertTrue(messages_patch.success.called)
+        job = self.channel.jobs.get()
+        self.assertEqual(job.kind, Job.FULL_FETCH)
+        self.assertEqual(job.status, Job.QUEUED)
 
 
 class ChannelFetchTest(LoggedInTestCase):
@@ -219,10 +478,11 @@ class ChannelFetchTest(LoggedInTestCase):
                 'channelid': self.channel.pk,
             }))
 
-            self.assertTrue(channel_info_patch.called)
-            self.assertTrue(fetch_videos_patch.called)
-            self.assertEqual(fetch_videos_patch.call_args,
-                             mock.call(full_fetch=False))
+            self.assertFalse(channel_info_patch.called)
+            self.assertFalse(fetch_videos_patch.called)
 
         self.assertRedirects(resp, reverse('admin'))
         self.assertTrue(messages_patch.success.called)
+        job = self.channel.jobs.get()
+        self.assertEqual(job.kind, Job.FETCH)
+        self.assertEqual(job.status, Job.QUEUED)
@@ -1,23 +1,105 @@
 from __future__ import unicode_literals
 
 import mock
-from django.test import TestCase
+import requests
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from django.conf import settings
+from requests.adapters import BaseAdapter, HTTPAdapter
 
 from ..youtubeapi import (
+    API_URL,
+    NotModified,
+    create_session,
+    get_session,
+    pop_usage,
+    set_session,
     check_channel_id_exists,
     fetch_channel_id_for_author,
     fetch_channel_info,
+    fetch_channels_info,
     fetch_videocategories,
     fetch_videos_from_playlist,
     fetch_videos,
 )
 
 
+class DummyAdapter(BaseAdapter):
+    pass
+
+
+class SessionTest(TestCase):
+    def tearDown(self):
+        set_session(None)
+
+    def test__get_session__shared(self):
+        set_session(None)
+
+        self.assertIs(get_session(), get_session())
+
+    def test__create_session__pooled(self):
+        session = create_session()
+
+        adapter = session.get_adapter(API_URL + 'videos')
+        self.assertIsInstance(adapter, HTTPAdapter)
+        self.assertEqual(adapter._pool_maxsize, settings.YOUTUBE_API_POOL_SIZE)
+        self.assertEqual(session.headers['Accept-Encoding'], 'gzip')
+        self.assertIn('gzip', session.headers['User-Agent'])
+
+    @override_settings(
+        YOUTUBE_API_ADAPTER='youtube.tests.test_youtubeapi.DummyAdapter',
+        YOUTUBE_API_GZIP=False,
+        YOUTUBE_API_KEEP_ALIVE=False)
+    def test__create_session__adapter_from_settings(self):
+        session = create_session()
+
+        self.assertIsInstance(
+            session.get_adapter(API_URL + 'videos'), DummyAdapter)
+        self.assertNotIn('gzip', session.headers['User-Agent'])
+        self.assertEqual(session.headers['Connection'], 'close')
+
+    def test__create_session__adapter_argument(self):
+        adapter = DummyAdapter()
+
+        session = create_session(adapter=adapter)
+
+        self.assertIs(session.get_adapter(API_URL + 'videos'), adapter)
+
+
+class UsageTest(TestCase):
+    def setUp(self):
+        pop_usage()
+
+    @mock.patch('youtube.youtubeapi._session')
+    def test(self, session_patch):
+        session_patch.get.return_value.json.return_value = {'items': []}
+
+        fetch_videos(['abcdef'])
+        fetch_videos(['abcdef'])
+        fetch_channels_info(['1234'])
+
+        usage = pop_usage()
+        self.assertEqual(sorted(usage), ['channels', 'videos'])
+        calls, units, seconds = usage['videos']
+        self.assertEqual(calls, 2)
+        self.assertEqual(units, 2)
+        self.assertGreaterEqual(seconds, 0)
+        self.assertEqual(pop_usage(), {})
+
+    @mock.patch('youtube.youtubeapi._session')
+    def test__failed_request(self, session_patch):
+        session_patch.get.side_effect = requests.exceptions.Timeout()
+
+        with self.assertRaises(requests.exceptions.Timeout):
+            fetch_videos(['abcdef'])
+
+        self.assertEqual(pop_usage()['videos'][:2], (1, 1))
+
+
 class FetchChannelIdForAuthorTest(TestCase):
-    @mock.patch('youtube.youtubeapi.requests')
-    def test__channel_exists(self, requests_patch):
-        requests_patch.get().json.return_value = {
+    @mock.patch('youtube.youtubeapi._session')
+    def test__channel_exists(self, session_patch):
+        session_patch.get().json.return_value = {
             'pageInfo': {
                 'totalResults': 1,
             },
@@ -31,60 +113,60 @@ class FetchChannelIdForAuthorTest(TestCase):
         self.assertEqual(
             1234, fetch_channel_id_for_author('testchannel'))
 
-        self.assertTrue(requests_patch.get.called)
-        self.assertTrue(requests_patch.get().raise_for_status.called)
-        self.assertTrue(requests_patch.get().json.called)
+        self.assertTrue(session_patch.get.called)
+        self.assertTrue(session_patch.get().raise_for_status.called)
+        self.assertTrue(session_patch.get().json.called)
 
-    @mock.patch('youtube.youtubeapi.requests')
-    def test__channel_does_not_exist(self, requests_patch):
-        requests_patch.get().raise_for_status.side_effect = Exception(
+    @mock.patch('youtube.youtubeapi._session')
+    def test__channel_does_not_exist(self, session_patch):
+        session_patch.get().raise_for_status.side_effect = Exception(
             'failed request')
 
         with self.assertRaises(Exception):
             fetch_channel_id_for_author('testchannel')
 
-        self.assertTrue(requests_patch.get.called)
-        self.assertTrue(requests_patch.get().raise_for_status.called)
+        self.assertTrue(session_patch.get.called)
+        self.assertTrue(session_patch.get().raise_for_status.called)
 
 
 class CheckChannelIdExists(TestCase):
-    @mock.patch('youtube.youtubeapi.requests')
-    def test__exists(self, requests_patch):
+    @mock.patch('youtube.youtubeapi._session')
+    def test__exists(self, session_patch):
         resp_mock = mock.MagicMock()
         resp_mock.json.return_value = {
             'pageInfo': {
                 'totalResults': 1,
             },
         }
-        requests_patch.get.return_value = resp_mock
+        session_patch.get.return_value = resp_mock
 
         self.assertTrue(check_channel_id_exists('testchannel'))
 
-        self.assertTrue(requests_patch.get.called)
+        self.assertTrue(session_patch.get.called)
         self.assertTrue(resp_mock.raise_for_status.called)
         self.assertTrue(resp_mock.json.called)
 
-    @mock.patch('youtube.youtubeapi.requests')
-    def test__does_not_exist(self, requests_patch):
+    @mock.patch('youtube.youtubeapi._session')
+    def test__does_not_exist(self, session_patch):
         resp_mock = mock.MagicMock()
         resp_mock.json.return_value = {
             'pageInfo': {
                 'totalResults': 0,
             },
         }
-        requests_patch.get.return_value = resp_mock
+        session_patch.get.return_value = resp_mock
 
         self.assertFalse(check_channel_id_exists('testchannel'))
 
-        self.assertTrue(requests_patch.get.called)
+        self.assertTrue(session_patch.get.called)
         self.assertTrue(resp_mock.raise_for_status.called)
         self.assertTrue(resp_mock.json.called)
 
 
 class FetchVideocategoriesTestCase(TestCase):
 
-    @mock.patch('youtube.youtubeapi.requests')
-    def test(self, requests_patch):
+    @mock.patch('youtube.youtubeapi._session')
+    def test(self, session_patch):
         resp_mock = mock.Mock()
         resp_mock.json.return_value = {
             'items': [
@@ -93,7 +175,7 @@ class FetchVideocategoriesTestCase(TestCase):
                 },
             ],
         }
-        requests_patch.get.return_value = resp_mock
+        session_patch.get.return_value = resp_mock
 
         self.assertEqual(fetch_videocategories([1, 2, 3]), [
             {
@@ -101,40 +183,42 @@ class FetchVideocategoriesTestCase(TestCase):
             },
         ])
 
-        requests_patch.get.assert_called_with(
+        session_patch.get.assert_called_with(
             'https://www.googleapis.com/youtube/v3/videoCategories',
             params={
                 'part': 'snippet',
                 'id': '1,2,3',
                 'key': settings.YOUTUBE_API_KEY,
-            })
+            },
+            timeout=settings.YOUTUBE_API_TIMEOUT)
         self.assertTrue(resp_mock.raise_for_status.called)
         self.assertTrue(resp_mock.json.called)
 
-    @mock.patch('youtube.youtubeapi.requests')
-    def test__empty_data(self, requests_patch):
+    @mock.patch('youtube.youtubeapi._session')
+    def test__empty_data(self, session_patch):
         resp_mock = mock.Mock()
         resp_mock.json.return_value = {}
-        requests_patch.get.return_value = resp_mock
+        session_patch.get.return_value = resp_mock
 
         # Empty list, since the JSON response is an empty object.
         self.assertEqual(fetch_videocategories([1, 2, 3]), [])
 
-        requests_patch.get.assert_called_with(
+        session_patch.get.assert_called_with(
             'https://www.googleapis.com/youtube/v3/videoCategories',
             params={
                 'part': 'snippet',
                 'id': '1,2,3',
                 'key': settings.YOUTUBE_API_KEY,
-            })
+            },
+            timeout=settings.YOUTUBE_API_TIMEOUT)
         self.assertTrue(resp_mock.raise_for_status.called)
         self.assertTrue(resp_mock.json.called)
 
 
 class FetchChannelInfoTestCase(TestCase):
 
-    @mock.patch('youtube.youtubeapi.requests')
-    def test(self, requests_patch):
+    @mock.patch('youtube.youtubeapi._session')
+    def test(self, session_patch):
         resp_mock = mock.Mock()
         resp_mock.json.return_value = {
             'items': [
@@ -143,26 +227,62 @@ class FetchChannelInfoTestCase(TestCase):
                 },
             ],
         }
-        requests_patch.get.return_value = resp_mock
+        session_patch.get.return_value = resp_mock
 
         self.assertEqual(fetch_channel_info('1234'), {
             'id': '1234',
         })
 
-        requests_patch.get.assert_called_with(
+        session_patch.get.assert_called_with(
             'https://www.googleapis.com/youtube/v3/channels', params={
                 'part': 'snippet,contentDetails',
                 'id': '1234',
                 'key': settings.YOUTUBE_API_KEY,
-            })
+            },
+            timeout=settings.YOUTUBE_API_TIMEOUT)
         self.assertTrue(resp_mock.raise_for_status.called)
         self.assertTrue(resp_mock.json.called)
 
 
+class FetchChannelsInfoTestCase(TestCase):
+
+    @mock.patch('youtube.youtubeapi._session')
+    def test(self, session_patch):
+        resp_mock = mock.Mock()
+        resp_mock.json.return_value = {
+            'items': [
+                {
+                    'id': '1234',
+                },
+            ],
+        }
+        session_patch.get.return_value = resp_mock
+
+        self.assertEqual(fetch_channels_info(['1234', '5678']), [{
+            'id': '1234',
+        }])
+
+        session_patch.get.assert_called_with(
+            'https://www.googleapis.com/youtube/v3/channels', params={
+                'part': 'snippet,contentDetails',
+                'id': '1234,5678',
+                'maxResults': 50,
+                'key': settings.YOUTUBE_API_KEY,
+            },
+            timeout=settings.YOUTUBE_API_TIMEOUT)
+        self.assertTrue(resp_mock.raise_for_status.called)
+
+    @mock.patch('youtube.youtubeapi._session')
+    def test__no_items(self, session_patch):
+        session_patch.get.return_value.json.return_value = {}
+
+        self.assertEqual(fetch_channels_info(['1234']), [])
+
+
 class FetchVideosFromPlaylistTestCase(TestCase):
 
-    @mock.patch('youtube.youtubeapi.requests')
-    def test(self, requests_patch):
+    @mock.patch('youtube.youtubeapi._session')
+    def test(self, session_patch):
         resp_mock = mock.Mock()
         resp_mock.json.return_value = {
             'nextPageToken': 'nextpagetoken',
@@ -172,7 +292,7 @@ class FetchVideosFromPlaylistTestCase(TestCase):
                 },
             ],
         }
-        requests_patch.get.return_value = resp_mock
+        session_patch.get.return_value = resp_mock
 
         self.assertEqual(fetch_videos_from_playlist('abc'), (
             [
@@ -185,21 +305,22 @@ class FetchVideosFromPlaylistTestCase(TestCase):
 
         self.assertTrue(resp_mock.raise_for_status.called)
         self.assertTrue(resp_mock.json.called)
-        requests_patch.get.assert_called_with(
+        session_patch.get.assert_called_with(
             'https://www.googleapis.com/youtube/v3/playlistItems', params={
                 'part': 'contentDetails',
                 'maxResults': 50,
                 'playlistId': 'abc',
                 'key': settings.YOUTUBE_API_KEY,
                 'pageToken': None,
-            }
+            },
+            timeout=settings.YOUTUBE_API_TIMEOUT,
         )
 
 
 class FetchVideosTestCase(TestCase):
 
-    @mock.patch('youtube.youtubeapi.requests')
-    def test(self, requests_patch):
+    @mock.patch('youtube.youtubeapi._session')
+    def test(self, session_patch):
         resp_mock = mock.Mock()
         resp_mock.json.return_value = {
             'items': [
@@ -208,7 +329,7 @@ class FetchVideosTestCase(TestCase):
                 },
             ],
         }
-        requests_patch.get.return_value = resp_mock
+        session_patch.get.return_value = resp_mock
 
         self.assertEqual(fetch_videos({'abc', 'def'}), [
             {
@@ -216,11 +337,78 @@ class FetchVideosTestCase(TestCase):
             },
         ])
 
-        requests_patch.get.assert_called_with(
+        session_patch.get.assert_called_with(
             'https://www.googleapis.com/youtube/v3/videos', params={
                 'part': 'snippet,contentDetails,statistics',
                 'id': ','.join({'abc', 'def'}),
                 'key': settings.YOUTUBE_API_KEY,
-            })
+            },
+            timeout=settings.YOUTUBE_API_TIMEOUT)
         self.assertTrue(resp_mock.raise_for_status.called)
         self.assertTrue(resp_mock.json.called)
+
+
+@override_settings(YOUTUBE_API_ETAG_CACHE='default')
+class ConditionalRequestTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.data = {
+            'items': [
+                {
+                    'id': '1234',
+                },
+            ],
+        }
+
+    @mock.patch('youtube.youtubeapi._session')
+    def test__not_modified(self, session_patch):
+        resp_mock = mock.Mock(status_code=200, headers={'ETag': '"etag1"'})
+        resp_mock.json.return_value = self.data
+        session_patch.get.return_value = resp_mock
+
+        self.assertEqual(
+            fetch_channel_info('1234', conditional=True), {'id': '1234'})
+        self.assertEqual(
+            session_patch.get.call_args[1]['headers'], {})
+
+        session_patch.get.return_value = mock.Mock(status_code=304)
+        with self.assertRaises(NotModified) as cm:
+            fetch_channel_info('1234', conditional=True)
+
+        self.assertEqual(cm.exception.data, self.data)
+        self.assertEqual(
+            session_patch.get.call_args[1]['headers'],
+            {'If-None-Match': '"etag1"'})
+
+    @mock.patch('youtube.youtubeapi._session')
+    def test__modified(self, session_patch):
+        resp_mock = mock.Mock(status_code=200, headers={})
+        resp_mock.json.return_value = dict(self.data, etag='"etag1"')
+        session_patch.get.return_value = resp_mock
+        fetch_channel_info('1234', conditional=True)
+
+        resp_mock.json.return_value = {
+            'etag': '"etag2"',
+            'items': [{'id': '5678'}],
+        }
+        self.assertEqual(
+            fetch_channel_info('1234', conditional=True), {'id': '5678'})
+        self.assertEqual(
+            session_patch.get.call_args[1]['headers'],
+            {'If-None-Match': '"etag1"'})
+
+        # Different requests does not share ETags.
+        fetch_channel_info('5678', conditional=True)
+        self.assertEqual(
+            session_patch.get.call_args[1]['headers'], {})
+
+    @mock.patch('youtube.youtubeapi._session')
+    def test__unconditional(self, session_patch):
+        resp_mock = mock.Mock(status_code=200, headers={'ETag': '"etag1"'})
+        resp_mock.json.return_value = self.data
+        session_patch.get.return_value = resp_mock
+
+        fetch_channel_info('1234')
+        fetch_channel_info('1234')
+
+        self.assertNotIn('headers', session_patch.get.call_args[1])
@@ -1,38 +1,111 @@
 from __future__ import unicode_literals
-from django.shortcuts import render, get_object_or_404, redirect
+import datetime
+import hashlib
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.shortcuts import get_object_or_404, redirect
+from django.template.response import TemplateResponse
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.utils.html import format_html
-from django.views.decorators.http import require_POST
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_POST
 from django.db import transaction
-from django.db.models import Count, Q
+from django.db.models import Count, Max, Q, Sum
+from django.utils import timezone
 from django.urls import reverse
 
-from .models import Video, Channel
+from . import caching, metrics
+from .models import ApiUsage, Job, Video, Channel
 from .forms import AddChannelForm
+from .pagination import paginate
 
+# The number of videos to show on each page of a feed.
+PAGE_SIZE = 72
+# The feeds show relative upload times, so their validators change every this
+# many seconds even if nothing else did.
+VALIDATOR_WINDOW = 60
 
-def index(request):
+
+def _feed_state(request, relative_times):
+    '''
+    Returns what the feeds depend on, aggregated from the denormalized
+    counters of the channels shown (not the videos), once per request.
+    '''
+    if not hasattr(request, '_feed_state'):
+        channels = Channel.objects.all()
+        if not request.user.is_authenticated:
+            channels = channels.filter(hidden=False)
+        state = channels.aggregate(
+            count=Count('id'),
+            # Logged in users see hidden channels, but not on the index.
+            hidden=Count('id', filter=Q(hidden=True)),
+            video_count=Sum('video_count'),
+            latest_upload=Max('latest_upload'),
+            updated=Max('updated'),
+        )
+        state['window'] = None
+        if relative_times:
+            now = timezone.now()
+            state['window'] = now - datetime.timedelta(
+                seconds=now.timestamp() % VALIDATOR_WINDOW)
+        request._feed_state = state
+    return request._feed_state
+
+
+def feed_view(view, relative_times=True):
+    '''
+    Decorator for the views of the feeds, answering conditional requests
+    with a 304 when nothing shown changed, and caching the pages for
+    anonymous users. Pass relative_times=False for views not showing
+    relative upload times.
+    '''
+    def etag(request, *args, **kwargs):
+        state = _feed_state(request, relative_times)
+        return hashlib.md5(('%s:%s:%s:%s:%s:%s:%s:%s' % (
+            request.user.pk, request.get_full_path(), state['count'],
+            state['hidden'], state['video_count'], state['latest_upload'],
+            state['updated'], state['window'],
+        )).encode('utf-8')).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        state = _feed_state(request, relative_times)
+        values = [
+            state['latest_upload'], state['updated'], state['window']]
+        return max([e for e in values if e is not None] or [None])
+
+    view = caching.cache_anonymous_page(view)
+    view = condition(etag_func=etag, last_modified_func=last_modified)(view)
+    # Browsers and proxies have to check with us before using their copy.
+    return cache_control(no_cache=True)(view)
+
+
+def index_videos(request):
+    '''
+    Returns the videos of the index, for the search query of the request.
+    '''
+    # Not ranked by relevance: pages and feeds are keyset paginated on the
+    # upload time, so they have to stay in chronological order.
     channel_ids = list(
         Channel.objects.
         filter(hidden=False).
         values_list('id', flat=True))
-    videos = (
+    return (
         Video.objects.
         filter(uploader_id__in=channel_ids).
         exclude_deleted().
         text_search(request.GET.get('q', '')).
         prefetch_related('uploader'))
 
-    return render(request, 'youtube/index.html', {
-        'videos': videos,
-        'full_url': request.build_absolute_uri(request.get_full_path()),
-    })
-
 
-def channel(request, author):
-    # Basic queryset for channel, prefetching video entries.
-    qs = Channel.objects.prefetch_related('videos')
+def channel_videos(request, author):
+    '''
+    Returns the channel of the author (or channel id) and its videos, for the
+    search query of the request. Raises Http404 if the channel is not found.
+    '''
+    # Basic queryset for the channel, videos are fetched a page at a time.
+    qs = Channel.objects.all()
 
     # If we're not logged in, don't allow showing hidden channels.
     if not request.user.is_authenticated:
@@ -46,22 +119,43 @@ def channel(request, author):
         exclude_deleted().
         text_search(request.GET.get('q', ''))
     )
+    return channel, videos
+
+
+@feed_view
+def index(request):
+    videos = index_videos(request)
+
+    return TemplateResponse(request, 'youtube/index.html', {
+        'page': paginate(videos, request.GET, PAGE_SIZE),
+        'full_url': request.build_absolute_uri(request.get_full_path()),
+        'generation': caching.feed_generation(),
+        'fragment_timeout': settings.YOUTUBE_FRAGMENT_CACHE_TIMEOUT,
+    })
+
+
+@feed_view
+def channel(request, author):
+    channel, videos = channel_videos(request, author)
 
     # Render and return.
-    return render(request, 'youtube/index.html', {
-        'videos': videos,
+    return TemplateResponse(request, 'youtube/index.html', {
+        'page': paginate(videos, request.GET, PAGE_SIZE),
         'channel': channel,
         'full_url': request.build_absolute_uri(request.get_full_path()),
+        'generation': caching.feed_generation(),
+        'fragment_timeout': settings.YOUTUBE_FRAGMENT_CACHE_TIMEOUT,
     })
 
 
 @login_required
 def admin(request):
     form = AddChannelForm(request.POST or None)
-    return render(request, 'youtube/admin.html', {
-        'admin_channels': (Channel.objects.
-                           annotate(videocount=Count('videos')).
-                           order_by('hidden', 'title')),
+    return TemplateResponse(request, 'youtube/admin.html', {
+        'admin_channels': Channel.objects.order_by('hidden', 'title'),
+        'api_units_used': ApiUsage.objects.units_used(),
+        'api_daily_quota': settings.YOUTUBE_API_DAILY_QUOTA,
+        'jobs': Job.objects.select_related('channel').order_by('-id')[:10],
         'form': form,
         'page': 'admin',
         'full_url': request.build_absolute_uri(request.get_full_path()),
@@ -69,6 +163,20 @@ def admin(request):
     })
 
 
+def prometheus_metrics(request):
+    # If a token is configured, it has to be given as a bearer token.
+    token = settings.YOUTUBE_METRICS_TOKEN
+    if token and request.META.get('HTTP_AUTHORIZATION') != 'Bearer %s' % (
+            token,):
+        return HttpResponseForbidden()
+
+    # The totals saved by the commands, with the metrics of this process.
+    snapshot = metrics.merge(metrics.load(), metrics.snapshot())
+    return HttpResponse(
+        metrics.render(snapshot),
+        content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 @require_POST
 @login_required
 @transaction.atomic
@@ -95,14 +203,16 @@ def channel_add(request):
         channelid=form.cleaned_data['channelid'],
         author=form.cleaned_data['channel'],
     )
-    channel.update_channel_info()
-    channel.fetch_videos()
+    # The videos are fetched in the background by `process_jobs`.
+    Job.objects.enqueue(channel, Job.ADD)
+    ApiUsage.objects.record()
 
     messages.success(
         request,
         format_html(
-            'Added channel under name <b><a href="{1}">{0}</a></b>',
-            channel.title, reverse('channel', kwargs={
+            'Added channel under name <b><a href="{1}">{0}</a></b>, its '
+            'videos will be fetched shortly',
+            channel.author, reverse('channel', kwargs={
                 'author': channel.author,
             }),
         ),
@@ -131,18 +241,17 @@ def channel_fetch(request, channelid, full_fetch=False):
     # Fetch the channel.
     channel = get_object_or_404(Channel, pk=channelid)
 
-    # Do the full update.
-    channel.update_channel_info()
-    channel.fetch_videos(full_fetch=full_fetch)
+    # Queue the update, it is run in the background by `process_jobs`.
+    Job.objects.enqueue(channel, Job.FULL_FETCH if full_fetch else Job.FETCH)
 
     # Notify the user.
     if full_fetch:
         messages.success(request, format_html(
-            'Did a full fetch on channel <b>{0}</b>.',
+            'Queued a full fetch on channel <b>{0}</b>.',
             channel.title))
     else:
         messages.success(request, format_html(
-            'Did a fast fetch on channel <b>{0}</b>.',
+            'Queued a fast fetch on channel <b>{0}</b>.',
             channel.title))
 
     # All done
@@ -1,22 +1,194 @@
+import hashlib
+import json
+import threading
+import time
+
 from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
 import requests
+from requests.adapters import HTTPAdapter
 
+from . import metrics
 
-def fetch_channel_id_for_author(author):
+API_URL = 'https://www.googleapis.com/youtube/v3/'
+
+# The quota cost of a call to each endpoint of the API, all the calls made are
+# list calls costing a single unit.
+# https://developers.google.com/youtube/v3/determine_quota_cost
+QUOTA_COSTS = {
+    'channels': 1,
+    'playlistItems': 1,
+    'videoCategories': 1,
+    'videos': 1,
+}
+
+_session = None
+_session_lock = threading.Lock()
+
+# API usage since the last call to `pop_usage`, by endpoint.
+_usage = {}
+_usage_lock = threading.Lock()
+
+
+class NotModified(Exception):
     '''
-    Checks to see if a given author exists.
+    Raised by conditional requests when the response has not changed since
+    the last time the same request was made.
 
-    Returns None or channelid as a string.
+    The previous response is available as `data`.
+    '''
+    def __init__(self, data):
+        super(NotModified, self).__init__('Not modified')
+        self.data = data
+
+
+def create_session(adapter=None):
+    '''
+    Creates and returns a new `requests.Session` configured for talking to the
+    Youtube API, based on the `YOUTUBE_API_*` settings.
+
+    If an adapter is given (or `YOUTUBE_API_ADAPTER` is set to the dotted path
+    of an adapter class) it is mounted for the API URL instead of the default
+    pooled HTTP adapter, this allows running without network access.
+    '''
+    session = requests.Session()
+
+    if adapter is None and settings.YOUTUBE_API_ADAPTER:
+        adapter = import_string(settings.YOUTUBE_API_ADAPTER)()
+    if adapter is None:
+        adapter = HTTPAdapter(
+            pool_connections=settings.YOUTUBE_API_POOL_SIZE,
+            pool_maxsize=settings.YOUTUBE_API_POOL_SIZE,
+        )
+    session.mount(API_URL, adapter)
+
+    # Google only serves gzip'ed responses when the user agent mentions it.
+    if settings.YOUTUBE_API_GZIP:
+        session.headers['Accept-Encoding'] = 'gzip'
+        session.headers['User-Agent'] = '%s (gzip)' % (
+            session.headers['User-Agent'],)
+    if not settings.YOUTUBE_API_KEEP_ALIVE:
+        session.headers['Connection'] = 'close'
+
+    return session
+
+
+def get_session():
+    '''
+    Returns the shared session used by all calls to the Youtube API, creating
+    it on first use.
+    '''
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = create_session()
+    return _session
+
+
+def set_session(session):
+    '''
+    Replaces the shared session, if None is given a new session is created
+    from the settings on next use.
+    '''
+    global _session
+    with _session_lock:
+        _session = session
+
+
+def _record_usage(endpoint, seconds, status):
+    metrics.API_CALLS.inc(endpoint=endpoint, status=status)
+    metrics.API_SECONDS.observe(seconds, endpoint=endpoint)
+    metrics.API_QUOTA_UNITS.inc(
+        QUOTA_COSTS.get(endpoint, 1), endpoint=endpoint)
+    with _usage_lock:
+        calls, units, total_seconds = _usage.get(endpoint, (0, 0, 0.0))
+        _usage[endpoint] = (
+            calls + 1,
+            units + QUOTA_COSTS.get(endpoint, 1),
+            total_seconds + seconds,
+        )
+
+
+def pop_usage():
+    '''
+    Returns the usage of the API since the last call, as a dict of endpoint
+    to a (calls, quota units, seconds spent) tuple, and resets it.
+
+    Usage is recorded for all calls, including failed and not modified ones,
+    as they count against the quota as well.
+    '''
+    global _usage
+    with _usage_lock:
+        usage, _usage = _usage, {}
+    return usage
+
+
+def _request(endpoint, params, **kwargs):
+    start = time.time()
+    status = 'error'
+    try:
+        resp = get_session().get(
+            API_URL + endpoint, params=params,
+            timeout=settings.YOUTUBE_API_TIMEOUT, **kwargs)
+        status = resp.status_code
+        return resp
+    finally:
+        _record_usage(endpoint, time.time() - start, status)
+
+
+def _get(endpoint, params, conditional=False):
+    '''
+    Does a GET request against the given endpoint of the Youtube API, using
+    the shared session, and returns the decoded JSON response.
+
+    If conditional is True, the ETag of the previous response to the same
+    request is sent along and `NotModified` is raised if it is unchanged.
     '''
-    resp = requests.get(
-        'https://www.googleapis.com/youtube/v3/channels', params={
-            'part': 'id',
-            'forUsername': author,
-            'key': settings.YOUTUBE_API_KEY,
-        })
+    params = dict(params, key=settings.YOUTUBE_API_KEY)
+    if conditional and settings.YOUTUBE_API_ETAG_CACHE:
+        return _conditional_get(endpoint, params)
+
+    resp = _request(endpoint, params)
+    resp.raise_for_status()
+    return resp.json()
+
+
+def _conditional_get(endpoint, params):
+    cache = caches[settings.YOUTUBE_API_ETAG_CACHE]
+    key = 'youtube:api:%s:%s' % (endpoint, hashlib.sha1(json.dumps(
+        dict(params, key=None), sort_keys=True).encode('utf-8')).hexdigest())
+    cached = cache.get(key)
+
+    headers = {}
+    if cached:
+        headers['If-None-Match'] = cached['etag']
+    resp = _request(endpoint, params, headers=headers)
+    if cached and resp.status_code == 304:
+        raise NotModified(cached['data'])
     resp.raise_for_status()
 
     data = resp.json()
+    etag = resp.headers.get('ETag') or data.get('etag')
+    if etag:
+        cache.set(key, {
+            'etag': etag,
+            'data': data,
+        }, settings.YOUTUBE_API_ETAG_TIMEOUT)
+    return data
+
+
+def fetch_channel_id_for_author(author):
+    '''
+    Checks to see if a given author exists.
+
+    Returns None or channelid as a string.
+    '''
+    data = _get('channels', {
+        'part': 'id',
+        'forUsername': author,
+    })
     if data['pageInfo']['totalResults'] > 0:
         return data['items'][0]['id']
 
@@ -27,15 +199,10 @@ def check_channel_id_exists(channelid):
 
     Returns True/False.
     '''
-    resp = requests.get(
-        'https://www.googleapis.com/youtube/v3/channels', params={
-            'part': 'id',
-            'id': channelid,
-            'key': settings.YOUTUBE_API_KEY,
-        })
-    resp.raise_for_status()
-
-    data = resp.json()
+    data = _get('channels', {
+        'part': 'id',
+        'id': channelid,
+    })
     return data['pageInfo']['totalResults'] > 0
 
 
@@ -43,15 +210,10 @@ def fetch_videocategories(categoryids):
     '''
     Fetches and returns a dictlist of data for the categoryids.
     '''
-    resp = requests.get(
-        'https://www.googleapis.com/youtube/v3/videoCategories',
-        params={
-            'part': 'snippet',
-            'id': ','.join([str(e) for e in categoryids]),
-            'key': settings.YOUTUBE_API_KEY,
-        })
-    resp.raise_for_status()
-    data = resp.json()
+    data = _get('videoCategories', {
+        'part': 'snippet',
+        'id': ','.join([str(e) for e in categoryids]),
+    })
     if 'items' in data:
         return data['items']
     else:
@@ -59,26 +221,45 @@ def fetch_videocategories(categoryids):
         return []
 
 
-def fetch_channel_info(channelid, parts=('snippet', 'contentDetails')):
+def fetch_channel_info(channelid, parts=('snippet', 'contentDetails'),
+                       conditional=False):
     '''
     Fetches and returns a dict of info about a given channel, with the given
     channel id.
+
+    If conditional is True `NotModified` is raised if the channel is unchanged
+    since the last conditional request.
     '''
-    resp = requests.get(
-        'https://www.googleapis.com/youtube/v3/channels', params={
-            'part': ','.join(parts),
-            'id': channelid,
-            'key': settings.YOUTUBE_API_KEY,
-        }
-    )
-    resp.raise_for_status()
-    return resp.json()['items'][0]
+    data = _get('channels', {
+        'part': ','.join(parts),
+        'id': channelid,
+    }, conditional=conditional)
+    return data['items'][0]
+
+
+def fetch_channels_info(channelids, parts=('snippet', 'contentDetails'),
+                        conditional=False):
+    '''
+    Fetches and returns a dictlist of info about the channels with the given
+    channel ids, at most 50 ids per call. Channels that does not exist are
+    left out.
+
+    If conditional is True `NotModified` is raised if none of the channels
+    have changed since the last conditional request.
+    '''
+    data = _get('channels', {
+        'part': ','.join(parts),
+        'id': ','.join(channelids),
+        'maxResults': 50,
+    }, conditional=conditional)
+    return data.get('items', [])
 
 
 def fetch_videos_from_playlist(
         playlistid,
         parts=('contentDetails',),
-        next_page_token=None):
+        next_page_token=None,
+        conditional=False):
     '''
     Fetches and returns a list of videoids from a playlist with a given
     playlistid as well as the next_page_token, if one is available as:
@@ -86,20 +267,18 @@ def fetch_videos_from_playlist(
 
     If a next_page_token is supplied, it is submitted to the API as the
     pageToken parameter, returning videos after the ones on the first "page".
+
+    If conditional is True `NotModified` is raised if the page is unchanged
+    since the last conditional request.
     '''
     # Fetch playlist-data from the API, without fetching extended info from the
     # API.
-    resp = requests.get(
-        'https://www.googleapis.com/youtube/v3/playlistItems', params={
-            'part': ','.join(parts),
-            'maxResults': 50,
-            'playlistId': playlistid,
-            'key': settings.YOUTUBE_API_KEY,
-            'pageToken': next_page_token,
-        }
-    )
-    resp.raise_for_status()
-    data = resp.json()
+    data = _get('playlistItems', {
+        'part': ','.join(parts),
+        'maxResults': 50,
+        'playlistId': playlistid,
+        'pageToken': next_page_token,
+    }, conditional=conditional)
 
     return data['items'], data.get('nextPageToken')
 
@@ -108,12 +287,8 @@ def fetch_videos(videoids, parts=('snippet', 'contentDetails', 'statistics')):
     '''
     Fetches and returns a dictlist of data, for the given iterable of videoids.
     '''
-    resp = requests.get(
-        'https://www.googleapis.com/youtube/v3/videos', params={
-            'part': ','.join(parts),
-            'id': ','.join(videoids),
-            'key': settings.YOUTUBE_API_KEY,
-        }
-    )
-    resp.raise_for_status()
-    return resp.json()['items']
+    data = _get('videos', {
+        'part': ','.join(parts),
+        'id': ','.join(videoids),
+    })
+    return data['items']